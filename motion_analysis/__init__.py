@@ -1,66 +1,22 @@
 import json
 import collections
+import numpy as np
 from vis_utils.scene.scene_object_builder import SceneObjectBuilder, SceneObject
 from vis_utils.scene.utils import get_random_color
 from anim_utils.animation_data import BVHReader, MotionVector, SkeletonBuilder
+from .annotation_intervals import create_intervals_from_sections, create_annotation_from_intervals
 
 
+def _sort_annotation(intervals, is_list=False):
+    """ orders the labels by their first frame and returns the annotation format of the animation controllers """
+    labels = sorted(intervals.keys(), key=lambda label: intervals[label][0][0] if len(intervals[label]) > 0 else np.inf)
+    return create_annotation_from_intervals(collections.OrderedDict((label, intervals[label]) for label in labels), is_list)
+
 def create_annotation_from_sections_list(sections, n_frames):
-    annotations = collections.OrderedDict()
-    for idx, section in enumerate(sections):
-        #print("section", label, section)
-        label = "c"+str(idx)# TODO store labels
-        indices_sections = []
-        if type(section) == list:
-            for sub_section in section:
-                start = sub_section["start_idx"]
-                end = sub_section["end_idx"]
-                if end == -1:
-                    end = n_frames-1
-                else:
-                    end += 1
-                frame_indices = list(range(start, end))
-                indices_sections.append(frame_indices)
-        else:
-            start = section["start_idx"]
-            end = section["end_idx"]
-            if end == -1:
-                end = n_frames-1
-            else:
-                end += 1
-            frame_indices = list(range(start, end))
-            indices_sections.append(frame_indices)
-        annotations[label] = indices_sections
-    #return annotations
-    return collections.OrderedDict(sorted(annotations.items(), key=lambda x: x[1][0][0]))
+    return _sort_annotation(create_intervals_from_sections(list(sections), n_frames), True)
 
 def create_annotation_from_sections_dict(sections, n_frames):
-    annotations = collections.OrderedDict()
-    for label, section in sections.items():
-        #print("section", label, section)
-        indices_sections = []
-        if type(section) == list:
-            for sub_section in section:
-                start = sub_section["start_idx"]
-                end = sub_section["end_idx"]
-                if end == -1:
-                    end = n_frames-1
-                else:
-                    end += 1
-                frame_indices = list(range(start, end))
-                indices_sections.append(frame_indices)
-        else:
-            start = section["start_idx"]
-            end = section["end_idx"]
-            if end == -1:
-                end = n_frames-1
-            else:
-                end += 1
-            frame_indices = list(range(start, end))
-            indices_sections.append(frame_indices)
-        annotations[label] = indices_sections
-    #return annotations
-    return collections.OrderedDict(sorted(annotations.items(), key=lambda x: x[1][0][0]))
+    return _sort_annotation(create_intervals_from_sections(dict(sections), n_frames))
 
 def get_bvh_from_str(bvh_str):
     bvh_reader = BVHReader("")
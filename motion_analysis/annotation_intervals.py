@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 DFKI GmbH.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the
+# following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+# NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE
+# USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Interval representation of semantic annotations.
+Each label maps to sorted, disjoint half-open sections [start, end) stored as two lists of start and end frames,
+so that the section of a frame is found by bisection instead of scanning the frame indices of all sections.
+Touching sections stay separate unless they are merged by an edit.
+The annotations used by the animation controllers map each label to a list of frame index lists
+and the meta information of a motion maps each label to a list of sections with inclusive start and end indices.
+The annotations are SectionAnnotations, which keep the end index -1, single sections and the list format
+of the meta information, so the sections are saved in the format they were loaded in.
+"""
+import bisect
+import collections
+import numpy as np
+
+
+class IntervalSet(object):
+    """ sorted disjoint sections of one label, overlapping sections are merged.
+        open_end is the end of a section that was given with the end index -1, i.e. until the end of the motion.
+        is_single_section is set if the meta information stored the section as a dict instead of a list.
+    """
+    def __init__(self, sections=None):
+        self.starts = []
+        self.ends = []
+        self.open_end = None
+        self.is_single_section = False
+        if sections is not None:
+            for start, end in sections:
+                self.add(start, end)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        return iter(zip(self.starts, self.ends))
+
+    def __getitem__(self, idx):
+        return self.starts[idx], self.ends[idx]
+
+    def copy(self):
+        s = IntervalSet()
+        s.starts = list(self.starts)
+        s.ends = list(self.ends)
+        s.open_end = self.open_end
+        s.is_single_section = self.is_single_section
+        return s
+
+    def clear(self):
+        self.starts = []
+        self.ends = []
+
+    def add(self, start, end, merge_touching=False):
+        if start >= end:
+            return
+        if merge_touching:
+            i = bisect.bisect_left(self.ends, start)
+            j = bisect.bisect_right(self.starts, end)
+        else:
+            i = bisect.bisect_right(self.ends, start)
+            j = bisect.bisect_left(self.starts, end)
+        if i < j:
+            start = min(start, self.starts[i])
+            end = max(end, self.ends[j-1])
+        self.starts[i:j] = [start]
+        self.ends[i:j] = [end]
+
+    def remove(self, start, end):
+        if start >= end:
+            return
+        i = bisect.bisect_right(self.ends, start)
+        j = bisect.bisect_left(self.starts, end)
+        if i >= j:
+            return
+        new_starts = []
+        new_ends = []
+        if self.starts[i] < start:
+            new_starts.append(self.starts[i])
+            new_ends.append(start)
+        if self.ends[j-1] > end:
+            new_starts.append(end)
+            new_ends.append(self.ends[j-1])
+        self.starts[i:j] = new_starts
+        self.ends[i:j] = new_ends
+
+    def merge_touching_sections(self):
+        starts = []
+        ends = []
+        for start, end in self:
+            if len(ends) > 0 and start <= ends[-1]:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        self.starts = starts
+        self.ends = ends
+
+    def pop(self, idx):
+        return self.starts.pop(idx), self.ends.pop(idx)
+
+    def find(self, frame_idx):
+        """ returns the index of the section that contains the frame or None """
+        i = bisect.bisect_right(self.starts, frame_idx) - 1
+        if i >= 0 and frame_idx < self.ends[i]:
+            return i
+        return None
+
+    def find_closest(self, frame_idx):
+        """ returns the index of the section with the frame closest to frame_idx and the distance or None and inf """
+        i = bisect.bisect_right(self.starts, frame_idx) - 1
+        closest_idx = None
+        delta = np.inf
+        if i >= 0:
+            closest_idx = i
+            delta = max(0, frame_idx - (self.ends[i] - 1))
+        if i + 1 < len(self.starts) and self.starts[i+1] - frame_idx < delta:
+            closest_idx = i + 1
+            delta = self.starts[i+1] - frame_idx
+        return closest_idx, delta
+
+    def get_frame_indices(self):
+        indices = []
+        for start, end in self:
+            indices += range(start, end)
+        return indices
+
+
+class SectionAnnotation(collections.OrderedDict):
+    """ annotation format of the animation controllers.
+        markers maps a label to the open end and the single section flag of its IntervalSet
+        and is_list is set if the sections were loaded from a list with the labels c0, c1, ...
+    """
+    def __init__(self, *args, **kwargs):
+        collections.OrderedDict.__init__(self, *args, **kwargs)
+        self.markers = dict()
+        self.is_list = False
+
+
+def create_interval_set_from_indices(sections):
+    """ converts a list of frame index lists or a single frame index list into sections of consecutive frames """
+    if len(sections) > 0 and np.ndim(sections[0]) == 0:
+        sections = [sections]
+    interval_set = IntervalSet()
+    for indices in sections:
+        if len(indices) == 0:
+            continue
+        indices = np.unique(np.asarray(indices, dtype=np.int64))
+        breaks = np.where(np.diff(indices) != 1)[0] + 1
+        starts = indices[np.concatenate([[0], breaks])]
+        ends = indices[np.concatenate([breaks - 1, [len(indices) - 1]])] + 1
+        for start, end in zip(starts, ends):
+            interval_set.add(int(start), int(end))
+    return interval_set
+
+
+def create_intervals_from_annotation(annotation):
+    markers = getattr(annotation, "markers", dict())
+    intervals = collections.OrderedDict()
+    for label, sections in annotation.items():
+        intervals[label] = create_interval_set_from_indices(sections)
+        if label in markers:
+            intervals[label].open_end, intervals[label].is_single_section = markers[label]
+    return intervals
+
+
+def create_annotation_from_intervals(intervals, is_list=False):
+    """ returns the annotation format of the animation controllers """
+    annotation = SectionAnnotation()
+    annotation.is_list = is_list
+    for label, interval_set in intervals.items():
+        annotation[label] = [list(range(start, end)) for start, end in interval_set]
+        if interval_set.open_end is not None or interval_set.is_single_section:
+            annotation.markers[label] = (interval_set.open_end, interval_set.is_single_section)
+    return annotation
+
+
+def _add_section_dict(interval_set, section, n_frames):
+    start = section["start_idx"]
+    end = section["end_idx"]
+    if end == -1:
+        end = n_frames
+        interval_set.open_end = n_frames
+    else:
+        end += 1
+    interval_set.add(start, end)
+
+
+def create_intervals_from_sections(sections, n_frames):
+    """ sections is either a dict that maps labels to one or a list of sections
+        or a list whose entries are one or a list of sections that get the labels c0, c1, ...
+        an end index of -1 marks a section that lasts until the end of the motion
+    """
+    if isinstance(sections, dict):
+        items = sections.items()
+    else:
+        items = [("c"+str(idx), section) for idx, section in enumerate(sections)]
+    intervals = collections.OrderedDict()
+    for label, section in items:
+        interval_set = IntervalSet()
+        if isinstance(section, list):
+            for sub_section in section:
+                _add_section_dict(interval_set, sub_section, n_frames)
+        else:
+            _add_section_dict(interval_set, section, n_frames)
+            interval_set.is_single_section = True
+        intervals[label] = interval_set
+    return intervals
+
+
+def create_sections_from_intervals(intervals, is_list=False):
+    """ returns the sections of the meta information with inclusive end indices or -1 for sections until the end
+        as a list if is_list is set and the labels are c0, c1, ... or otherwise as a dict
+    """
+    motion_sections = dict()
+    for label, interval_set in intervals.items():
+        motion_sections[label] = []
+        for start, end in interval_set:
+            end_idx = -1 if end == interval_set.open_end else end - 1
+            motion_sections[label].append({"start_idx": start, "end_idx": end_idx})
+        if interval_set.is_single_section and len(motion_sections[label]) == 1:
+            motion_sections[label] = motion_sections[label][0]
+    list_labels = ["c" + str(idx) for idx in range(len(motion_sections))]
+    if is_list and set(motion_sections.keys()) == set(list_labels):
+        return [motion_sections[label] for label in list_labels]
+    return motion_sections
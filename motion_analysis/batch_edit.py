@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 DFKI GmbH.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the
+# following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+# NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE
+# USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Applies a command history that was exported from the animation editor to many clips without the GUI.
+The clips are read from a directory, the local database cache or a collection of the motion database and
+are edited in parallel by the worker processes of a TaskScheduler, which receive the skeleton and
+the commands once when they are started. The edited clips are written into an output directory or replaced
+in the database, in which case their frames are removed from the local database cache afterwards.
+A dry run applies the commands without writing any clips.
+The report contains the time of each command per clip and the clips that were skipped or failed.
+It is written into the output directory or the file given by --report, also for a dry run.
+"""
+import os
+import json
+import time
+import argparse
+import bson
+import numpy as np
+from anim_utils.animation_data import BVHWriter, MotionVector
+from anim_utils.utilities.db_interface import get_motion_list_from_remote_db, replace_motion_in_db, load_skeleton_from_db
+from vis_utils.animation.animation_editor import AnimationEditorBase
+from .batch_retargeting import TaskScheduler, STATUS_DONE, load_motion_vector, iterate_clip_files, \
+                               iterate_cached_clips, load_skeleton, create_report
+from .motion_db.client import MotionDBClient
+
+OUTPUT_FORMATS = ["bvh", "bson", "npy"]
+REPORT_FILE = "edit_report.json"
+
+_clients = dict()
+
+
+def load_command_history(filename):
+    """ returns the list of function names and parameters saved by the animation editor """
+    with open(filename, "rt") as in_file:
+        data = json.load(in_file)
+    commands = []
+    for idx, command in enumerate(data):
+        if not isinstance(command, (list, tuple)) or len(command) != 2 or not isinstance(command[0], str):
+            raise ValueError("Command " + str(idx) + " is not a pair of function name and parameters")
+        commands.append((command[0], command[1]))
+    return commands
+
+
+def apply_command_history(skeleton, motion_vector, commands):
+    """ applies the commands in place and returns the duration of each command """
+    motion_vector.skeleton = skeleton
+    anim_editor = AnimationEditorBase(skeleton, motion_vector)
+    command_times = []
+    for idx, (func_name, params) in enumerate(commands):
+        start = time.time()
+        try:
+            anim_editor.apply_edit(func_name, params)
+        except Exception as e:
+            raise RuntimeError("Command " + str(idx) + " " + func_name + " failed: " + str(e))
+        command_times.append(time.time() - start)
+    return command_times
+
+
+def _get_client(db_url, session):
+    """ keeps one client per worker process so that the connection is reused for all motions of the worker """
+    if db_url not in _clients:
+        _clients[db_url] = MotionDBClient(db_url, session)
+    return _clients[db_url]
+
+
+def write_motion_file(skeleton, motion_vector, filename, out_format):
+    directory = os.path.dirname(filename)
+    if directory != "" and not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+    if out_format == "bvh":
+        bvh_writer = BVHWriter(None, skeleton, motion_vector.frames, motion_vector.frame_time, True)
+        bvh_writer.write(filename)
+    elif out_format == "bson":
+        with open(filename, "wb") as out_file:
+            out_file.write(bson.dumps(motion_vector.to_db_format()))
+    else:
+        np.save(filename, motion_vector.frames)
+
+
+def edit_clip_to_file_task(state, item, out_dir, out_format, dry_run=False, overwrite=False):
+    """ state is a tuple of the skeleton and the commands and item is a tuple of the relative output name and the source file
+        returns the number of frames, the time of each command and the time spent on loading and writing
+    """
+    skeleton, commands = state
+    name, filename = item
+    result = dict()
+    out_filename = os.path.join(out_dir, name + "." + out_format) if out_dir is not None else None
+    if out_filename is not None and not overwrite and os.path.isfile(out_filename):
+        result["n_frames"] = 0
+        result["skipped"] = "output exists"
+        return result
+    start = time.time()
+    motion_vector = load_motion_vector(filename)
+    result["load_time"] = time.time() - start
+    result["command_times"] = apply_command_history(skeleton, motion_vector, commands)
+    result["n_frames"] = len(motion_vector.frames)
+    start = time.time()
+    if not dry_run and out_filename is not None:
+        write_motion_file(skeleton, motion_vector, out_filename, out_format)
+    result["write_time"] = time.time() - start
+    return result
+
+
+def edit_motion_in_db_task(state, item, db_url, collection, skeleton_name, is_processed, session, dry_run=False):
+    """ item is a tuple of the name and the id of the motion which is replaced in the database """
+    skeleton, commands = state
+    name, motion_id = item
+    result = dict()
+    start = time.time()
+    motion_data = _get_client(db_url, session).get_motion(motion_id, is_processed)
+    if motion_data is None:
+        raise ValueError("Motion data of " + str(motion_id) + " is empty")
+    motion_vector = MotionVector()
+    motion_vector.from_custom_db_format(motion_data)
+    result["load_time"] = time.time() - start
+    result["command_times"] = apply_command_history(skeleton, motion_vector, commands)
+    result["n_frames"] = len(motion_vector.frames)
+    start = time.time()
+    if not dry_run:
+        replace_motion_in_db(db_url, motion_id, name, motion_vector.to_db_format(), collection, skeleton_name, None,
+                             is_processed=is_processed, session=session)
+    result["write_time"] = time.time() - start
+    return result
+
+
+def create_edit_report(results, duration, n_workers, commands, dry_run):
+    """ extends the retargeting report by the skipped clips and the total and mean time of each command """
+    report = create_report(results, duration, n_workers)
+    report["dry_run"] = dry_run
+    report["n_skipped"] = sum(1 for clip in report["clips"] if "skipped" in clip)
+    report["n_done"] -= report["n_skipped"]
+    report["clips_per_second"] = report["n_done"] / duration if duration > 0 else 0.0
+    command_times = np.zeros(len(commands))
+    n_edited = 0
+    for clip in report["clips"]:
+        if clip["status"] == STATUS_DONE and "command_times" in clip:
+            command_times += clip["command_times"]
+            n_edited += 1
+    report["commands"] = []
+    for idx, (func_name, params) in enumerate(commands):
+        command = dict()
+        command["name"] = func_name
+        command["total_time"] = float(command_times[idx])
+        command["mean_time"] = float(command_times[idx]) / n_edited if n_edited > 0 else 0.0
+        report["commands"].append(command)
+    return report
+
+
+def _run_batch_edit(skeleton, commands, items, task_func, task_args, n_workers, dry_run, progress_callback, report_file):
+    scheduler = TaskScheduler((skeleton, commands), task_func, task_args, n_workers, progress_callback, task_name="edit motion")
+    start = time.time()
+    results = scheduler.run(items)
+    report = create_edit_report(results, time.time() - start, scheduler.n_workers, commands, dry_run)
+    if report_file is not None:
+        with open(report_file, "wt") as out_file:
+            json.dump(report, out_file, indent=4)
+    print("edited", report["n_done"], "clips with", report["n_frames"], "frames in", report["duration"], "s,",
+          report["frames_per_second"], "frames/s,", report["n_skipped"], "skipped,", report["n_failed"], "failed")
+    for command in report["commands"]:
+        print(command["name"], command["mean_time"], "s per clip")
+    return report
+
+
+def edit_clips_to_directory(skeleton, commands, clips, out_dir, out_format="bvh", n_workers=None, dry_run=False,
+                            overwrite=False, progress_callback=None, report_file=None):
+    """ applies the commands to the clips given as tuples of name and file and writes the results and a report into out_dir
+        existing output files are skipped unless overwrite is set
+    """
+    if out_format not in OUTPUT_FORMATS:
+        raise ValueError("Unknown output format " + out_format)
+    if out_dir is not None:
+        if not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+        if report_file is None:
+            report_file = os.path.join(out_dir, REPORT_FILE)
+    task_args = (out_dir, out_format, dry_run, overwrite)
+    return _run_batch_edit(skeleton, commands, clips, edit_clip_to_file_task, task_args, n_workers, dry_run, progress_callback, report_file)
+
+
+def edit_collection_in_db(skeleton, commands, db_url, c_id, skeleton_name, is_processed=False, session=None,
+                          n_workers=None, dry_run=False, progress_callback=None, report_file=None):
+    """ applies the commands to all motions of a collection and replaces them in the database """
+    motion_list = get_motion_list_from_remote_db(db_url, c_id, skeleton_name, is_processed, session)
+    if motion_list is None:
+        print("could not find motions")
+        motion_list = []
+    items = [(name, motion_id) for motion_id, name in motion_list]
+    task_args = (db_url, c_id, skeleton_name, is_processed, session, dry_run)
+    report = _run_batch_edit(skeleton, commands, items, edit_motion_in_db_task, task_args, n_workers, dry_run, progress_callback, report_file)
+    if not dry_run:
+        invalidate_cached_motions(db_url, report, session)
+    return report
+
+
+def invalidate_cached_motions(db_url, report, session=None):
+    """ removes the frames of the replaced motions from the local cache, which the worker processes cannot update """
+    from motion_analysis.motion_db.cache import CachedMotionDB
+    db = CachedMotionDB(db_url, session)
+    for clip in report["clips"]:
+        if clip["status"] == STATUS_DONE:
+            db.invalidate_motion_data(clip["source"])
+    db.close()
+
+
+def main():
+    from motion_analysis import constants
+    from motion_analysis.session_manager import SessionManager
+    from motion_analysis.motion_db.cache import get_local_cache
+    parser = argparse.ArgumentParser(description="Apply a command history of the animation editor to many clips.")
+    parser.add_argument("commands", help="json file with the command history exported by the animation editor")
+    parser.add_argument("source", help="directory with bvh or bson files, 'cache' for the motions in the local database cache or 'db' for a collection")
+    parser.add_argument("skeleton", help="bvh or json file or name of a local, cached or database skeleton")
+    parser.add_argument("--out_dir", default=None, help="output directory, required unless the source is 'db' or --dry_run is set")
+    parser.add_argument("--skeleton_model", default=None, help="name of the local skeleton model of the skeleton")
+    parser.add_argument("--format", default="bvh", choices=OUTPUT_FORMATS, help="output format")
+    parser.add_argument("--collection", type=int, default=None, help="collection id of the motions that are replaced in the database")
+    parser.add_argument("--processed", action="store_true", help="use the processed motions of the cache or the database")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes, by default the number of cores")
+    parser.add_argument("--dry_run", action="store_true", help="apply the commands without writing the results")
+    parser.add_argument("--overwrite", action="store_true", help="overwrite existing output files")
+    parser.add_argument("--report", default=None, help="report file, by default edit_report.json in the output directory")
+    parser.add_argument("--url", default=None, help="url of the motion database")
+    args = parser.parse_args()
+    if os.path.isfile(constants.CONFIG_FILE):
+        constants.set_constants_from_file(constants.CONFIG_FILE)
+    db_url = args.url if args.url is not None else constants.DB_URL
+    commands = load_command_history(args.commands)
+    if args.source == "db":
+        if args.collection is None:
+            parser.error("--collection is required for the database")
+        session = SessionManager().session
+        skeleton = load_skeleton_from_db(db_url, args.skeleton, session)
+        if skeleton is None:
+            raise ValueError("Could not find skeleton " + args.skeleton)
+        report = edit_collection_in_db(skeleton, commands, db_url, args.collection, args.skeleton, args.processed, session,
+                                       args.workers, args.dry_run, report_file=args.report)
+    else:
+        if args.out_dir is None and not args.dry_run:
+            parser.error("--out_dir is required unless --dry_run is set")
+        cache = get_local_cache()
+        skeleton = load_skeleton(args.skeleton, args.skeleton_model, db_url, cache)
+        if args.source == "cache":
+            clips = list(iterate_cached_clips(cache, db_url, args.processed))
+        else:
+            clips = list(iterate_clip_files(args.source))
+        report = edit_clips_to_directory(skeleton, commands, clips, args.out_dir, args.format, args.workers,
+                                         args.dry_run, args.overwrite, report_file=args.report)
+    if report["n_failed"] > 0:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
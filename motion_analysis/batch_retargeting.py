@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 DFKI GmbH.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the
+# following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+# NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE
+# USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Scheduler for retargeting many motions in parallel.
+Each worker process receives the state of the task, e.g. the Retargeting object, once when it is started and then takes
+single motions from a shared task queue, so that fast workers continue with the remaining motions.
+The results are reported per motion from a background thread and the remaining motions can be cancelled.
+The motions are either retargeted in the motion database or read from a directory or the local database cache
+and written into an output directory, which also works without a connection to the database.
+"""
+import os
+import json
+import time
+import argparse
+import threading
+import traceback
+import multiprocessing
+from multiprocessing import cpu_count
+import numpy as np
+import bson
+from anim_utils.animation_data import BVHReader, BVHWriter, MotionVector, SkeletonBuilder
+from anim_utils.retargeting.analytical import Retargeting, generate_joint_map
+from anim_utils.utilities.db_interface import retarget_motion_in_db
+
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+CLIP_FILE_TYPES = [".bvh", ".bson"]
+OUTPUT_FORMATS = ["bvh", "npy"]
+REPORT_FILE = "retargeting_report.json"
+
+_worker_state = dict()
+
+
+def _init_worker(state, task_func, task_args, cancel_event):
+    _worker_state["state"] = state
+    _worker_state["task_func"] = task_func
+    _worker_state["task_args"] = task_args
+    _worker_state["cancel_event"] = cancel_event
+
+
+def _run_task(item):
+    """ returns the item, the status, the result or the error message and the duration """
+    if _worker_state["cancel_event"].is_set():
+        return item, STATUS_CANCELLED, None, 0.0
+    start = time.time()
+    try:
+        result = _worker_state["task_func"](_worker_state["state"], item, *_worker_state["task_args"])
+        return item, STATUS_DONE, result, time.time() - start
+    except Exception:
+        return item, STATUS_FAILED, traceback.format_exc(), time.time() - start
+
+
+def retarget_motion_in_db_task(retargeting, item, db_url, collection, target_skeleton_name, is_aligned, session):
+    motion_id, motion_name = item
+    retarget_motion_in_db(db_url, retargeting, motion_id, motion_name, collection, target_skeleton_name, is_aligned, session=session)
+
+
+class TaskScheduler(object):
+    """ calls task_func(state, item, *task_args) for each item in a pool of worker processes
+        state is sent to each worker once when it is started
+        progress_callback is called with the number of finished items, the number of items, the item, the status and the result or error
+        finished_callback is called with the list of results
+        both callbacks are called from the thread that collects the results
+        task_name is used for the progress output
+    """
+    def __init__(self, state, task_func, task_args=(), n_workers=None, progress_callback=None, finished_callback=None, task_name="retarget motion"):
+        self.state = state
+        self.task_name = task_name
+        self.task_func = task_func
+        self.task_args = task_args
+        if n_workers is None:
+            n_workers = cpu_count()
+        self.n_workers = max(1, n_workers)
+        self.progress_callback = progress_callback
+        self.finished_callback = finished_callback
+        self.cancel_event = multiprocessing.Event()
+        self.thread = None
+        self.results = []
+
+    def run(self, items):
+        """ blocks until all items are processed and returns a list of tuples of item, status, result and duration """
+        items = list(items)
+        self.results = []
+        self.cancel_event.clear()
+        if len(items) == 0:
+            return self.results
+        n_workers = min(self.n_workers, len(items))
+        init_args = (self.state, self.task_func, self.task_args, self.cancel_event)
+        pool = multiprocessing.Pool(n_workers, _init_worker, init_args)
+        try:
+            # chunksize 1 so that each worker only takes the next motion when it is idle
+            for result in pool.imap_unordered(_run_task, items, chunksize=1):
+                self.results.append(result)
+                item, status, value, duration = result
+                if status == STATUS_FAILED:
+                    print("Error:", self.task_name, item, "failed", value)
+                else:
+                    print(self.task_name, str(len(self.results))+"/"+str(len(items)), item, status)
+                if self.progress_callback is not None:
+                    self.progress_callback(len(self.results), len(items), item, status, value)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        if self.finished_callback is not None:
+            self.finished_callback(self.results)
+        return self.results
+
+    def start(self, items):
+        """ processes the items in the background and returns immediately """
+        self.thread = threading.Thread(target=self.run, args=(list(items),))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def cancel(self):
+        """ motions that were already started are finished, all others are skipped """
+        self.cancel_event.set()
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        return self.results
+
+
+def load_motion_vector(filename):
+    """ returns a MotionVector of a bvh file or of a motion in the database format stored as bson """
+    motion_vector = MotionVector()
+    if filename.endswith(".bvh"):
+        bvh_reader = BVHReader(filename)
+        motion_vector.from_bvh_reader(bvh_reader, False)
+        motion_vector.frame_time = bvh_reader.frame_time
+        return motion_vector
+    with open(filename, "rb") as in_file:
+        motion_data = bson.loads(in_file.read())
+    motion_vector.from_custom_db_format(motion_data)
+    return motion_vector
+
+
+def load_motion_file(filename):
+    """ returns the frames and the frame time of a bvh file or of a motion in the database format stored as bson """
+    motion_vector = load_motion_vector(filename)
+    return motion_vector.frames, motion_vector.frame_time
+
+
+def retarget_clip_to_file_task(retargeting, item, out_dir, out_format):
+    """ item is a tuple of the relative output name and the source file
+        returns the number of frames and the time spent on loading, retargeting and writing
+    """
+    name, filename = item
+    start = time.time()
+    frames, frame_time = load_motion_file(filename)
+    load_time = time.time() - start
+    start = time.time()
+    new_frames = np.array([retargeting.retarget_frame(frame, None) for frame in frames])
+    retarget_time = time.time() - start
+    start = time.time()
+    out_filename = os.path.join(out_dir, name + "." + out_format)
+    directory = os.path.dirname(out_filename)
+    if not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+    if out_format == "bvh":
+        bvh_writer = BVHWriter(None, retargeting.target_skeleton, new_frames, frame_time, True)
+        bvh_writer.write(out_filename)
+    else:
+        np.save(out_filename, new_frames)
+    write_time = time.time() - start
+    result = dict()
+    result["n_frames"] = len(new_frames)
+    result["load_time"] = load_time
+    result["retarget_time"] = retarget_time
+    result["write_time"] = write_time
+    return result
+
+
+def iterate_clip_files(directory):
+    """ yields the relative name without extension and the path of the bvh and bson files in the directory and its sub directories """
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for filename in sorted(files):
+            base_name, ext = os.path.splitext(filename)
+            if ext in CLIP_FILE_TYPES:
+                name = os.path.relpath(os.path.join(root, base_name), directory)
+                yield name, os.path.join(root, filename)
+
+
+def iterate_cached_clips(cache, db_url=None, is_processed=False):
+    """ yields a name and the file of each motion in the local database cache, optionally only for one database """
+    data_type = "|motion" + str(int(is_processed)) + "|"
+    prefix = db_url + data_type if db_url is not None else ""
+    for key in sorted(cache.get_keys(prefix)):
+        if data_type not in key:
+            continue
+        filename = cache.get_object_path(key)
+        if filename is not None:
+            yield "motion_" + key.split("|")[-1], filename
+
+
+def load_skeleton(name, skeleton_model=None, db_url=None, cache=None):
+    """ loads a skeleton from a bvh file, a json file with a skeleton and a model as written by the skeleton editor,
+        a local skeleton model or a skeleton in the local database cache.
+        The model of a local skeleton with the name skeleton_model is used if it is not a dict.
+    """
+    from motion_analysis import constants
+    if skeleton_model is not None and not isinstance(skeleton_model, dict):
+        skeleton_model = constants.LOCAL_SKELETON_MODELS[skeleton_model]["model"]
+    data = None
+    if os.path.isfile(name) and name.endswith(".bvh"):
+        bvh_reader = BVHReader(name)
+        animated_joints = [key for key in list(bvh_reader.node_names.keys()) if not key.endswith("EndSite")]
+        skeleton = SkeletonBuilder().load_from_bvh(bvh_reader, animated_joints)
+        skeleton.skeleton_model = skeleton_model
+        return skeleton
+    elif os.path.isfile(name):
+        with open(name, "rt") as in_file:
+            data = json.load(in_file)
+    elif name in constants.LOCAL_SKELETON_MODELS:
+        data = constants.LOCAL_SKELETON_MODELS[name]
+    elif cache is not None and db_url is not None:
+        entry = cache.get(db_url + "|skeleton|" + name)
+        if entry is not None:
+            data = json.loads(entry[0].decode("utf-8"))
+    if data is None:
+        raise ValueError("Could not find skeleton " + name)
+    if "skeleton" in data:
+        skeleton = SkeletonBuilder().load_from_custom_unity_format(data["skeleton"])
+        if skeleton_model is None:
+            skeleton_model = data.get("model")
+    else:
+        skeleton = SkeletonBuilder().load_from_custom_unity_format(data)
+    if skeleton_model is None:
+        skeleton_model = data.get("skeleton_model")
+    if skeleton_model is None:
+        raise ValueError("No skeleton model for skeleton " + name)
+    skeleton.skeleton_model = skeleton_model
+    return skeleton
+
+
+def create_report(results, duration, n_workers):
+    """ returns per clip timings and the throughput of the run """
+    report = dict()
+    report["n_workers"] = n_workers
+    report["duration"] = duration
+    report["clips"] = []
+    n_frames = 0
+    n_failed = 0
+    for item, status, value, clip_duration in results:
+        clip = dict()
+        clip["name"] = item[0]
+        clip["source"] = item[1]
+        clip["status"] = status
+        clip["duration"] = clip_duration
+        if status == STATUS_DONE:
+            clip.update(value)
+            n_frames += value["n_frames"]
+        elif status == STATUS_FAILED:
+            clip["error"] = value
+            n_failed += 1
+        report["clips"].append(clip)
+    n_done = len(results) - n_failed - sum(1 for r in results if r[1] == STATUS_CANCELLED)
+    report["n_clips"] = len(results)
+    report["n_done"] = n_done
+    report["n_failed"] = n_failed
+    report["n_frames"] = n_frames
+    report["clips_per_second"] = n_done / duration if duration > 0 else 0.0
+    report["frames_per_second"] = n_frames / duration if duration > 0 else 0.0
+    return report
+
+
+def retarget_clips_to_directory(retargeting, clips, out_dir, out_format="bvh", n_workers=None, progress_callback=None):
+    """ retargets the clips given as tuples of name and file in parallel and writes the results and a report into out_dir """
+    if out_format not in OUTPUT_FORMATS:
+        raise ValueError("Unknown output format " + out_format)
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    scheduler = TaskScheduler(retargeting, retarget_clip_to_file_task, (out_dir, out_format),
+                              n_workers, progress_callback)
+    start = time.time()
+    results = scheduler.run(clips)
+    report = create_report(results, time.time() - start, scheduler.n_workers)
+    with open(os.path.join(out_dir, REPORT_FILE), "wt") as out_file:
+        json.dump(report, out_file, indent=4)
+    print("retargeted", report["n_done"], "clips with", report["n_frames"], "frames in", report["duration"], "s,",
+          report["clips_per_second"], "clips/s,", report["frames_per_second"], "frames/s,", report["n_failed"], "failed")
+    return report
+
+
+def main():
+    from motion_analysis import constants
+    from motion_analysis.motion_db.cache import get_local_cache
+    parser = argparse.ArgumentParser(description="Retarget bvh or bson files or the motions in the local database cache and write them into a directory.")
+    parser.add_argument("source", help="directory with source clips or 'cache' for the motions in the local database cache")
+    parser.add_argument("src_skeleton", help="bvh or json file or name of a local or cached skeleton")
+    parser.add_argument("target_skeleton", help="bvh or json file or name of a local or cached skeleton")
+    parser.add_argument("out_dir", help="output directory")
+    parser.add_argument("--src_model", default=None, help="name of the local skeleton model of the source skeleton")
+    parser.add_argument("--target_model", default=None, help="name of the local skeleton model of the target skeleton")
+    parser.add_argument("--scale", type=float, default=1.0, help="scale factor of the source skeleton")
+    parser.add_argument("--place_on_ground", action="store_true", help="move the root so that the feet touch the ground")
+    parser.add_argument("--format", default="bvh", choices=OUTPUT_FORMATS, help="output format")
+    parser.add_argument("--processed", action="store_true", help="use the processed motions of the cache")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes, by default the number of cores")
+    parser.add_argument("--url", default=None, help="url of the motion database whose cached data is used")
+    args = parser.parse_args()
+    if os.path.isfile(constants.CONFIG_FILE):
+        constants.set_constants_from_file(constants.CONFIG_FILE)
+    db_url = args.url if args.url is not None else constants.DB_URL
+    cache = get_local_cache()
+    src_skeleton = load_skeleton(args.src_skeleton, args.src_model, db_url, cache)
+    target_skeleton = load_skeleton(args.target_skeleton, args.target_model, db_url, cache)
+    joint_map = generate_joint_map(src_skeleton.skeleton_model, target_skeleton.skeleton_model)
+    retargeting = Retargeting(src_skeleton, target_skeleton, joint_map, args.scale, additional_rotation_map=None, place_on_ground=args.place_on_ground)
+    if args.source == "cache":
+        clips = list(iterate_cached_clips(cache, db_url, args.processed))
+    else:
+        clips = list(iterate_clip_files(args.source))
+    report = retarget_clips_to_directory(retargeting, clips, args.out_dir, args.format, args.workers)
+    if report["n_failed"] > 0:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -17,6 +17,8 @@ K8S_IMAGE_NAME = "python:3.5.3"
 MG_REPO_URL = "https://iceland.sb.dfki.de/bitbucket/scm/motsy/mosi_dev_mg.git"
 MG_EXEC_DIR= "mosi_dev_mg/python_src"
 LOCAL_SKELETON_MODELS = collections.OrderedDict()
+DB_CACHE_SIZE = 2 * 1024**3
+DB_CACHE_MAX_AGE = 24 * 60 * 60
 
 def set_constants_from_file(filename):
     import json
@@ -26,6 +28,8 @@ def set_constants_from_file(filename):
     global MG_REPO_URL
     global MG_EXEC_DIR
     global K8S_IMAGE_NAME
+    global DB_CACHE_SIZE
+    global DB_CACHE_MAX_AGE
     vis_constants.activate_simulation = True
     vis_constants.use_frame_buffer = True
     vis_constants.activate_shadows = True
@@ -48,6 +52,10 @@ def set_constants_from_file(filename):
         MG_EXEC_DIR = config["mg_exec_dir"]
     if "k8s_image_name" in config:
         K8S_IMAGE_NAME = config["k8s_image_name"]
+    if "db_cache_size" in config:
+        DB_CACHE_SIZE = config["db_cache_size"]
+    if "db_cache_max_age" in config:
+        DB_CACHE_MAX_AGE = config["db_cache_max_age"]
     
     if not os.path.isdir(DATA_DIR):
         try:
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 DFKI GmbH.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the
+# following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+# NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE
+# USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Copies the values of selected joints from a range of a source motion into a range of a destination motion.
+The source range is retimed to the length of the destination range with a cubic spline that is evaluated
+for all frames at once and the transitions at the borders of the destination range are blended with
+a slerp that is applied to all selected joints at once, so that the same copy can be applied to many motions.
+"""
+import numpy as np
+from scipy.interpolate import CubicSpline
+from anim_utils.animation_data.motion_blending import smooth_translation_in_quat_frames
+
+SLERP_EPS = np.finfo(float).eps * 4.0
+
+
+def get_joint_parameter_indices(skeleton, joint_list):
+    """ returns the indices of the translation and rotation parameters of the root and the rotation parameters of the other joints """
+    joint_index_list = []
+    for joint_name in joint_list:
+        if joint_name == skeleton.root:
+            offset = 0
+            n_channels = 7
+        else:
+            offset = skeleton.nodes[joint_name].quaternion_frame_index * 4 + 3
+            n_channels = 4
+        joint_index_list += list(range(offset, offset+n_channels))
+    return joint_index_list
+
+
+def stretch_frames(frames, n_dest_frames):
+    """ fits a cubic spline to the frames and evaluates it at n_dest_frames equally spaced times in one call """
+    frames = np.asarray(frames, dtype=np.float64)
+    n_frames = len(frames)
+    if n_frames < 2:
+        return np.repeat(frames[:1], n_dest_frames, axis=0)
+    spline = CubicSpline(np.arange(n_frames), frames, axis=0)
+    step_size = (n_frames-1)/n_dest_frames
+    return spline(np.arange(n_dest_frames) * step_size)
+
+
+def slerp_quaternions(q0, q1, t):
+    """ spherical linear interpolation along the shortest path of arrays of quaternions with the shape (..., 4)
+        t is broadcast against the leading dimensions
+    """
+    q0 = q0 / np.linalg.norm(q0, axis=-1, keepdims=True)
+    q1 = q1 / np.linalg.norm(q1, axis=-1, keepdims=True)
+    t = np.asarray(t, dtype=np.float64)[..., None]
+    d = np.sum(q0 * q1, axis=-1, keepdims=True)
+    shortest_q1 = np.where(d < 0.0, -q1, q1)
+    d = np.abs(d)
+    angle = np.arccos(np.clip(d, -1.0, 1.0))
+    is_close = (np.abs(d - 1.0) < SLERP_EPS) | (np.abs(angle) < SLERP_EPS)
+    sin_angle = np.where(is_close, 1.0, np.sin(angle))
+    w0 = np.where(is_close, 1.0, np.sin((1.0 - t) * angle) / sin_angle)
+    w1 = np.where(is_close, 0.0, np.sin(t * angle) / sin_angle)
+    result = w0 * q0 + w1 * shortest_q1
+    result = np.where(t == 0.0, q0, result)
+    return np.where(t == 1.0, q1, result)
+
+
+def blend_quaternion_transition(frames, q_indices, start_frame, end_frame, steps, forward=True):
+    """ blends the quaternions of all joints in q_indices with the shape n_joints x 4 between start_frame and start_frame+steps
+        towards a slerp from the pose at start_frame to the pose at end_frame
+    """
+    t = np.arange(steps) / steps
+    start_q = frames[start_frame, q_indices]
+    end_q = frames[end_frame, q_indices]
+    new_q = slerp_quaternions(start_q[None], end_q[None], t[:, None])
+    if forward:
+        weights = t
+    else:
+        weights = 1.0 - t
+    old_q = frames[start_frame:start_frame+steps][:, q_indices]
+    frames[start_frame:start_frame+steps, q_indices] = slerp_quaternions(old_q, new_q, weights[:, None])
+    return frames
+
+
+def copy_joint_values(src_frames, dest_frames, joint_index_list, src_start, src_end, dest_start, dest_end):
+    """ returns a copy of dest_frames in which the parameters in joint_index_list of the frames from dest_start to dest_end
+        are replaced by the frames from src_start to src_end retimed to the length of the destination range
+    """
+    n_copied_frames = src_end - src_start
+    n_dest_frames = dest_end - dest_start
+    modified_frames = np.array(dest_frames)
+    src_frames = np.asarray(src_frames)
+    if n_copied_frames > 1:
+        copied_frames = stretch_frames(src_frames[src_start:src_end], n_dest_frames)
+    else:
+        copied_frames = np.repeat(src_frames[src_start:src_start+1], n_dest_frames, axis=0)
+    joint_index_list = np.asarray(joint_index_list, dtype=np.int64)
+    modified_frames[dest_start:dest_end, joint_index_list] = copied_frames[:, joint_index_list]
+    return modified_frames
+
+
+def apply_blending(skeleton, frames, joint_list, joint_index_list, dest_start, dest_end, n_blend_range):
+    """ smooths the transitions into and out of the frames from dest_start to dest_end (inclusive) for the joints in joint_list """
+    n_frames = len(frames)
+    blend_start = max(dest_start - n_blend_range, 0)
+    start_window = dest_start - blend_start
+    blend_end = min(dest_end + n_blend_range, n_frames-1)
+    end_window = blend_end - dest_end
+    quat_joint_index_list = list(joint_index_list)
+    if skeleton.root in joint_list:
+        # apply root smoothing and remove the translation from the index list
+        if start_window > 0:
+            frames = smooth_translation_in_quat_frames(frames, dest_start, start_window)
+        if end_window > 0:
+            frames = smooth_translation_in_quat_frames(frames, dest_end, end_window)
+        for i in range(3):
+            quat_joint_index_list.remove(i)
+    if len(quat_joint_index_list) > 0:
+        q_indices = np.array(quat_joint_index_list, dtype=np.int64).reshape(-1, 4)
+        if start_window > 0:
+            frames = blend_quaternion_transition(frames, q_indices, blend_start, dest_start, start_window, forward=True)
+        if end_window > 0:
+            frames = blend_quaternion_transition(frames, q_indices, dest_end, blend_end, end_window, forward=False)
+    return frames
+
+
+def copy_motion_range(skeleton, src_frames, dest_frames, joint_list, src_start, src_end, dest_start, dest_end, n_blend_range=0):
+    """ copies the joints in joint_list from the frames src_start to src_end into the frames dest_start to dest_end (exclusive)
+        and blends n_blend_range frames before and after the destination range
+    """
+    joint_index_list = get_joint_parameter_indices(skeleton, joint_list)
+    frames = copy_joint_values(src_frames, dest_frames, joint_index_list, src_start, src_end, dest_start, dest_end)
+    if n_blend_range > 0 and len(joint_list) > 0:
+        frames = apply_blending(skeleton, frames, joint_list, joint_index_list, dest_start, dest_end-1, n_blend_range)
+    return frames
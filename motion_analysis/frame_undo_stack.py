@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 DFKI GmbH.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the
+# following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+# NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE
+# USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Undo and redo of frame edits that stores only the changed values.
+Each edit is recorded as the smallest frame range and the set of channels that differ from the previous state,
+together with their old and new values. Edits that change the number of frames store all frames.
+Consecutive edits of the same range and channels are merged and the oldest edits are dropped when the
+stored values exceed the memory budget. Each edit also keeps the editor commands that caused it,
+so that the command history can follow undo and redo.
+"""
+import time
+import numpy as np
+
+UNDO_MEMORY_BUDGET = 256 * 1024**2
+COALESCE_TIME = 1.0
+# frame copies that the vis_utils animation editor keeps for its own undo, which is replaced by FrameUndoStack
+EDITOR_SNAPSHOT_ATTRIBUTE = "motion_backup"
+
+
+class FrameDelta(object):
+    """ old and new values of the channels in columns for the frames from start to end with exclusive end.
+        If resized is True, old_values and new_values contain all frames and columns is None.
+    """
+    def __init__(self, start, end, columns, old_values, new_values, resized=False):
+        self.start = start
+        self.end = end
+        self.columns = columns
+        self.old_values = old_values
+        self.new_values = new_values
+        self.resized = resized
+        self.time = time.time()
+        self.commands = []
+
+    @property
+    def nbytes(self):
+        return self.old_values.nbytes + self.new_values.nbytes
+
+    def has_same_region(self, other):
+        return not self.resized and not other.resized and self.start == other.start and self.end == other.end \
+            and np.array_equal(self.columns, other.columns)
+
+    def get_values(self, undo=False):
+        return self.old_values if undo else self.new_values
+
+    def apply(self, frames, undo=False):
+        """ writes the values into frames and returns the frames, which are replaced if the number of frames changed """
+        values = self.get_values(undo)
+        if self.resized:
+            return np.array(values)
+        frames[self.start:self.end, self.columns] = values
+        return frames
+
+
+def compute_frame_delta(frames, new_frames):
+    """ returns the delta between two frame arrays or None if they are equal """
+    new_frames = np.asarray(new_frames)
+    if frames.shape != new_frames.shape:
+        return FrameDelta(0, len(new_frames), None, frames.copy(), np.array(new_frames, dtype=frames.dtype), True)
+    changed = frames != new_frames
+    rows = np.flatnonzero(changed.any(axis=1))
+    if len(rows) == 0:
+        return None
+    columns = np.flatnonzero(changed.any(axis=0))
+    start, end = int(rows[0]), int(rows[-1]) + 1
+    old_values = frames[start:end, columns]
+    new_values = new_frames[start:end, columns].astype(frames.dtype)
+    return FrameDelta(start, end, columns, old_values, new_values)
+
+
+class FrameUndoStack(object):
+    """ keeps one copy of the current frames to compute the changes of each edit """
+    def __init__(self, frames, memory_budget=UNDO_MEMORY_BUDGET, coalesce_time=COALESCE_TIME):
+        self.frames = np.array(frames, dtype=np.float64)
+        self.memory_budget = memory_budget
+        self.coalesce_time = coalesce_time
+        self.undo_deltas = []
+        self.redo_deltas = []
+        self.nbytes = 0
+
+    def record(self, new_frames, commands=None, coalesce=True):
+        """ stores the changes compared to the current frames and returns the delta or None if nothing changed """
+        delta = compute_frame_delta(self.frames, new_frames)
+        if delta is None:
+            return None
+        if commands is not None:
+            delta.commands = list(commands)
+        self.frames = delta.apply(self.frames)
+        for d in self.redo_deltas:
+            self.nbytes -= d.nbytes
+        self.redo_deltas = []
+        prev_delta = self.undo_deltas[-1] if len(self.undo_deltas) > 0 else None
+        if coalesce and prev_delta is not None and prev_delta.has_same_region(delta) \
+                and delta.time - prev_delta.time < self.coalesce_time:
+            # keep the values before the first edit and the values after the last edit
+            prev_delta.new_values = delta.new_values
+            prev_delta.time = delta.time
+            prev_delta.commands += delta.commands
+        else:
+            self.undo_deltas.append(delta)
+            self.nbytes += delta.nbytes
+        self._drop_old_deltas()
+        return delta
+
+    def _drop_old_deltas(self):
+        """ the latest edit is kept even if it exceeds the budget """
+        while self.nbytes > self.memory_budget and len(self.undo_deltas) > 1:
+            self.nbytes -= self.undo_deltas.pop(0).nbytes
+
+    def can_undo(self):
+        return len(self.undo_deltas) > 0
+
+    def can_redo(self):
+        return len(self.redo_deltas) > 0
+
+    def undo(self):
+        """ restores the frames before the last edit and returns its delta or None """
+        if not self.can_undo():
+            return None
+        delta = self.undo_deltas.pop()
+        self.frames = delta.apply(self.frames, undo=True)
+        self.redo_deltas.append(delta)
+        return delta
+
+    def redo(self):
+        if not self.can_redo():
+            return None
+        delta = self.redo_deltas.pop()
+        self.frames = delta.apply(self.frames)
+        self.undo_deltas.append(delta)
+        return delta
+
+    def clear(self):
+        self.undo_deltas = []
+        self.redo_deltas = []
+        self.nbytes = 0
+
+
+def clear_frame_snapshots(animation_editor):
+    """ removes the copies of the frames that the vis_utils animation editor keeps for its own undo after each edit
+        raises an AttributeError if the editor does not have EDITOR_SNAPSHOT_ATTRIBUTE
+    """
+    if not hasattr(animation_editor, EDITOR_SNAPSHOT_ATTRIBUTE):
+        raise AttributeError(type(animation_editor).__name__ + " has no attribute " + EDITOR_SNAPSHOT_ATTRIBUTE +
+                             ", update EDITOR_SNAPSHOT_ATTRIBUTE for this version of vis_utils")
+    snapshots = getattr(animation_editor, EDITOR_SNAPSHOT_ATTRIBUTE)
+    if isinstance(snapshots, list):
+        del snapshots[:]
+    else:
+        setattr(animation_editor, EDITOR_SNAPSHOT_ATTRIBUTE, None)
+
+
+def replace_changed_frames(controller, delta, frames, undo=False):
+    """ writes only the changed values of the delta into the frames of an animation controller
+        a copy of all frames is used if the number of frames changed or the controller does not store an array with the same shape
+    """
+    controller_frames = controller._motion.mv.frames
+    if not delta.resized and isinstance(controller_frames, np.ndarray) and controller_frames.shape == frames.shape:
+        delta.apply(controller_frames, undo)
+    else:
+        controller.replace_frames(np.array(frames))
@@ -28,18 +28,32 @@
 import sys
 import time
 import math
+import threading
+import collections
+import traceback
 from PySide2.QtCore import QObject, QTimer, Qt
+from PySide2.QtGui import QMouseEvent
+from PySide2.QtWidgets import QApplication
 from PySignal import Signal
 from vis_utils.scene.editor_scene import EditorScene
 from OpenGL.GL import *
 from vis_utils.scene.scene_interaction import SceneInteraction, INTERACTION_DEFINE_SPLINE, INTERACTION_NONE, INTERACTION_DEFINE_MARKER
 from vis_utils import constants
+from .render_scheduler import RenderScheduler
+from .simulation_thread import SimulationThread, PoseSnapshotBuffer, PhaseTimings, step_scene, attach_controllers, \
+                               detach_controllers
 if constants.activate_simulation:
     from physics_utils.sim import SimWorld
 
 class ApplicationManager(QObject):
     """ main application logic
     controls the updates to the scene done by the main thread via a Qt.QTimer event
+    or, in the threaded update mode, by a SimulationThread that advances the animation controllers with a fixed time step
+    while the timer writes their poses into the visualizations, updates the other objects and renders.
+    The physics simulation is not stepped in the threaded update mode.
+    in the threaded update mode, changes of the scene by the GUI have to be made via run_in_scene,
+    e.g. loading files, creating or deleting objects and mouse interaction. The simulation thread is also
+    paused while a modal dialog is open. Object widgets may only change attributes of the controllers.
     holds the reference to the server thread
     "singleton class" by calling convention #http://stackoverflow.com/questions/31875/is-there-a-simple-elegant-way-to-define-singletons-in-python/33201#33201
     """
@@ -68,6 +82,14 @@ class ApplicationManager(QObject):
             self.scene = None
             self.graphics_widget = graphics_widget
             self.interaction = SceneInteraction()
+            self.render_scheduler = RenderScheduler()
+            self.scene_lock = threading.RLock()
+            self.pose_buffer = PoseSnapshotBuffer()
+            self.phase_timings = PhaseTimings()
+            self.phase_averages = self.phase_timings.get_averages()
+            self.simulation_thread = None
+            self._queued_signals = collections.deque()
+            self._scene_calls = collections.deque()
             self.timer = QTimer()
             self.timer.timeout.connect(self.update)
             self.timer.start(0)
@@ -107,6 +129,11 @@ class ApplicationManager(QObject):
         print("init scene")
 
     def on_mouse_click(self, event, ray_start, ray_dir, pos, node_id):
+        # the event is copied because Qt deletes it before a queued call is run
+        event = QMouseEvent(event.type(), event.localPos(), event.button(), event.buttons(), event.modifiers())
+        self.run_in_scene(self.handle_mouse_click, event, ray_start, ray_dir, pos, node_id)
+
+    def handle_mouse_click(self, event, ray_start, ray_dir, pos, node_id):
         self.interaction.handleMouseClick(event, ray_start, ray_dir, pos)
         if event.button() == Qt.LeftButton:
             self.select_object(node_id, (ray_start, ray_dir))
@@ -114,27 +141,123 @@ class ApplicationManager(QObject):
         
     def on_mouse_release(self, event):
         print("mouse release")
-        self.scene.deactivate_axis()
+        self.run_in_scene(self.scene.deactivate_axis)
 
     def on_mouse_move(self, event, last_mouse_pos, cam_pos, cam_ray):
-        self.scene.handle_mouse_movement(cam_pos, cam_ray)
+        self.run_in_scene(self.scene.handle_mouse_movement, cam_pos, cam_ray)
         
     def update(self):
         """ main loop of the application
         """
         dt = self.update_delta_time()
-        if self.scene is not None:
-            # from locotest
-            n_steps = int(math.ceil(self.interval / self.sim_dt))
-            self.scene.before_update(dt)
-            for i in range(0, n_steps):
-                self.scene.sim_update(self.sim_dt)
-            self.scene.update(dt)
-            self.scene.after_update(dt)
-
+        if self.simulation_thread is not None:
+            self.render_threaded_update(dt)
+        else:
+            if self.scene is not None:
+                # from locotest
+                n_steps = int(math.ceil(self.interval / self.sim_dt))
+                step_scene(self.scene, dt, self.sim_dt, n_steps, self.phase_timings)
+            start = time.perf_counter()
+            for view in self.views:
+                view.graphics_context.update(dt)
+                self.drawOnView(view)
+            self.phase_timings.add("render", time.perf_counter() - start)
+        self.render_scheduler.update(dt)
+
+    def render_threaded_update(self, dt):
+        """ renders the poses interpolated one step behind the latest snapshot of the simulation thread
+            without the scene lock, so the event loop is not blocked by a slow step.
+        """
+        if self.simulation_thread.error is not None or not self.simulation_thread.is_alive():
+            print("Warning: fall back to the timer update after the simulation thread stopped")
+            self.set_threaded_update(False)
+            return
+        self.emit_queued_signals()
+        self.run_scene_calls()
+        start = time.perf_counter()
+        self.pose_buffer.apply(start - self.simulation_thread.step_dt)
+        worker_objects = set(id(o) for o in self.simulation_thread.scene_objects)
+        for scene_object in self.scene.objectList():
+            if id(scene_object) not in worker_objects:
+                scene_object.update(dt)
         for view in self.views:
             view.graphics_context.update(dt)
             self.drawOnView(view)
+        self.phase_timings.add("render", time.perf_counter() - start)
+
+    def run_in_scene(self, func, *args, **kwargs):
+        """ calls func directly in the timer update mode. In the threaded update mode the call is queued
+            and run by the GUI thread once the simulation thread has paused between two steps.
+        """
+        if self.simulation_thread is None:
+            return func(*args, **kwargs)
+        self._scene_calls.append((func, args, kwargs))
+        self.simulation_thread.pause_requested.set()
+
+    def run_scene_calls(self):
+        """ runs the queued calls if the simulation thread is paused, otherwise it is asked to pause and the calls are tried again in the next update """
+        thread = self.simulation_thread
+        is_modal = QApplication.activeModalWidget() is not None
+        if len(self._scene_calls) == 0 and not is_modal:
+            if thread is not None:
+                thread.pause_requested.clear()
+            return
+        if thread is not None:
+            thread.pause_requested.set()
+        if not self.scene_lock.acquire(blocking=False):
+            return
+        try:
+            while len(self._scene_calls) > 0:
+                func, args, kwargs = self._scene_calls.popleft()
+                try:
+                    func(*args, **kwargs)
+                except:
+                    print("Error in scene call", func)
+                    traceback.print_exc()
+            if thread is not None:
+                # objects that were added by the calls are handed to the worker
+                thread.set_scene_objects(attach_controllers(self.scene))
+        finally:
+            self.scene_lock.release()
+
+    def set_threaded_update(self, enabled):
+        """ starts or stops stepping the scene on a SimulationThread with the fixed time step self.interval """
+        if enabled and self.simulation_thread is None and self.scene is not None:
+            if constants.activate_simulation:
+                print("Warning: the threaded update does not support the physics simulation")
+                return
+            self.pose_buffer.clear()
+            with self.scene_lock:
+                scene_objects = attach_controllers(self.scene)
+            self.simulation_thread = SimulationThread(scene_objects, self.scene_lock, self.pose_buffer,
+                                                      self.interval, self.phase_timings)
+            self.simulation_thread.start()
+            print("start threaded update")
+        elif not enabled and self.simulation_thread is not None:
+            self.simulation_thread.stop()
+            print("stop threaded update after", self.simulation_thread.n_steps, "steps,",
+                  self.simulation_thread.n_dropped_steps, "dropped")
+            with self.scene_lock:
+                detach_controllers(self.simulation_thread.scene_objects)
+            self.simulation_thread = None
+            self.pose_buffer.clear()
+            self.emit_queued_signals()
+            self.run_scene_calls()
+
+    def toggle_threaded_update(self):
+        self.set_threaded_update(self.simulation_thread is None)
+
+    def emit_signal(self, signal, *args):
+        """ signals of the scene raised on the simulation thread are emitted later by the GUI thread """
+        if self.simulation_thread is not None and threading.current_thread() is self.simulation_thread:
+            self._queued_signals.append((signal, args))
+        else:
+            signal.emit(*args)
+
+    def emit_queued_signals(self):
+        while len(self._queued_signals) > 0:
+            signal, args = self._queued_signals.popleft()
+            signal.emit(*args)
 
     def update_scene(self, scene, dt):
         n_steps = int(math.ceil(self.interval / self.sim_dt))
@@ -163,7 +286,11 @@ class ApplicationManager(QObject):
             self.fps = self.frames
             self.frames = 0
             self.last_fps_update_time = t
-        self.update_status_bar("FPS " + str(round(self.fps)))
+            self.phase_averages = self.phase_timings.get_averages()
+        message = "FPS " + str(round(self.fps)) + " | " + self.phase_timings.to_string(self.phase_averages)
+        if self.simulation_thread is not None:
+            message += " | threaded"
+        self.update_status_bar(message)
         self.frames += 1
         return dt
 
@@ -224,26 +351,30 @@ class ApplicationManager(QObject):
     def relayAddedSceneObject(self, sceneId):
         sceneObject = self.scene.getObject(sceneId)
         if sceneObject is not None:
-            self.added_scene_object.emit(sceneId, sceneObject.name)
+            self.emit_signal(self.added_scene_object, sceneId, sceneObject.name)
         else:
-            self.added_scene_object.emit(None, None)
+            self.emit_signal(self.added_scene_object, None, None)
 
     def relayUpdateSceneObject(self, sceneId):
-        self.update_scene_object.emit(sceneId)
+        self.emit_signal(self.update_scene_object, sceneId)
    
     def relayEndOfAnimation(self,animationIndex,loop):
-        self.reached_end_of_animation.emit(animationIndex,loop)
+        self.emit_signal(self.reached_end_of_animation, animationIndex, loop)
         
     def relayUpdateAnimationFrame(self,frameNumber):
-        self.updated_animation_frame.emit(frameNumber)
+        self.emit_signal(self.updated_animation_frame, frameNumber)
 
     def relayDeletedSceneObject(self, node_id):
-        self.deleted_scene_object.emit(node_id)
+        self.emit_signal(self.deleted_scene_object, node_id)
 
     def deinitialize(self):
         self.timer.stop()
+        self.set_threaded_update(False)
 
     def loadFile(self, path):
+        self.run_in_scene(self._load_file, path)
+
+    def _load_file(self, path):
         if self.scene.object_builder.load_file(path):
             return
         elif path.endswith(".py"):
@@ -22,7 +22,7 @@
 # USE OR OTHER DEALINGS IN THE SOFTWARE.
 import numpy as np
 import collections
-from PySide2.QtCore import QTimer, Qt
+from PySide2.QtCore import Qt
 from PySide2.QtWidgets import QDialog, QListWidgetItem, QTableWidgetItem, QTableWidget, QFileDialog
 from PySide2.QtGui import QColor
 from OpenGL.GL import *
@@ -30,11 +30,14 @@ from motion_analysis.gui.layout.animation_editor_dialog_ui import Ui_Dialog
 from motion_analysis.gui.dialogs.select_scene_objects_dialog import SelectSceneObjectsDialog
 from .utils import get_animation_controllers
 from motion_analysis.gui.widgets.scene_viewer import SceneViewerWidget
+from motion_analysis.gui.application_manager import ApplicationManager
 from vis_utils.scene.editor_scene import EditorScene
 from vis_utils.animation.animation_editor import AnimationEditor
 from vis_utils.io import save_json_file
 from vis_utils.scene.utils import get_random_color
 from motion_analysis.annotation_editor import AnnotationEditor
+from motion_analysis.annotation_intervals import IntervalSet
+from motion_analysis.frame_undo_stack import FrameUndoStack, replace_changed_frames, clear_frame_snapshots
 
 
 class AnimationEditorDialog(QDialog, Ui_Dialog):
@@ -55,10 +58,6 @@ class AnimationEditorDialog(QDialog, Ui_Dialog):
         self.radius = 1.5
         self.fps = 60
         self.dt = 1/60
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.draw)
-        self.timer.start(0)
-        self.timer.setInterval(1000.0/self.fps)
         self.scene = scene
         self.original_controller = controller
         self.controller = None
@@ -91,6 +90,7 @@ class AnimationEditorDialog(QDialog, Ui_Dialog):
         self.fixJointButton.clicked.connect(self.slot_fix_joint)
         self.clearConstraintsButton.clicked.connect(self.slot_clear_constraints)
         self.undoButton.clicked.connect(self.slot_undo)
+        self.redoButton.clicked.connect(self.slot_redo)
         self.exportCommandsButton.clicked.connect(self.slot_export_command_history)
         self.applyConstraintsButton.clicked.connect(self.slot_apply_constraints)
         self.resampleButton.clicked.connect(self.slot_resample_motion)
@@ -126,7 +126,8 @@ class AnimationEditorDialog(QDialog, Ui_Dialog):
         self.set_frame_range()
         self.initialized = False
         self.collect_constraints = True
-        self.original_frames = np.array(self.controller.get_frames())
+        self.undo_stack = FrameUndoStack(self.controller.get_frames())
+        self.n_recorded_commands = 0
         self.annotation_editor = AnnotationEditor()
         self.contactLabelView.setTimeLineParameters(100000, 10)
         self.contactLabelView.initScene()
@@ -143,9 +144,15 @@ class AnimationEditorDialog(QDialog, Ui_Dialog):
             self.annotation_editor.set_annotation(ground_annotation, color_map)
             self.fill_label_combobox()
         self.init_label_time_line()
+        self.render_scheduler = ApplicationManager.instance.render_scheduler
+        self.render_scheduler.add_view("animation editor", self.leftView, self.left_scene, self.draw, watched_widget=self)
+        self.finished.connect(self.slot_finished)
+
+    def slot_finished(self, result=None):
+        self.render_scheduler.remove_view(self.leftView)
 
     def closeEvent(self, e):
-        self.timer.stop()
+        self.slot_finished()
         self.leftView.makeCurrent()
         try:
            del self.leftView
@@ -154,16 +161,40 @@ class AnimationEditorDialog(QDialog, Ui_Dialog):
 
 
     def slot_undo(self):
-        frames = self._animation_editor.undo()
-        if frames is not None:
-            self.n_frames = len(frames)
-            self.set_frame_range()
-            self.original_controller.replace_frames(frames)
-            self.original_controller.updateTransformation()
+        # edits that were not shown yet become a separate step
+        self.show_change()
+        delta = self.undo_stack.undo()
+        if delta is not None:
+            self.apply_undo_step(delta, True)
             print("undo")
         else:
             print("nothing to undo")
 
+    def slot_redo(self):
+        delta = self.undo_stack.redo()
+        if delta is not None:
+            self.apply_undo_step(delta, False)
+            print("redo")
+        else:
+            print("nothing to redo")
+
+    def apply_undo_step(self, delta, undo):
+        # the exported command history only contains the edits that were not undone
+        command_history = self._animation_editor.command_history
+        if undo:
+            del command_history[len(command_history) - len(delta.commands):]
+        else:
+            command_history += delta.commands
+        self.n_recorded_commands = len(command_history)
+        frames = self.undo_stack.frames
+        replace_changed_frames(self.controller, delta, frames, undo)
+        replace_changed_frames(self.original_controller, delta, frames, undo)
+        if delta.resized:
+            self.n_frames = len(frames)
+            self.set_frame_range()
+        self.controller.updateTransformation()
+        self.original_controller.updateTransformation()
+
     def on_mouse_click(self, event, ray_start, ray_dir, pos, node_id):
         if event.button() == Qt.LeftButton:
             self.left_scene.select_object(node_id, (ray_start, ray_dir))            
@@ -219,6 +250,8 @@ class AnimationEditorDialog(QDialog, Ui_Dialog):
         
         #target_scene.object_builder.create_component("animation_editor", o)
         self._animation_editor = AnimationEditor(o) #o._components["animation_editor"]
+        # fails when the dialog is opened instead of after the first edit if the attribute is missing
+        clear_frame_snapshots(self._animation_editor)
         return o._components["animation_controller"]
 
     def draw(self):
@@ -229,7 +262,6 @@ class AnimationEditorDialog(QDialog, Ui_Dialog):
             if self.leftView.graphics_context is not None:
                 self.leftView.resize(400,400)
                 self.initialized = True
-        self.left_scene.update(self.dt)
         self.leftView.makeCurrent()
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
         self.leftView.graphics_context.render(self.left_scene)
@@ -327,8 +359,13 @@ class AnimationEditorDialog(QDialog, Ui_Dialog):
         self.show_change()
 
     def show_change(self):
-        frames = np.array(self.controller.get_frames())
-        self.original_controller.replace_frames(frames)
+        """ records the edit for undo and copies only the changed frames and channels to the original controller """
+        command_history = self._animation_editor.command_history
+        delta = self.undo_stack.record(self.controller.get_frames(), command_history[self.n_recorded_commands:])
+        self.n_recorded_commands = len(command_history)
+        clear_frame_snapshots(self._animation_editor)
+        if delta is not None:
+            replace_changed_frames(self.original_controller, delta, self.undo_stack.frames)
         self.original_controller.updateTransformation()
         self.controller.updateTransformation()
 
@@ -453,41 +490,29 @@ class AnimationEditorDialog(QDialog, Ui_Dialog):
         target_ground_height = float(self.targetGroundHeightLineEdit.text())
         n_frames = self.controller.getNumberOfFrames()
         ground_contacts = [[] for f in range(n_frames)]
-        ground_annotation = self.annotation_editor._semantic_annotation
-        for label in ground_annotation:
+        for label in self.annotation_editor.get_labels():
             if label not in self.skeleton.nodes:
                 print("ignore",label)
                 continue
-            for entry in ground_annotation[label]:
-                for idx in entry:
+            for start, end in self.annotation_editor.get_sections(label):
+                for idx in range(start, min(end, n_frames)):
                     ground_contacts[idx].append(label)
         self._animation_editor.apply_foot_constraints(ground_contacts, target_ground_height)
         self.show_change()
 
     def init_label_time_line(self):
         n_frames = self.controller.getNumberOfFrames()
-        self.contactLabelView.clearScene()
-        self.contactLabelView.create_frame_indicator()
-        self.contactLabelView.setTimeLineParameters(n_frames, 10)
+        self.contactLabelView.initTimeLine(n_frames, 10)
         self.contactLabelView.set_edit_start_frame(0)
-        ground_annotation = self.annotation_editor._semantic_annotation
-        color_map = self.annotation_editor._label_color_map
-        if len(ground_annotation) > 0:
-            for label, indices in ground_annotation.items():
-                color = [0,0,1]
-                if label in color_map:
-                    color = color_map[label]
-                joint_indices = []
-                n_entries = len(indices) 
-                if n_entries > 0 and type(indices[0]) == list:
-                    for i in range(n_entries):
-                        joint_indices += indices[i]
-                else:
-                    joint_indices = indices
-       
-                self.contactLabelView.addLabel(label, joint_indices, color)
-        else:
-            self.contactLabelView.addLabel("empty", [], [0,0,0])
+        labels = []
+        for label in self.annotation_editor.get_labels():
+            color = [0,0,1]
+            if label in self.annotation_editor._label_color_map:
+                color = self.annotation_editor._label_color_map[label]
+            labels.append((label, IntervalSet(self.annotation_editor.get_sections(label)), color))
+        if len(labels) == 0:
+            labels.append(("empty", IntervalSet(), [0,0,0]))
+        self.contactLabelView.setLabels(labels)
 
     def keyReleaseEvent(self, event):
         if event.key() == Qt.Key_G:
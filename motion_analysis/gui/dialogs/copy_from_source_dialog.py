@@ -23,32 +23,17 @@
 
 import numpy as np
 from PySide2.QtWidgets import QDialog, QListWidgetItem, QTableWidgetItem, QTableWidget
-from PySide2.QtCore import QTimer, Qt
+from PySide2.QtCore import Qt
 from PySide2.QtGui import QColor
 from motion_analysis.gui.layout.copy_from_source_dialog_ui import Ui_Dialog
 from motion_analysis.gui.dialogs.utils import get_animation_controllers
 from motion_analysis.gui.widgets.scene_viewer import SceneViewerWidget
+from motion_analysis.gui.application_manager import ApplicationManager
 from vis_utils.scene.editor_scene import EditorScene
-from anim_utils.animation_data.motion_blending import create_transition_for_joints_using_slerp, BLEND_DIRECTION_FORWARD, BLEND_DIRECTION_BACKWARD, smooth_translation_in_quat_frames
-from anim_utils.motion_editing.cubic_motion_spline import CubicMotionSpline
+from motion_analysis.copy_motion import copy_motion_range, get_joint_parameter_indices
 from OpenGL.GL import *
 
 
-def stretch_motion(skeleton, frames, n_dest_frames):
-    n_frames = len(frames)
-    times = list(range(0, n_frames))
-    spline = CubicMotionSpline.fit_frames(skeleton, times, frames)
-    step_size = (n_frames-1)/n_dest_frames
-    streched_times = np.arange(0,n_frames-1,step_size)
-    #print(streched_times)
-    new_frames = []
-    for t in streched_times:
-        f = spline.evaluate(t)
-        new_frames.append(f)
-    print("new frames", len(new_frames))
-    return new_frames
-
-
 class CopyFromSourceDialog(QDialog, Ui_Dialog):
     def __init__(self, controller, scene, share_widget, parent=None):
         QDialog.__init__(self, parent)
@@ -70,10 +55,6 @@ class CopyFromSourceDialog(QDialog, Ui_Dialog):
 
         self.fps = 60
         self.dt = 1/60
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.draw)
-        self.timer.start(0)
-        self.timer.setInterval(1000.0/self.fps)
         self.scene = scene
         self.right_controller = None
         self.skeleton = None
@@ -127,9 +108,17 @@ class CopyFromSourceDialog(QDialog, Ui_Dialog):
         self.end_frame = n_frames-1#
         self.set_right_frame_range()
         self.initialized = False
+        self.render_scheduler = ApplicationManager.instance.render_scheduler
+        self.render_scheduler.add_view("copy source", self.leftView, self.left_scene, self.draw_left_view, watched_widget=self)
+        self.render_scheduler.add_view("copy target", self.rightView, self.right_scene, self.draw_right_view, watched_widget=self)
+        self.finished.connect(self.slot_finished)
+
+    def slot_finished(self, result=None):
+        self.render_scheduler.remove_view(self.leftView)
+        self.render_scheduler.remove_view(self.rightView)
 
     def closeEvent(self, e):
-        self.timer.stop()
+        self.slot_finished()
         self.leftView.makeCurrent()
         del self.leftView
         self.rightView.makeCurrent()
@@ -163,78 +152,21 @@ class CopyFromSourceDialog(QDialog, Ui_Dialog):
             
             joint_list, joint_index_list = self.get_selected_joints()
             print("copy", joint_list, joint_index_list)
-            
-            modified_frames = self.copy_joint_values(left_frames, right_frames, joint_list, joint_index_list, src_start, src_end, dest_start, dest_end)
             n_blend_range = int(self.blendRangeLineEdit.text())
-            if n_blend_range > 0:
-                modified_frames = self.apply_blending(modified_frames, joint_list, joint_index_list, dest_start, dest_end-1, n_blend_range)
+            modified_frames = copy_motion_range(self.skeleton, left_frames, right_frames, joint_list, src_start, src_end, dest_start, dest_end, n_blend_range)
             self.right_controller.replace_frames(modified_frames)
             n_new_right_frames = self.right_controller.getNumberOfFrames()
             print("finished overwriting", n_right_frames, n_new_right_frames)
-        
-    def copy_joint_values(self, left_frames, right_frames, joint_list, joint_index_list, src_start, src_end, dest_start, dest_end):
-        n_copied_frames = src_end - src_start
-        n_dest_frames = dest_end - dest_start
-        modified_frames = np.array(right_frames)
-        if n_copied_frames > 1:
-            src_frames = stretch_motion(self.skeleton, left_frames[src_start:src_end], n_dest_frames)
-        else:
-            src_frames = []
-            for i in range(n_dest_frames):
-                src_frames.append(left_frames[src_start])
-            src_frames = np.array(src_frames)
-        print("copy ", n_copied_frames, n_dest_frames)
-        for frame_idx in range(n_dest_frames):
-            modified_frames[dest_start+frame_idx][joint_index_list] = src_frames[frame_idx][joint_index_list]
-        return modified_frames
-
-    def apply_blending(self, frames, joint_list, joint_index_list, dest_start, dest_end, n_blend_range):
-        n_frames = len(frames)
-        blend_start = max(dest_start- n_blend_range, 0)
-        start_window = dest_start -blend_start
-        blend_end =  min(dest_end +n_blend_range, n_frames-1)
-        end_window = blend_end- dest_end
-         #remove root indices
-        print("blend ", dest_start, dest_end, n_blend_range, start_window, end_window)
-        quat_joint_index_list = list(joint_index_list)
-        if self.skeleton.root in joint_list:
-            # apply root smnoothing and remove from index list
-            if start_window > 0:
-                frames = smooth_translation_in_quat_frames(frames, dest_start, start_window)
-            if end_window > 0:
-                frames = smooth_translation_in_quat_frames(frames, dest_end, end_window)
-            for i in range(3):
-                quat_joint_index_list.remove(i)
-        
-        if len(quat_joint_index_list) > 0:
-            o = 0
-            for j in joint_list:
-                q_indices = quat_joint_index_list[o:o+4]
-                if start_window > 0:
-                    frames = create_transition_for_joints_using_slerp(frames, q_indices, blend_start, dest_start, start_window, BLEND_DIRECTION_FORWARD)
-                if end_window > 0:
-                    print(j, q_indices)
-                    frames = create_transition_for_joints_using_slerp(frames, q_indices, dest_end, blend_end, end_window, BLEND_DIRECTION_BACKWARD)
-                o += 4
-        
-        return frames
-        
+
     def get_selected_joints(self):
         joint_list = []
-        joint_index_list = []
         for row_idx in range(self.jointTableWidget.rowCount()):
             index_cell = self.jointTableWidget.item(row_idx,0)
             if index_cell.checkState() == Qt.Checked:
                 name_cell = self.jointTableWidget.item(row_idx,1)
                 joint_name = str(name_cell.text())
                 joint_list.append(joint_name)
-                if joint_name == self.skeleton.root:
-                    offset = 0
-                    n_channels = 7
-                else:
-                    offset = self.skeleton.nodes[joint_name].quaternion_frame_index * 4 + 3
-                    n_channels = 4
-                joint_index_list += list(range(offset,offset+n_channels))
+        joint_index_list = get_joint_parameter_indices(self.skeleton, joint_list)
         return joint_list, joint_index_list
 
 
@@ -277,28 +209,29 @@ class CopyFromSourceDialog(QDialog, Ui_Dialog):
         self.leftDisplayFrameSlider.setRange(0, n_frames-1)
 
 
-    def draw(self):
-        """ draw current scene on the given view
-        (note before calling this function the context of the view has to be set as current using makeCurrent() and afterwards the doubble buffer has to swapped to display the current frame swapBuffers())
-        """
+    def initialize_views(self):
         if not self.initialized:
             if self.leftView.graphics_context is not None and self.rightView.graphics_context is not None:
                 self.leftView.resize(400,400)
                 self.rightView.resize(400,400)
                 self.initialized = True
-        self.left_scene.update(self.dt)
+
+    def draw_left_view(self):
+        """ draw current scene on the given view
+        (note before calling this function the context of the view has to be set as current using makeCurrent() and afterwards the doubble buffer has to swapped to display the current frame swapBuffers())
+        """
+        self.initialize_views()
         self.leftView.makeCurrent()
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
         self.leftView.graphics_context.render(self.left_scene)
         self.leftView.swapBuffers()
 
-
-        self.right_scene.update(self.dt)
+    def draw_right_view(self):
+        self.initialize_views()
         self.rightView.makeCurrent()
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
         self.rightView.graphics_context.render(self.right_scene)
         self.rightView.swapBuffers()
-        #print(len(self.right_scene.lightSources))
 
     def right_display_changed(self, frame_idx):
         if self.right_controller is not None:
@@ -29,11 +29,8 @@ import bson
 import numpy as np
 import threading
 from functools import partial
-import asyncio
-from concurrent.futures import ProcessPoolExecutor
-from multiprocessing import cpu_count
 from PySide2 import QtWidgets, QtCore, QtUiTools
-from PySide2.QtWidgets import QDialog, QListWidgetItem, QFileDialog, QAbstractItemView, QTreeWidgetItem
+from PySide2.QtWidgets import QDialog, QFileDialog, QAbstractItemView, QTreeWidgetItem
 from PySide2.QtCore import Qt
 from .enter_name_dialog import EnterNameDialog
 from .confirmation_dialog import ConfirmationDialog
@@ -46,7 +43,7 @@ from .motion_modelling_dialog import MotionModellingDialog
 from .graph_definition_dialog import GraphDefinitionDialog
 from .graph_table_view_dialog import GraphTableViewDialog
 from .skeleton_editor_dialog import SkeletonEditorDialog
-from .utils import get_animation_controllers, load_motion_data_from_dir
+from .utils import get_animation_controllers
 from anim_utils.utilities.db_interface import create_new_collection_in_remote_db, get_bvh_string, get_motion_list_from_remote_db, get_motion_by_id_from_remote_db, \
                                         delete_motion_by_id_from_remote_db,  upload_motion_to_db, replace_motion_in_db, get_time_function_by_id_from_remote_db, \
                                         create_new_skeleton_in_db, load_skeleton_from_db,delete_skeleton_from_remote_db, retarget_motion_in_db, get_annotation_by_id_from_remote_db, \
@@ -58,10 +55,12 @@ from vis_utils.io import load_json_file, save_json_file
 from anim_utils.animation_data.skeleton_models import SKELETON_MODELS
 from anim_utils.animation_data import BVHReader, BVHWriter, MotionVector, SkeletonBuilder
 from anim_utils.retargeting.analytical import Retargeting, generate_joint_map
-from vis_utils.animation.animation_editor import AnimationEditorBase
 from motion_analysis.gui.application_manager import ApplicationManager
 from motion_analysis.gui.layout.motion_db_browser_dialog_ui import Ui_Dialog
 from motion_analysis.session_manager import SessionManager
+from motion_analysis.motion_db import CollectionExporter, CachedMotionDB, FolderImporter, AsyncDBLoader
+from motion_analysis.batch_retargeting import TaskScheduler, retarget_motion_in_db_task, STATUS_FAILED
+from motion_analysis.batch_edit import apply_command_history
 try:
     from morphablegraphs.utilities import convert_to_mgrd_skeleton
     from morphablegraphs.motion_model.motion_primitive_wrapper import MotionPrimitiveModelWrapper
@@ -152,26 +151,15 @@ def chunks(l, n):
         yield l[i:i + n]
 
 
-def retarget_batch(params):
-    db_url, batch, retargeting, collection, target_skeleton_name, is_aligned, session = params
-    for item in batch:
-        print(item)
-        retarget_motion_in_db(db_url, retargeting, item[0], item[1], collection, target_skeleton_name, is_aligned, session)
-
-
-@asyncio.coroutine
-def run_retargeting_process(pool, db_url, batch, retargeting, collection, target_skeleton_name, is_aligned, session):
-    print("start retarging", len(batch), "motions")
-    params = db_url, batch, retargeting, collection, target_skeleton_name, is_aligned, session
-    fut = pool.submit(retarget_batch, params)
-    while not fut.done() and not fut.cancelled():
-        yield from asyncio.sleep(0.1)
-    print("done")
-
-
-
-
 class MotionDBBrowserDialog(QDialog, Ui_Dialog):
+    import_finished = QtCore.Signal()
+    import_progress = QtCore.Signal(int, int, str)
+    export_progress = QtCore.Signal(int, int, str)
+    export_finished = QtCore.Signal(int, int)
+    retargeting_progress = QtCore.Signal(int, int, str)
+    collections_loaded = QtCore.Signal(str, int, object)
+    list_loaded = QtCore.Signal(str, int, object)
+
     def __init__(self, scene, parent=None):
         QDialog.__init__(self, parent)
         self.setModal(0)
@@ -209,10 +197,24 @@ class MotionDBBrowserDialog(QDialog, Ui_Dialog):
         self.generateMGFromFIleButton.clicked.connect(self.slot_generate_graph_definition)
         self.retargetAlignedMotionsButton.clicked.connect(partial(MotionDBBrowserDialog.slot_retarget_motions_parallel,self, True))
         self.editSkeletonButton.clicked.connect(self.slot_edit_skeleton)
+        self.import_finished.connect(self._fill_motion_list_from_db)
+        self.import_progress.connect(self.slot_update_import_progress)
+        self.export_progress.connect(self.slot_update_export_progress)
+        self.export_finished.connect(self.slot_export_finished)
+        self.retargeting_progress.connect(self.slot_update_retargeting_progress)
+        self.retargeting_scheduler = None
+        self.exporters = []
+        self.importer = None
         self.debugInfoButton.clicked.connect(self.slot_print_debug_info)
         self.rootItem = None
+        self.collection_items = dict()
+        self.loaded_collections = set()
+        self.loader = AsyncDBLoader()
+        self.collections_loaded.connect(self.slot_add_collections)
+        self.list_loaded.connect(self.slot_set_list)
         self.db_url = constants.DB_URL
         self.session = SessionManager.session
+        self.db = CachedMotionDB(self.db_url, self.session)
         print("set session", self.session)
         if self.session is not None and "user" in self.session:
             self.statusLabel.setText("Status: Authenticated as "+self.session["user"])
@@ -222,16 +224,19 @@ class MotionDBBrowserDialog(QDialog, Ui_Dialog):
 
             
         self.urlLineEdit.setText(self.db_url)
+        self.list_widgets = {"motions": self.processedMotionListWidget,
+                             "aligned_motions": self.alignedMotionListWidget,
+                             "models": self.modelListWidget}
         self.fill_combo_box_with_skeletons()
         self.update_lists()
         self.processedMotionListWidget.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
         self.alignedMotionListWidget.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
         self.skeletonListComboBox.currentIndexChanged.connect(self.update_lists)
         self.collectionTreeWidget.itemClicked.connect(self.update_lists)
+        self.collectionTreeWidget.itemExpanded.connect(self.slot_expand_collection)
         self.urlLineEdit.textChanged.connect(self.set_url)
         self.tabWidget.currentChanged.connect(self.toggle_motion_primitive_list)
-        t = threading.Thread(target=self.fill_tree_widget)
-        t.start()
+        self.fill_tree_widget()
         self.n_samples = 10000
         self.n_subdivisions_per_level = 4
         self.k8s_resources = constants.K8S_RESOURCES
@@ -245,6 +250,14 @@ class MotionDBBrowserDialog(QDialog, Ui_Dialog):
         parent = self.parent()
         if parent is not None:
             parent.motion_db_browser_dialog = None
+        if self.retargeting_scheduler is not None:
+            self.retargeting_scheduler.cancel()
+        for exporter in list(self.exporters):
+            exporter.stop()
+        if self.importer is not None:
+            self.importer.stop()
+        self.loader.close()
+        self.db.close()
 
     def exit(self):
         self.close()
@@ -252,6 +265,9 @@ class MotionDBBrowserDialog(QDialog, Ui_Dialog):
     def set_url(self, text):
         print("set url", text)
         self.db_url = str(text)
+        self.loader.cancel()
+        self.db.close()
+        self.db = CachedMotionDB(self.db_url, self.session)
 
     def toggle_motion_primitive_list(self):
         tab_name = self.tabWidget.currentWidget().objectName()
@@ -262,26 +278,61 @@ class MotionDBBrowserDialog(QDialog, Ui_Dialog):
         self._fill_model_list_from_db()
         self._fill_aligned_motion_list_from_db()
 
-    def fill_tree_widget(self, parent=None):
-        if parent is None:
-            self.collectionTreeWidget.clear()
-            self.rootItem = QTreeWidgetItem(self.collectionTreeWidget, ["root", "root"])
-            self.rootItem.setExpanded(True)
-            # root collection has id 0
-            parent_id = 0
-            parent_item = self.rootItem
-            self.rootItem.setData(0, Qt.UserRole, parent_id)
-        else:
-            parent_id = parent[1]
-            parent_item = parent[0]
-
-        collection_list = get_collections_by_parent_id_from_remote_db(self.db_url, parent_id)
-        if collection_list is not None:
-            for col in collection_list:
-                colItem = QTreeWidgetItem(parent_item, [col[1], col[2]])
-                colItem.setData(0, Qt.UserRole, col[0])
-                self.fill_tree_widget((colItem, col[0]))
-            
+    def fill_tree_widget(self):
+        """ recreates the tree from the root. The levels of the tree are requested in the background when they are needed """
+        for parent_id in self.loaded_collections:
+            self.loader.cancel("collections" + str(parent_id))
+        self.collectionTreeWidget.clear()
+        self.collection_items = dict()
+        self.loaded_collections = set()
+        self.rootItem = QTreeWidgetItem(self.collectionTreeWidget, ["root", "root"])
+        # root collection has id 0
+        self.rootItem.setData(0, Qt.UserRole, 0)
+        self.collection_items[0] = self.rootItem
+        self.request_collections(0)
+        self.rootItem.setExpanded(True)
+
+    def request_collections(self, parent_id):
+        if parent_id in self.loaded_collections:
+            return
+        self.loaded_collections.add(parent_id)
+        # each level has its own channel so that requests for different levels do not cancel each other
+        self.loader.submit("collections" + str(parent_id), get_collections_by_parent_id_from_remote_db,
+                           (self.db_url, parent_id), partial(self.emit_loaded, self.collections_loaded))
+
+    def emit_loaded(self, signal, channel, version, result):
+        """ is called from the thread of the loader and forwards the result to the Qt event loop """
+        signal.emit(channel, version, result)
+
+    def slot_add_collections(self, channel, version, collection_list):
+        if not self.loader.is_current(channel, version):
+            return
+        parent_id = int(channel[len("collections"):])
+        if parent_id not in self.collection_items:
+            return
+        parent_item = self.collection_items[parent_id]
+        if collection_list is None:
+            # allow another attempt when the node is expanded again
+            self.loaded_collections.discard(parent_id)
+            return
+        for col in collection_list:
+            colItem = QTreeWidgetItem(parent_item, [col[1], col[2]])
+            colItem.setData(0, Qt.UserRole, col[0])
+            # the children are not known yet
+            colItem.setChildIndicatorPolicy(QTreeWidgetItem.ShowIndicator)
+            self.collection_items[col[0]] = colItem
+        parent_item.setChildIndicatorPolicy(QTreeWidgetItem.DontShowIndicatorWhenChildless)
+        if parent_item.isExpanded():
+            self.prefetch_child_collections(parent_item)
+
+    def slot_expand_collection(self, item):
+        self.request_collections(int(item.data(0, Qt.UserRole)))
+        self.prefetch_child_collections(item)
+
+    def prefetch_child_collections(self, item):
+        """ requests the next level below the expanded item, so that its children can be expanded without waiting """
+        for idx in range(item.childCount()):
+            self.request_collections(int(item.child(idx).data(0, Qt.UserRole)))
 
     def fill_combo_box_with_skeletons(self):
         self.skeletonListComboBox.clear()
@@ -308,58 +359,31 @@ class MotionDBBrowserDialog(QDialog, Ui_Dialog):
             return
         return int(parent.data(0, Qt.UserRole)),  str(parent.text(0)), str(parent.text(1))
 
-    def _fill_motion_list_from_db(self, idx=None):
-        self.processedMotionListWidget.clear()
+    def request_list(self, channel, func):
+        """ replaces the content of the list when the request is finished. A running request for the list is cancelled """
+        self.list_widgets[channel].clear()
         col = self.get_collection()
         if col is None:
+            self.loader.cancel(channel)
             return
         c_id, c_name, c_type = col
-        print("update lists", c_id)
         skeleton = str(self.skeletonListComboBox.currentText())
-        motion_list = get_motion_list_from_remote_db(self.db_url, c_id, skeleton, is_processed=False, session=self.session)
-        if motion_list is None:
+        self.loader.submit(channel, func, (self.db_url, c_id, skeleton), partial(self.emit_loaded, self.list_loaded))
+
+    def slot_set_list(self, channel, version, item_list):
+        if not self.loader.is_current(channel, version) or item_list is None:
             return
-        print("loaded", len(motion_list), "clips")
-        for node_id, name in motion_list:
-            item = QListWidgetItem()
-            item.setText(name)
-            item.setData(Qt.UserRole, node_id)
-            self.processedMotionListWidget.addItem(item)
+        print("loaded", len(item_list), channel)
+        self.list_widgets[channel].set_items(item_list)
+
+    def _fill_motion_list_from_db(self, idx=None):
+        self.request_list("motions", partial(get_motion_list_from_remote_db, is_processed=False, session=self.session))
 
     def  _fill_aligned_motion_list_from_db(self, idx=None):
-        self.alignedMotionListWidget.clear()
-        col = self.get_collection()
-        if col is None:
-            return
-        c_id, c_name, c_type = col
-        skeleton = str(self.skeletonListComboBox.currentText())
-        motion_list = get_motion_list_from_remote_db(self.db_url, c_id, skeleton, is_processed=True)
-        if motion_list is None:
-            return
-        print("loaded", len(motion_list), "aligned clips")
-        for node_id, name in motion_list:
-            item = QListWidgetItem()
-            item.setText(name)
-            item.setData(Qt.UserRole, node_id)
-            print("loaded", name, node_id)
-            self.alignedMotionListWidget.addItem(item)
-        
+        self.request_list("aligned_motions", partial(get_motion_list_from_remote_db, is_processed=True))
+
     def _fill_model_list_from_db(self, idx=None):
-        self.modelListWidget.clear()
-        col = self.get_collection()
-        if col is None:
-            return
-        c_id, c_name, c_type = col
-        skeleton = str(self.skeletonListComboBox.currentText())
-        model_list = get_model_list_from_remote_db(self.db_url, c_id, skeleton)
-        print("model list", model_list)
-        if model_list is None:
-            return
-        for node_id, name in model_list:
-            item = QListWidgetItem()
-            item.setText(name)
-            item.setData(Qt.UserRole, node_id)
-            self.modelListWidget.addItem(item)
+        self.request_list("models", get_model_list_from_remote_db)
 
     def slot_load_motions(self, is_aligned=0):
         if is_aligned==0:
@@ -372,6 +396,8 @@ class MotionDBBrowserDialog(QDialog, Ui_Dialog):
         c_id, c_name, c_type = col
         n_motions = len(items)
         count = 1
+        motion_ids = [int(item.data(Qt.UserRole)) for item in items]
+        self.db.prefetch_motions(motion_ids, is_aligned, ["motion", "annotation"])
         for item in items:
             motion_id = int(item.data(Qt.UserRole))
             motion_name = str(item.text())
@@ -382,24 +408,24 @@ class MotionDBBrowserDialog(QDialog, Ui_Dialog):
 
     def load_motion_from_db(self, motion_id, motion_name, collection, is_processed=False):
         #print("selected item", item.text(),self.selected_id)
-        motion_data = get_motion_by_id_from_remote_db(self.db_url, motion_id, is_processed)
+        motion_data = self.db.get_motion(motion_id, is_processed)
         if motion_data is None:
             print("Error: motion data is empty")
             return
         #skeleton_name = motion_data["skeletonModel"]
         skeleton_name = str(self.skeletonListComboBox.currentText())
         print("load skeleton", skeleton_name)
-        skeleton_data = get_skeleton_from_remote_db(self.db_url, skeleton_name)
+        skeleton_data = self.db.get_skeleton_data(skeleton_name)
         if skeleton_data is None:
             print("Error: skeleton data is empty")
             return
-        meta_info_str = get_annotation_by_id_from_remote_db(self.db_url, motion_id, is_processed)
+        meta_info_str = self.db.get_annotation(motion_id, is_processed)
         skeleton_model = None
         if skeleton_name in SKELETON_MODELS:
             skeleton_model = SKELETON_MODELS[skeleton_name]
         visible = True
         color = [0,0,1]
-        self.scene.object_builder.create_object("motion_from_json", skeleton_data, motion_data, motion_name, collection, motion_id, meta_info_str, skeleton_model, is_processed, visible=visible)
+        ApplicationManager.instance.run_in_scene(self.scene.object_builder.create_object, "motion_from_json", skeleton_data, motion_data, motion_name, collection, motion_id, meta_info_str, skeleton_model, is_processed, visible=visible)
 
     def slot_delete_motion(self, is_processed=0):
         dialog = ConfirmationDialog()
@@ -413,6 +439,7 @@ class MotionDBBrowserDialog(QDialog, Ui_Dialog):
                 selected_id = int(item.data(Qt.UserRole))
                 print("delete", selected_id, is_processed)
                 delete_motion_by_id_from_remote_db(self.db_url, selected_id, is_processed, session=self.session)
+                self.db.invalidate_motion(selected_id)
             self._fill_motion_list_from_db()
 
     def slot_new_collection(self):
@@ -489,6 +516,7 @@ class MotionDBBrowserDialog(QDialog, Ui_Dialog):
         if dialog.success:
             skeleton_name = str(self.skeletonListComboBox.currentText())
             delete_skeleton_from_remote_db(self.db_url, skeleton_name, self.session)
+            self.db.invalidate_skeleton(skeleton_name)
             self.fill_combo_box_with_skeletons()
             self._fill_motion_list_from_db()
 
@@ -501,6 +529,7 @@ class MotionDBBrowserDialog(QDialog, Ui_Dialog):
             for item in items:
                 selected_id = int(item.data(Qt.UserRole))
                 delete_model_by_id_from_remote_db(self.db_url, selected_id, self.session)
+                self.db.invalidate_model(selected_id)
             self.update_lists()
 
     def slot_export_collection_to_folder(self, is_aligned=False):
@@ -515,57 +544,48 @@ class MotionDBBrowserDialog(QDialog, Ui_Dialog):
             self.export_collection_clips_to_folder(c_id, skeleton_name, directory, is_aligned)
             #self.export_processed_motion_data(skeleton_name, directory, c_id)
 
+    def create_exporter(self, **kwargs):
+        return CollectionExporter(self.db_url, self.session, progress_callback=self.export_progress.emit, **kwargs)
+
+    def start_export(self, exporter, add_jobs):
+        """ collects and downloads the items in a background thread like the folder import so that the dialog stays responsive """
+        self.exporters.append(exporter)
+        t = threading.Thread(target=self.run_export, args=(exporter, add_jobs))
+        t.start()
+        self.statusLabel.setText("Status: Collecting items for the export")
+
+    def run_export(self, exporter, add_jobs):
+        n_exported, n_failed = 0, 0
+        try:
+            add_jobs()
+            stats = exporter.run()
+            n_exported, n_failed = stats["n_exported"], len(stats["failed"])
+        except Exception as e:
+            print("Error: export failed", e)
+            n_failed = -1
+        finally:
+            exporter.close()
+            self.exporters.remove(exporter)
+        self.export_finished.emit(n_exported, n_failed)
+
+    def slot_update_export_progress(self, n_done, n_items, key):
+        self.statusLabel.setText("Status: Exported "+str(n_done)+"/"+str(n_items)+" "+key)
+
+    def slot_export_finished(self, n_exported, n_failed):
+        if n_failed < 0:
+            self.statusLabel.setText("Status: Export failed")
+        else:
+            self.statusLabel.setText("Status: Finished export of "+str(n_exported)+" items, "+str(n_failed)+" failed")
+
     def export_collection_clips_to_folder(self, c_id, skeleton_name, directory, is_aligned):
         print("export", is_aligned)
-        #is_aligned = 1
-        skeleton = load_skeleton_from_db(self.db_url, skeleton_name)
-        motion_list = get_motion_list_from_remote_db(self.db_url, c_id, skeleton_name, is_aligned, self.session)
-        if motion_list is None:
-            print("could not find motions")
-            return
-        n_motions = len(motion_list)
-        if n_motions < 1:
-            print("no motions", c_id)
-            return
-        if not os.path.isdir(directory):
-            os.makedirs(directory)
-        count = 1
-        #print(skeleton_name, len(motion_list), is_aligned, directory)
-        for motion_id, name in motion_list:
-            print("download motion", str(count)+"/"+str(n_motions), name, is_aligned)
-            self.export_motion_clip(skeleton, motion_id, name, directory)
-            count+=1
+        exporter = self.create_exporter()
+        self.start_export(exporter, partial(exporter.add_collection, c_id, skeleton_name, directory, is_aligned))
 
     def export_motion_clip(self, skeleton, motion_id, name, directory, export_bvh=False, export_json=False, export_bson=True):
         print("export clip")
-        motion_dict = get_motion_by_id_from_remote_db(self.db_url, motion_id, is_processed=False, session=self.session)
-        if motion_dict is None:
-            return
-        print("write to file")
-        if export_bvh:
-            motion_vector = MotionVector()
-            motion_vector.from_custom_unity_format(motion_dict)
-            bvh_str = get_bvh_string(skeleton, motion_vector.frames)
-            filename = directory+os.sep+name
-            if not name.endswith(".bvh"):
-                filename += ".bvh"
-            with open(filename, "wt") as out_file:
-                out_file.write(bvh_str)
-        filename = directory+os.sep+name
-        annotation_str = get_annotation_by_id_from_remote_db(self.db_url, motion_id, is_processed=False, session=self.session)
-        if annotation_str != "":
-            annotation_filename = filename + "_meta_info.json"
-            with open(annotation_filename, "wt") as out_file:
-                out_file.write(annotation_str)
-        else:
-            print("no meta info")
-        time_function_str = get_time_function_by_id_from_remote_db(self.db_url, motion_id, self.session)
-        if time_function_str != "":
-            time_function_filename = filename + "_time_function.json"
-            with open(time_function_filename, "wt") as out_file:
-                out_file.write(time_function_str)
-        else:
-            print("no time function")
+        exporter = self.create_exporter(n_workers=1, export_bvh=export_bvh, export_json=export_json, export_bson=export_bson)
+        self.start_export(exporter, partial(exporter.add_motion_clip, skeleton, motion_id, name, directory))
 
     def slot_import_collection_from_folder(self):
         directory = QFileDialog.getExistingDirectory(self, "Select Directory")
@@ -575,16 +595,32 @@ class MotionDBBrowserDialog(QDialog, Ui_Dialog):
             if col is None:
                 return
             c_id, c_name, c_type = col
-            motion_data_list = load_motion_data_from_dir(directory)
-            count = 1
-            n_motions = len(motion_data_list)
-            for name, data in motion_data_list.items():
-                print("upload motion", str(count)+"/"+str(n_motions), name)
-                is_processed = False
-                motion_data = data["bvh_str"]
-                upload_motion_to_db(self.db_url, name, motion_data, c_id, data["skeleton_model"], data["meta_info"], is_processed, self.session)
-                count+=1
-            self._fill_motion_list_from_db()
+            if self.importer is not None:
+                print("wait until the running import is finished")
+                return
+            # the files are streamed from a background thread so that the dialog stays responsive
+            self.importer = FolderImporter(self.db_url, c_id, self.session, progress_callback=self.emit_import_progress)
+            t = threading.Thread(target=self.import_collection_from_folder, args=(self.importer, directory))
+            t.start()
+            self.statusLabel.setText("Status: Importing "+directory)
+
+    def import_collection_from_folder(self, importer, directory):
+        try:
+            importer.run(directory)
+        finally:
+            self.importer = None
+        self.import_finished.emit()
+
+    def emit_import_progress(self, n_done, n_files, name, error):
+        """ is called from the threads of the importer and forwards the progress to the Qt event loop """
+        status = "done" if error is None else "failed " + name
+        self.import_progress.emit(n_done, n_files, status)
+
+    def slot_update_import_progress(self, n_done, n_files, status):
+        text = "Status: Imported "+str(n_done)+"/"+str(n_files)
+        if status != "done":
+            text += " ("+status+")"
+        self.statusLabel.setText(text)
 
     def delete_motion(self, motion_id_list):
         for motion_id in motion_id_list:
@@ -677,16 +713,16 @@ class MotionDBBrowserDialog(QDialog, Ui_Dialog):
         item = self.modelListWidget.currentItem()
         model_id = int(item.data(Qt.UserRole))
         model_name = str(item.text())
-        model_data_str = download_motion_model_from_remote_db(self.db_url, model_id, self.session)
+        model_data_str = self.db.get_motion_model(model_id)
         cluster_tree_data_str = download_cluster_tree_from_remote_db(self.db_url, model_id, self.session)
         if model_data_str is not None:
-            self.scene.object_builder.create_object("motion_primitive", model_name, model_data_str, cluster_tree_data_str)
+            ApplicationManager.instance.run_in_scene(self.scene.object_builder.create_object, "motion_primitive", model_name, model_data_str, cluster_tree_data_str)
 
     def slot_export_motion_model(self):
         item = self.modelListWidget.currentItem()
         model_id = int(item.data(Qt.UserRole))
         model_name = str(item.text())
-        model_data_str = download_motion_model_from_remote_db(self.db_url, model_id, self.session)
+        model_data_str = self.db.get_motion_model(model_id)
         if model_data_str is not None:
             filename = QFileDialog.getSaveFileName(self, 'Save To File', '.')[0]
             with open(filename, "w") as out_file:
@@ -695,7 +731,7 @@ class MotionDBBrowserDialog(QDialog, Ui_Dialog):
     def slot_create_cluster_tree(self):
         item = self.modelListWidget.currentItem()
         model_id = int(item.data(Qt.UserRole))
-        model_data_str = download_motion_model_from_remote_db(self.db_url, model_id, self.session)
+        model_data_str = self.db.get_motion_model(model_id)
         model = json.loads(model_data_str)
 
         tree = create_cluster_tree_from_model(model, self.n_samples, self.n_subdivisions_per_level)
@@ -739,49 +775,33 @@ class MotionDBBrowserDialog(QDialog, Ui_Dialog):
                 skeleton_data = get_skeleton_from_remote_db(self.db_url, skeleton_name, self.session)
                 save_json_file(skeleton_data, skeleton_dir + os.sep + skeleton_name+"_skeleton.json")
                 
-                #self.export_raw_motion_data(skeleton_name, skeleton_dir + os.sep + "raw")
-                self.export_processed_motion_data(skeleton_name, skeleton_dir + os.sep + "processed")
-                #self.export_aligned_motion_data(skeleton_name, skeleton_dir + os.sep + "aligned")
-                self.export_motion_models(skeleton_name, skeleton_dir + os.sep + "models")
+                # the clips and the models are downloaded by the same export run
+                exporter = self.create_exporter()
+                self.start_export(exporter, partial(self.add_database_export_jobs, exporter, skeleton_name, skeleton_dir))
                 break
                   
             
+    def add_database_export_jobs(self, exporter, skeleton_name, skeleton_dir):
+        #exporter.add_collection_tree(skeleton_name, skeleton_dir + os.sep + "raw")
+        exporter.add_collection_tree(skeleton_name, skeleton_dir + os.sep + "processed", 0, 0, self.model_filter)
+        #exporter.add_collection_tree(skeleton_name, skeleton_dir + os.sep + "aligned", 0, 1, self.model_filter)
+        exporter.add_model_tree(skeleton_name, skeleton_dir + os.sep + "models")
+
     def export_motion_models(self, skeleton_name, out_dir, parent=0):
-        for col in get_collections_by_parent_id_from_remote_db(self.db_url, parent, self.session):
-            col_id, col_name, col_type, owner = col
-            action_dir = out_dir+os.sep+col_name
-            self.export_motion_primitive_models(col_id, skeleton_name, action_dir)
-            self.export_motion_models(skeleton_name, action_dir, col_id)
+        exporter = self.create_exporter()
+        self.start_export(exporter, partial(exporter.add_model_tree, skeleton_name, out_dir, parent))
 
     def export_aligned_motion_data(self, skeleton_name, out_dir, parent=0):
-        for col in get_collections_by_parent_id_from_remote_db(self.db_url, parent):
-            col_id, col_name, col_type, owner = col
-            action_dir = out_dir+os.sep+col_name
-            if self.model_filter is None or col_name in self.model_filter:
-                self.export_collection_clips_to_folder(col_id, skeleton_name, action_dir, is_aligned=1)
-            self.export_aligned_motion_data(skeleton_name, action_dir, col_id)
+        exporter = self.create_exporter()
+        self.start_export(exporter, partial(exporter.add_collection_tree, skeleton_name, out_dir, parent, 1, self.model_filter))
 
     def export_processed_motion_data(self, skeleton_name, out_dir, parent=0):
-        for col in get_collections_by_parent_id_from_remote_db(self.db_url, parent):
-            print(col)
-            col_id, col_name, col_type, owner = col
-            action_dir = out_dir+os.sep+col_name
-            if self.model_filter is None or col_name in self.model_filter:
-                self.export_collection_clips_to_folder(col_id, skeleton_name, action_dir, is_aligned=0)
-            self.export_processed_motion_data(skeleton_name, action_dir, col_id)
+        exporter = self.create_exporter()
+        self.start_export(exporter, partial(exporter.add_collection_tree, skeleton_name, out_dir, parent, 0, self.model_filter))
 
     def export_motion_primitive_models(self, mp_name, skeleton_name, out_dir):
-        model_list = get_model_list_from_remote_db(self.db_url, mp_name, skeleton_name, self.session)
-        if len(model_list) > 0 and not os.path.isdir(out_dir):
-            os.makedirs(out_dir)
-        for model_id, name in model_list:
-            model_data_str = download_motion_model_from_remote_db(self.db_url, model_id, self.session)
-            with open(out_dir+ os.sep + name + "_quaternion_mm.json", "w+") as out_file:
-                out_file.write(model_data_str)
-            cluster_tree_data_str = download_cluster_tree_from_remote_db(self.db_url, model_id, self.session)
-            if cluster_tree_data_str is not None and len(cluster_tree_data_str) > 0:
-                with open(out_dir+ os.sep + name + "_cluster_tree.json", "w+") as out_file:
-                    out_file.write(cluster_tree_data_str)
+        exporter = self.create_exporter()
+        self.start_export(exporter, partial(exporter.add_motion_primitive_models, mp_name, skeleton_name, out_dir))
 
     def slot_retarget_motions(self, is_aligned=0):
         dialog = RetargetDBDialog(self.db_url)
@@ -816,6 +836,10 @@ class MotionDBBrowserDialog(QDialog, Ui_Dialog):
                 count+=1
 
     def slot_retarget_motions_parallel(self, is_aligned=0):
+        if self.retargeting_scheduler is not None and self.retargeting_scheduler.is_running():
+            print("cancel retargeting")
+            self.retargeting_scheduler.cancel()
+            return
         col = self.get_collection()
         if col is None:
             return
@@ -859,16 +883,23 @@ class MotionDBBrowserDialog(QDialog, Ui_Dialog):
                 joint_map = generate_joint_map(src_skeleton.skeleton_model, target_skeleton.skeleton_model)
                 retargeting = Retargeting(src_skeleton, target_skeleton, joint_map, src_scale, additional_rotation_map=None, place_on_ground=place_on_ground)
 
-                n_workers = cpu_count()
-                if n_workers > n_motions:
-                    n_workers = n_motions
-                n_batches = int(len(motions) / n_workers)
-                pool = ProcessPoolExecutor(max_workers=n_workers)
-                tasks = []
-                for motion_batch in chunks(motions, n_batches):
-                    t = run_retargeting_process(pool, self.db_url, motion_batch, retargeting, collection, target_skeleton_name, is_aligned, self.session)
-                    tasks.append(t)
-                asyncio.get_event_loop().run_until_complete(asyncio.gather(*tasks))
+                task_args = (self.db_url, collection, target_skeleton_name, is_aligned, self.session)
+                self.retargeting_scheduler = TaskScheduler(retargeting, retarget_motion_in_db_task, task_args,
+                                                           progress_callback=self.emit_retargeting_progress)
+                self.retargeting_scheduler.start(motions)
+                self.statusLabel.setText("Status: Retargeting "+str(n_motions)+" motions, press retarget again to cancel")
+
+    def emit_retargeting_progress(self, n_done, n_items, item, status, value):
+        """ is called from the thread of the scheduler and forwards the progress to the Qt event loop """
+        if status == STATUS_FAILED:
+            status += " " + str(item[1])
+        self.retargeting_progress.emit(n_done, n_items, status)
+
+    def slot_update_retargeting_progress(self, n_done, n_items, status):
+        text = "Status: Retargeted "+str(n_done)+"/"+str(n_items)
+        if status != "done":
+            text += " ("+status+")"
+        self.statusLabel.setText(text)
 
     def slot_copy_motions(self):
         dialog = CopyDBDialog(self.db_url)
@@ -880,6 +911,7 @@ class MotionDBBrowserDialog(QDialog, Ui_Dialog):
             items = self.processedMotionListWidget.selectedItems()
             n_motions = len(items)
             count = 1
+            self.db.prefetch_motions([int(item.data(Qt.UserRole)) for item in items], False, ["motion", "annotation"])
             for item in items:
                 motion_id = int(item.data(Qt.UserRole))
                 motion_name = str(item.text())
@@ -889,7 +921,7 @@ class MotionDBBrowserDialog(QDialog, Ui_Dialog):
                 count+=1
    
     def copy_motion_in_db(self, skeleton, motion_id, motion_name, collection, skeleton_model_name):
-        motion_data = get_motion_by_id_from_remote_db(self.db_url, motion_id, is_processed=False, session=self.session)
+        motion_data = self.db.get_motion(motion_id, is_processed=False)
         if motion_data is None:
             print("Error: motion data is empty")
             return
@@ -897,7 +929,7 @@ class MotionDBBrowserDialog(QDialog, Ui_Dialog):
         #motion_vector.from_custom_unity_format(motion_data)
         #bvh_str = get_bvh_string(skeleton, motion_vector.frames)
         #motion_vector.skeleton = skeleton
-        meta_info_str = get_annotation_by_id_from_remote_db(self.db_url, motion_id)
+        meta_info_str = self.db.get_annotation(motion_id)
         upload_motion_to_db(self.db_url, motion_name, motion_data, collection, skeleton_model_name, meta_info_str, session=self.session)
 
     def slot_edit_motions(self):
@@ -915,6 +947,7 @@ class MotionDBBrowserDialog(QDialog, Ui_Dialog):
             n_motions = len(items)
             skeleton = load_skeleton_from_db(self.db_url, skeleton_name, self.session)
             count = 1
+            self.db.prefetch_motions([int(item.data(Qt.UserRole)) for item in items], False, ["motion"])
             for item in items:
                 motion_id = int(item.data(Qt.UserRole))
                 motion_name = str(item.text())
@@ -923,22 +956,19 @@ class MotionDBBrowserDialog(QDialog, Ui_Dialog):
                 count += 1
 
     def edit_motion_in_db(self, skeleton, motion_id, motion_name, collection, skeleton_name, instructions): 
-        motion_data = get_motion_by_id_from_remote_db(self.db_url, motion_id, is_processed=False, session=self.session)
+        motion_data = self.db.get_motion(motion_id, is_processed=False)
         if motion_data is None:
             print("Error: motion data is empty")
             return
         motion_vector = MotionVector()
         motion_vector.from_custom_db_format(motion_data)
-        motion_vector.skeleton = skeleton
-        
-        anim_editor = AnimationEditorBase(skeleton, motion_vector)
-        for func_name, params in instructions:
-            anim_editor.apply_edit(func_name, params)
+        apply_command_history(skeleton, motion_vector, instructions)
 
         #bvh_str = get_bvh_string(skeleton, motion_vector.frames)
         motion_data = motion_vector.to_db_format()
         meta_data = None
         replace_motion_in_db(self.db_url, motion_id, motion_name, motion_data, collection, skeleton_name, meta_data, is_processed=False, session=self.session)
+        self.db.invalidate_motion(motion_id)
 
     def slot_set_timefunction(self):
         filename = QFileDialog.getOpenFileName(self, 'Open File', '.')[0]
@@ -950,6 +980,8 @@ class MotionDBBrowserDialog(QDialog, Ui_Dialog):
             items = self.processedMotionListWidget.selectedItems()
             n_motions = len(items)
             count = 1
+            motion_ids = [int(item.data(Qt.UserRole)) for item in items if str(item.text()) in temporal_data]
+            self.db.prefetch_motions(motion_ids, False, ["annotation"])
             for item in items:
                 motion_id = int(item.data(Qt.UserRole))
                 motion_name = str(item.text())
@@ -959,13 +991,16 @@ class MotionDBBrowserDialog(QDialog, Ui_Dialog):
                     data = ""
                     collection = ""
                     skeleton_name = ""
-                    meta_data = get_annotation_by_id_from_remote_db(self.db_url, motion_id, is_processed=False, session=self.session)
-                    if meta_data is None:
+                    meta_data = self.db.get_annotation(motion_id, is_processed=False)
+                    if meta_data is None or meta_data == "":
                         meta_data = dict()
+                    else:
+                        meta_data = json.loads(meta_data)
                     meta_data["time_function"] = time_function
                     meta_data =  bson.dumps(meta_data)
                     replace_motion_in_db(self.db_url, motion_id, motion_name, data, collection, 
                                         skeleton_name, meta_data, is_processed=True, session=self.session)
+                    self.db.invalidate_motion(motion_id)
                 count += 1
 
     def slot_generate_graph_definition(self):
@@ -1031,7 +1066,7 @@ class MotionDBBrowserDialog(QDialog, Ui_Dialog):
                 if len(model_list) <1:
                     continue
                 model_id, name = model_list[-1]
-                model_data_str = download_motion_model_from_remote_db(self.db_url, model_id, self.session)
+                model_data_str = self.db.get_motion_model(model_id)
                 with open(action_dir+ os.sep +  a+"_"+mp_name + "_quaternion_mm.json", "w+") as out_file:
                     out_file.write(model_data_str)
                 cluster_tree_data_str = download_cluster_tree_from_remote_db(self.db_url, model_id, self.session)
@@ -1056,7 +1091,7 @@ class MotionDBBrowserDialog(QDialog, Ui_Dialog):
             motion_vector = MotionVector()
             motion_vector.frames = [skeleton.reference_frame]
             motion_vector.n_frames = 1
-            self.scene.object_builder.create_object("animation_controller", skeleton_name, skeleton, motion_vector, skeleton.frame_time)
+            ApplicationManager.instance.run_in_scene(self.scene.object_builder.create_object, "animation_controller", skeleton_name, skeleton, motion_vector, skeleton.frame_time)
         else:
             print("Error: Could not load skeleton")
 
@@ -1082,6 +1117,7 @@ class MotionDBBrowserDialog(QDialog, Ui_Dialog):
                 meta_data = json.dumps(meta_data)
             if data is not None or meta_data is not None:
                 replace_skeleton_in_remote_db(self.db_url, name, data, meta_data, self.session)
+                self.db.invalidate_skeleton(name)
             print("replaced skeleton", skeleton_name)
 
     def slot_edit_skeleton(self):
@@ -1097,6 +1133,7 @@ class MotionDBBrowserDialog(QDialog, Ui_Dialog):
             print("edit skeleton")
             meta_data = json.dumps(skeleton_editor.skeleton_model)  
             replace_skeleton_in_remote_db(self.db_url, skeleton_name, skeleton_data, meta_data, self.session)
+            self.db.invalidate_skeleton(skeleton_name)
         else:
             print("ignore changes")
         
@@ -1111,8 +1148,9 @@ class MotionDBBrowserDialog(QDialog, Ui_Dialog):
             return
         print("loaded", len(motion_list), "clips")
         frame_sum = 0
+        motions = self.db.fetcher.fetch([motion_id for motion_id, name in motion_list], False, ["motion"])
         for motion_id, name in motion_list:
-            motion_data = get_motion_by_id_from_remote_db(self.db_url, motion_id, self.session)
+            motion_data = motions[motion_id]["motion"]
             if motion_data is None:
                 print("Error: motion data is empty")
                 return
@@ -23,12 +23,14 @@
 import collections
 import numpy as np
 from OpenGL.GL import *
-from PySide2.QtCore import QTimer, Qt
+from PySide2.QtCore import Qt
 from PySide2.QtWidgets import  QDialog, QAction, QColorDialog
 from .select_joints_dialog import SelectJointsDialog
 from motion_analysis.gui.widgets.scene_viewer import SceneViewerWidget
+from motion_analysis.gui.application_manager import ApplicationManager
 from vis_utils.scene.editor_scene import EditorScene
 from motion_analysis.annotation_editor import AnnotationEditor
+from motion_analysis.annotation_intervals import IntervalSet
 from motion_analysis.gui.layout.set_annotation_dialog_ui import Ui_Dialog
 
 def get_random_color():
@@ -59,10 +61,6 @@ class SetAnnotationDialog(QDialog, Ui_Dialog):
         self.displayFrameSpinBox.valueChanged.connect(self.display_changed)
         self.fps = 60
         self.dt = 1/60
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.draw)
-        self.timer.start(0)
-        self.timer.setInterval(1000.0/self.fps)
         self.view.makeCurrent()
         self.edit_scene = EditorScene(True)
         self.edit_scene.enable_scene_edit_widget = False
@@ -82,6 +80,9 @@ class SetAnnotationDialog(QDialog, Ui_Dialog):
         self.labelView.show()
         self.init_label_time_line()
         self.plot_objects = []
+        self.render_scheduler = ApplicationManager.instance.render_scheduler
+        self.render_scheduler.add_view("annotation editor", self.view, self.edit_scene, self.draw, watched_widget=self)
+        self.finished.connect(self.slot_finished)
 
     def init_actions(self):
         self.create_segment_action = QAction("Create Segment", self)
@@ -114,8 +115,11 @@ class SetAnnotationDialog(QDialog, Ui_Dialog):
         self.removeJointPlotButton.clicked.connect(self.remove_joint_plot)
 
 
+    def slot_finished(self, result=None):
+        self.render_scheduler.remove_view(self.view)
+
     def closeEvent(self, e):
-        self.timer.stop()
+        self.slot_finished()
         self.view.makeCurrent()
         try:
            del self.view
@@ -130,7 +134,6 @@ class SetAnnotationDialog(QDialog, Ui_Dialog):
             if self.view.graphics_context is not None:
                 self.view.resize(400,400)
                 self.initialized = True
-        self.edit_scene.update(self.dt)
         self.view.makeCurrent()
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
         self.view.graphics_context.render(self.edit_scene)
@@ -174,7 +177,7 @@ class SetAnnotationDialog(QDialog, Ui_Dialog):
         color = get_random_color()
         if self.editor.add_label(label, color):
             joint_indices = []
-            self.labelView.addLabel(label, joint_indices, color_map[label])
+            self.labelView.addLabel(label, joint_indices, color)
         self.edit_controller._motion._semantic_annotation = self.editor._semantic_annotation
         self.edit_controller._motion.label_color_map = self.editor._label_color_map
         self.fill_label_combobox()
@@ -212,26 +215,19 @@ class SetAnnotationDialog(QDialog, Ui_Dialog):
     
     def init_label_time_line(self):
         n_frames = self.edit_controller.getNumberOfFrames()
-        self.labelView.clearScene()
-        self.labelView.create_frame_indicator()
-        self.labelView.setTimeLineParameters(n_frames, 10)
+        self.labelView.initTimeLine(n_frames, 10)
         self.labelView.set_edit_start_frame(self.editor.prev_annotation_edit_frame_idx)
-        if len(self.editor._semantic_annotation) > 0:
-            for label, indices in self.editor._semantic_annotation.items():
-                color = [0,0,1]
-                if label in self.editor._label_color_map:
-                    color = self.editor._label_color_map[label]
-                joint_indices = []
-                n_entries = len(indices) 
-                if n_entries > 0 and type(indices[0]) == list:
-                    for i in range(n_entries):
-                        joint_indices += indices[i]
-                else:
-                    joint_indices = indices
-                self.labelView.addLabel(label, joint_indices, color)
-        else:
-            self.labelView.addLabel("empty", [], [0,0,0])
-  
+        self.edit_controller._motion._semantic_annotation = self.editor._semantic_annotation
+        labels = []
+        for label in self.editor.get_labels():
+            color = [0,0,1]
+            if label in self.editor._label_color_map:
+                color = self.editor._label_color_map[label]
+            labels.append((label, IntervalSet(self.editor.get_sections(label)), color))
+        if len(labels) == 0:
+            labels.append(("empty", IntervalSet(), [0,0,0]))
+        self.labelView.setLabels(labels)
+
     def split_annotation(self):
         frame_idx = self.edit_controller._motion.frame_idx
         n_frames = self.edit_controller._motion.get_n_frames()
@@ -253,7 +249,7 @@ class SetAnnotationDialog(QDialog, Ui_Dialog):
         frame_idx = self.edit_controller._motion.frame_idx
         current_label = str(self.labelComboBox.currentText())
         #current_label, current_entry_idx = self.get_annotation_of_frame(frame_idx)
-        if self.editor.remove_annotation_section(current_label, frame_idx):
+        if self.editor.remove_annotation_section(frame_idx, current_label):
             self.init_label_time_line()
 
     def overwrite_current_section_by_neighbor(self):
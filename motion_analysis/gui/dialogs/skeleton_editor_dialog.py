@@ -25,13 +25,14 @@ import math
 import numpy as np
 from copy import copy
 from PySide2.QtWidgets import  QDialog, QListWidgetItem, QTableWidgetItem, QTableWidget, QFileDialog
-from PySide2.QtCore import QTimer, Qt
+from PySide2.QtCore import Qt
 from PySide2.QtGui import QColor
 from OpenGL.GL import *
 from motion_analysis.gui.layout.skeleton_editor_dialog_ui import Ui_Dialog
 from .utils import get_animation_controllers
 from transformations import quaternion_matrix, quaternion_multiply, quaternion_about_axis
 from motion_analysis.gui.widgets.scene_viewer import SceneViewerWidget
+from motion_analysis.gui.application_manager import ApplicationManager
 from vis_utils.animation import load_motion_from_bvh
 from vis_utils.scene.editor_scene import EditorScene
 from vis_utils.animation.animation_editor import AnimationEditor
@@ -243,10 +244,6 @@ class SkeletonEditorDialog(QDialog, Ui_Dialog):
         self.radius = 1.5
         self.fps = 60
         self.dt = 1/60
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.draw)
-        self.timer.start(0)
-        self.timer.setInterval(1000.0/self.fps)
         self.skeleton = skeleton
         self.view.makeCurrent()
         self.scene = EditorScene(True)
@@ -314,6 +311,9 @@ class SkeletonEditorDialog(QDialog, Ui_Dialog):
         self.aligning_root_node = self.skeleton.aligning_root_node
         self.fill_root_combobox()
         self.init_aligning_root_node()
+        self.render_scheduler = ApplicationManager.instance.render_scheduler
+        self.render_scheduler.add_view("skeleton editor", self.view, self.scene, self.draw, watched_widget=self)
+        self.finished.connect(self.slot_finished)
 
 
     def init_aligning_root_node(self):
@@ -326,8 +326,11 @@ class SkeletonEditorDialog(QDialog, Ui_Dialog):
             if index >= 0:
                 self.aligningRootComboBox.setCurrentIndex(index)
 
+    def slot_finished(self, result=None):
+        self.render_scheduler.remove_view(self.view)
+
     def closeEvent(self, e):
-         self.timer.stop()
+         self.slot_finished()
          self.view.makeCurrent()
          del self.view
 
@@ -424,7 +427,6 @@ class SkeletonEditorDialog(QDialog, Ui_Dialog):
             if self.view.graphics_context is not None:
                 self.view.resize(400,400)
                 self.initialized = True
-        self.scene.update(self.dt)
         self.view.makeCurrent()
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
         self.view.graphics_context.render(self.scene)
@@ -26,6 +26,9 @@ import glob
 import collections
 from vis_utils.io import load_json_file, save_json_file
 from vis_utils.scene.legacy import ConstraintObject
+from motion_analysis.motion_db.import_pipeline import create_sections_from_annotation, read_annotation_file, \
+                                        get_meta_info_for_file, get_meta_info_from_keyframe
+from motion_analysis.annotation_intervals import create_intervals_from_annotation, create_sections_from_intervals
 
 def get_all_objects(scene):
     return scene.objectList()
@@ -46,39 +49,12 @@ def get_constraints(scene):
         if isinstance(sceneObject, ConstraintObject):
             yield sceneObject
 
-def create_sections_from_annotation(annotations):
-    motion_sections = dict()
-    for label in annotations:
-        annotations[label].sort()
-        section = dict()
-        section["start_idx"] = annotations[label][0]
-        section["end_idx"] = annotations[label][-1]
-        motion_sections[section["start_idx"]] = section
-    return list(collections.OrderedDict(sorted(motion_sections.items())).values())
-
 def create_section_dict_from_annotation(annotations):
-    motion_sections = dict()
-    for label, sections in annotations.items():
-        motion_sections[label] = []
-        for sub_section in sections:
-            sub_section.sort()
-            section_dict = dict()
-            section_dict["start_idx"] = sub_section[0]
-            section_dict["end_idx"] = sub_section[-1]
-            motion_sections[label].append(section_dict)
-    return motion_sections
-
-def read_annotation_file(annotation_filepath):
-    meta_info_str = ""
-    with open(annotation_filepath, "rt") as annotation_file:
-        print("read meta info from", annotation_filepath)
-        annotation_str = annotation_file.read()
-        annotation_data = json.loads(annotation_str)
-        meta_info_data = dict()
-        meta_info_data["sections"] = create_sections_from_annotation(annotation_data["semantic_annotation"])
-        meta_info_str = json.dumps(meta_info_data)
-    return meta_info_str
-
+    """ frame index lists with gaps are stored as several sections
+        the markers of a SectionAnnotation restore the format of the loaded meta information
+    """
+    is_list = getattr(annotations, "is_list", False)
+    return create_sections_from_intervals(create_intervals_from_annotation(annotations), is_list)
 
 def load_bvh_with_annotations(directory, skeleton_model="custom"):
     data = collections.OrderedDict()
@@ -89,21 +65,8 @@ def load_bvh_with_annotations(directory, skeleton_model="custom"):
             print("read", filename)
             bvh_str = in_file.read()
         if bvh_str is not None:
-            meta_info_str = ""
             #check for annoation
-            annotation_file_option1 = filename[:-4]+"_section.json"
-            annotation_file_option2 = filename[:-4]+"_sections.json"
-            meta_info_file = filename+"_meta_info.json"
-            if os.path.isfile(annotation_file_option1):
-                meta_info_str = read_annotation_file(annotation_file_option1)
-            elif os.path.isfile(annotation_file_option2):
-                meta_info_str = read_annotation_file(annotation_file_option2)
-            elif os.path.isfile(meta_info_file):
-                with open(meta_info_file, "rt") as meta_info_file:
-                    meta_info_str = meta_info_file.read()
-            else:
-                print("Did not find meta info for", filename)
-                meta_info_str = ""
+            meta_info_str = get_meta_info_for_file(filename)
             data[name] = dict()
             data[name]["meta_info"] = meta_info_str
             data[name]["bvh_str"] = bvh_str
@@ -127,21 +90,7 @@ def load_bvh_with_keyframes(directory, skeleton_model="custom"):
             bvh_str = in_file.read()
             
             key = name[:-4]
-            if key in keyframe_data:
-                meta_info_data = dict()
-                meta_info_data["sections"] = []
-                section = dict()
-                section["start_idx"] = 0
-                section["end_idx"] = keyframe_data[key]
-                meta_info_data["sections"].append(section)
-                section = dict()
-                section["start_idx"] = keyframe_data[key]
-                section["end_idx"] = -1
-                meta_info_data["sections"].append(section)
-                meta_info_str = json.dumps(meta_info_data)
-            else:
-                meta_info_str = ""
-
+            meta_info_str = get_meta_info_from_keyframe(keyframe_data, key)
 
             data[name] = dict()
             data[name]["meta_info"] = meta_info_str
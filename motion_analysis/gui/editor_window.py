@@ -43,6 +43,7 @@ from motion_analysis.gui.application_manager import ApplicationManager
 from motion_analysis.session_manager import SessionManager
 
 MG_COMPONENT = "morphablegraphs_controller"
+MG_STATE_MACHINE_COMPONENT = "morphablegraph_state_machine"
 ANIMATION_COMPONENT = "animation_controller"
 MP_COMPONENT = "motion_primitive_controller"
 BLEND_COMPONENT = "blend_controller"
@@ -110,32 +111,33 @@ class EditorWindow(QMainWindow, Ui_MainWindow):
                                         
                                     ]
             self.actions["Create"] = [
-                    {"text": "Group Animation Controller", "function": self.createGroupAnimationController},
-                    {"text": "Blend Animation Controller", "function": self.createBlendAnimationController},
+                    {"text": "Group Animation Controller", "function": self.createGroupAnimationController, "scene_call": True},
+                    {"text": "Blend Animation Controller", "function": self.createBlendAnimationController, "scene_call": True},
                     {"text": "spline", "function": self.startSplineDefinition},
                     {"text": "marker", "short_cut": "O","function": self.startMarkerDefinition},
                     {"text": "Stop editing", "short_cut": "E", "function": self.stopSceneInteraction}
                     ]
             if constants.vis_constants.activate_simulation:
-               self.actions["Create"] += [{"text": "Articulated Body", "function": self.addArticulatedBody},
-                                            {"text": "ode capsule object", "function": self.sceneManager.createCapsuleObject},
-                                            {"text": "ode box object", "function": self.sceneManager.createBoxObject},
-                                            {"text": "ode sphere object", "function": self.sceneManager.createSphereObject},
-                                            {"text": "ode linked capsule object", "function": self.sceneManager.createLinkedCapsuleObject},
-                                            {"text": "RagDoll", "function": self.sceneManager.createRagDoll}]
+               self.actions["Create"] += [{"text": "Articulated Body", "function": self.addArticulatedBody, "scene_call": True},
+                                            {"text": "ode capsule object", "function": self.sceneManager.createCapsuleObject, "scene_call": True},
+                                            {"text": "ode box object", "function": self.sceneManager.createBoxObject, "scene_call": True},
+                                            {"text": "ode sphere object", "function": self.sceneManager.createSphereObject, "scene_call": True},
+                                            {"text": "ode linked capsule object", "function": self.sceneManager.createLinkedCapsuleObject, "scene_call": True},
+                                            {"text": "RagDoll", "function": self.sceneManager.createRagDoll, "scene_call": True}]
             self.actions["View"] = [
                     {"text": "Set selected to camera target", "short_cut": "Ctrl+T", "function": self.setCameraTarget},
                     {"text": "Toggle full screen","short_cut": "F11", "function": self.toggleFullScreen},
-                    {"text": "Hide/Show Selected", "short_cut": "Ctrl+H", "function": self.toggleVisibility},
+                    {"text": "Hide/Show Selected", "short_cut": "Ctrl+H", "function": self.toggleVisibility, "scene_call": True},
                     {"text": "Save Screenshot", "short_cut": "Ctrl+E", "function": self.saveScreenshot}
 
             ]
             self.actions["Scene"] = [{"text": "Toggle scene widget", "function": self.toggleEditSceneWidget},
-                                     {"text": "Delete selected objects", "short_cut": "Del", "function": self.deleteSelectedObjects}]
+                                     {"text": "Delete selected objects", "short_cut": "Del", "function": self.deleteSelectedObjects, "scene_call": True},
+                                     {"text": "Toggle threaded update", "function": self.toggleThreadedUpdate}]
             if constants.vis_constants.activate_simulation:
-                 self.actions["Scene"] += [{"text": "Toggle simulation", "short_cut": "P", "function": self.toggleSimulation},
+                 self.actions["Scene"] += [{"text": "Toggle simulation", "short_cut": "P", "function": self.toggleSimulation, "scene_call": True},
                                             {"text": "Save simulation state","function": self.saveSimulationState},
-                                            {"text": "Restore simulation state", "function": self.restoreSimulationState}]
+                                            {"text": "Restore simulation state", "function": self.restoreSimulationState, "scene_call": True}]
             self.initActions()
             self.initMenus()
             self.initSlots()
@@ -205,16 +207,20 @@ class EditorWindow(QMainWindow, Ui_MainWindow):
                     for name in files:
                         if name.endswith(".bvh"):
                             filePath = os.path.join(root,name)
-                            self.sceneManager.scene.object_builder.create_object_from_file("bvh", filePath)
+                            self.create_object_from_file("bvh", filePath)
 
-    def _add_qt_action(self, function, text, short_cut=None, status_tip=None):
+    def _add_qt_action(self, function, text, short_cut=None, status_tip=None, scene_call=False):
         action_name = function.__name__ + 'Action'
         setattr(self, action_name, QAction(text, self))
         if short_cut is not None:
             getattr(self, action_name).setShortcut(short_cut)
         if status_tip is not None:
             getattr(self, action_name).setStatusTip(status_tip)
-        getattr(self, action_name).triggered.connect(function)
+        if scene_call:
+            # actions that change the scene without a dialog are run while the simulation thread is paused
+            getattr(self, action_name).triggered.connect(lambda checked=False: self.sceneManager.run_in_scene(function))
+        else:
+            getattr(self, action_name).triggered.connect(function)
 
     #======================================================================================================
     # ANIMATION VIEWER
@@ -271,15 +277,19 @@ class EditorWindow(QMainWindow, Ui_MainWindow):
         self.object_widgets[name].setEnabled(True)
         self.object_widgets[name].show()
 
+    def create_object_from_file(self, *args):
+        """ the file dialogs are opened directly, only the creation of the object is run by run_in_scene """
+        self.sceneManager.run_in_scene(self.sceneManager.scene.object_builder.create_object_from_file, *args)
+
     def loadBVHFile(self):
         filename = QFileDialog.getOpenFileName(self, 'Open File', '.')[0]
         if filename is not None:
-            self.sceneManager.scene.object_builder.create_object_from_file("bvh",str(filename))
+            self.create_object_from_file("bvh",str(filename))
 
     def loadASFFile(self):
         filename = QFileDialog.getOpenFileName(self, 'Open File', '.')[0]
         if filename is not None:
-            self.sceneManager.scene.object_builder.create_object_from_file("asf",str(filename))
+            self.create_object_from_file("asf",str(filename))
 
     def loadBVHFilesFromDirectory(self):
         directory = QFileDialog.getExistingDirectory(self, "Select Directory")
@@ -287,7 +297,7 @@ class EditorWindow(QMainWindow, Ui_MainWindow):
             for name in files:
                 if name.endswith(".bvh"):
                     filePath = os.path.join(root,name)
-                    self.sceneManager.scene.object_builder.create_object_from_file("bvh", filePath)
+                    self.create_object_from_file("bvh", filePath)
 
  
     def slotAddItemToObjectList(self, sceneId, name):
@@ -334,38 +344,41 @@ class EditorWindow(QMainWindow, Ui_MainWindow):
 
     def loadOBJFile(self):
         filename = QFileDialog.getOpenFileName(self, 'Open File', '.')[0]
-        self.sceneManager.scene.object_builder.create_object_from_file("obj", str(filename))
+        self.create_object_from_file("obj", str(filename))
 
     def loadCOLLADAFile(self):
         filename = QFileDialog.getOpenFileName(self, 'Open File', '.')[0]
-        self.sceneManager.scene.object_builder.create_object_from_file("dae", str(filename))
+        self.create_object_from_file("dae", str(filename))
 
     def loadFBXFile(self):
         filename = QFileDialog.getOpenFileName(self, 'Open File', '.')[0]
-        self.sceneManager.scene.object_builder.create_object_from_file("fbx", str(filename))
+        self.create_object_from_file("fbx", str(filename))
 
     def loadRagDoll(self):
         filename = QFileDialog.getOpenFileName(self, 'Open File', '.')[0]
         p = [0, 10, 0]
-        scene_object = self.sceneManager.scene.object_builder.create_object_from_file("ragdoll",p, str(filename))
+        self.sceneManager.run_in_scene(self._load_rag_doll, p, str(filename))
+
+    def _load_rag_doll(self, p, filename):
+        scene_object = self.sceneManager.scene.object_builder.create_object_from_file("ragdoll", p, filename)
         if scene_object is not None:
             self.sceneManager.scene.addAnimationController(scene_object, "character_animation_recorder")
 
     def loadMorphableGraphFile(self):
         filename = QFileDialog.getOpenFileName(self, 'Open File', '.')[0]
-        self.sceneManager.scene.object_builder.create_object_from_file("zip",str(filename))
+        self.create_object_from_file("zip",str(filename))
 
     def loadMorphableModelFile(self):
         filename = QFileDialog.getOpenFileName(self, 'Open File', '.')[0]
-        self.sceneManager.scene.object_builder.create_object_from_file("mm.json",str(filename))
+        self.create_object_from_file("mm.json",str(filename))
 
     def loadMorphableGraphStateMachine(self):
         filename = QFileDialog.getOpenFileName(self, 'Open File', '.')[0]
-        self.sceneManager.scene.object_builder.create_object_from_file("mg.zip", str(filename))
+        self.create_object_from_file("mg.zip", str(filename))
 
     def loadBlendController(self):
         filename = QFileDialog.getOpenFileName(self, 'Open File', '.')[0]
-        self.sceneManager.loadBlendController(str(filename))
+        self.sceneManager.run_in_scene(self.sceneManager.loadBlendController, str(filename))
 
     def openMotionDBBrowser(self):
         """ https://stackoverflow.com/questions/38309803/pyqt-non-modal-dialog-always-modal """
@@ -398,28 +411,28 @@ class EditorWindow(QMainWindow, Ui_MainWindow):
 
     def loadHeightMap(self):
         filename = QFileDialog.getOpenFileName(self, 'Open File', '.')[0]
-        self.sceneManager.loadHeightMap(str(filename))
+        self.sceneManager.run_in_scene(self.sceneManager.loadHeightMap, str(filename))
 
     def loadConstraintsFormat(self):
         filename = QFileDialog.getOpenFileName(self, 'Open File', '.')[0]
-        self.sceneManager.loadConstraintsFormat(str(filename))
+        self.sceneManager.run_in_scene(self.sceneManager.loadConstraintsFormat, str(filename))
 
     def loadPointCloud(self):
         filename = QFileDialog.getOpenFileName(self, 'Open File', '.')[0]
-        self.sceneManager.scene.object_builder.create_object_from_file("pc", str(filename))
+        self.create_object_from_file("pc", str(filename))
 
 
     def loadC3DFile(self):
         filename = QFileDialog.getOpenFileName(self, 'Open File', '.')[0]
-        self.sceneManager.scene.object_builder.create_object_from_file("c3d", str(filename))
+        self.create_object_from_file("c3d", str(filename))
 
     def runPythonScript(self):
         filename = QFileDialog.getOpenFileName(self, 'Open File', '.')[0]
-        self.sceneManager.runPythonScript(str(filename))
+        self.sceneManager.run_in_scene(self.sceneManager.runPythonScript, str(filename))
 
     def loadCustomUnityFormat(self):
         filename = QFileDialog.getOpenFileName(self, 'Open File', '.')[0]
-        self.sceneManager.scene.object_builder.create_object_from_file("_m.json", str(filename))
+        self.create_object_from_file("_m.json", str(filename))
 
     def changeSkeletonColor(self, item):
         color = QColorDialog.getColor()
@@ -471,6 +484,9 @@ class EditorWindow(QMainWindow, Ui_MainWindow):
 
     def toggleSimulation(self):
         self.sceneManager.scene.toggle_simulation()
+
+    def toggleThreadedUpdate(self):
+        self.sceneManager.toggle_threaded_update()
     
     def loginToServer(self):
         loginDialog = LoginDialog()
@@ -525,6 +541,10 @@ class EditorWindow(QMainWindow, Ui_MainWindow):
 
     def deleteSelectedObjects(self):
         node_ids = self.getSelectedSceneObjects()
+        for node_id in node_ids:
+            scene_object = self.sceneManager.getObject(node_id)
+            if scene_object is not None and scene_object.has_component(MG_STATE_MACHINE_COMPONENT):
+                scene_object._components[MG_STATE_MACHINE_COMPONENT].cleanup()
         self.sceneManager.scene.delete_objects(node_ids)
         self.deleteSceneTableEntries(node_ids)
 
@@ -253,6 +253,9 @@ class Ui_Dialog(object):
         self.undoButton = QtWidgets.QPushButton(Dialog)
         self.undoButton.setObjectName("undoButton")
         self.horizontalLayout_2.addWidget(self.undoButton)
+        self.redoButton = QtWidgets.QPushButton(Dialog)
+        self.redoButton.setObjectName("redoButton")
+        self.horizontalLayout_2.addWidget(self.redoButton)
         self.selectButton = QtWidgets.QPushButton(Dialog)
         self.selectButton.setObjectName("selectButton")
         self.horizontalLayout_2.addWidget(self.selectButton)
@@ -313,6 +316,7 @@ class Ui_Dialog(object):
         self.flipBlenderCoordinateSystemButton.setText(QtWidgets.QApplication.translate("Dialog", "Flip Blender Coordinate Systems", None, -1))
         self.exportCommandsButton.setText(QtWidgets.QApplication.translate("Dialog", "Export Commands", None, -1))
         self.undoButton.setText(QtWidgets.QApplication.translate("Dialog", "Undo", None, -1))
+        self.redoButton.setText(QtWidgets.QApplication.translate("Dialog", "Redo", None, -1))
         self.selectButton.setText(QtWidgets.QApplication.translate("Dialog", "Accept", None, -1))
         self.cancelButton.setText(QtWidgets.QApplication.translate("Dialog", "Cancel", None, -1))
 
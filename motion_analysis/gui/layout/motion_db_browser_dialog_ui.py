@@ -91,7 +91,7 @@ class Ui_Dialog(object):
         self.clip_tab.setObjectName("clip_tab")
         self.gridLayout = QtWidgets.QGridLayout(self.clip_tab)
         self.gridLayout.setObjectName("gridLayout")
-        self.processedMotionListWidget = QtWidgets.QListWidget(self.clip_tab)
+        self.processedMotionListWidget = MotionListView(self.clip_tab)
         self.processedMotionListWidget.setObjectName("processedMotionListWidget")
         self.gridLayout.addWidget(self.processedMotionListWidget, 0, 0, 1, 1)
         self.horizontalLayout_2 = QtWidgets.QHBoxLayout()
@@ -146,7 +146,7 @@ class Ui_Dialog(object):
         self.aligned_tab.setObjectName("aligned_tab")
         self.verticalLayout_3 = QtWidgets.QVBoxLayout(self.aligned_tab)
         self.verticalLayout_3.setObjectName("verticalLayout_3")
-        self.alignedMotionListWidget = QtWidgets.QListWidget(self.aligned_tab)
+        self.alignedMotionListWidget = MotionListView(self.aligned_tab)
         self.alignedMotionListWidget.setObjectName("alignedMotionListWidget")
         self.verticalLayout_3.addWidget(self.alignedMotionListWidget)
         self.horizontalLayout_8 = QtWidgets.QHBoxLayout()
@@ -184,7 +184,7 @@ class Ui_Dialog(object):
         self.model_tab.setObjectName("model_tab")
         self.gridLayout_2 = QtWidgets.QGridLayout(self.model_tab)
         self.gridLayout_2.setObjectName("gridLayout_2")
-        self.modelListWidget = QtWidgets.QListWidget(self.model_tab)
+        self.modelListWidget = MotionListView(self.model_tab)
         self.modelListWidget.setObjectName("modelListWidget")
         self.gridLayout_2.addWidget(self.modelListWidget, 0, 0, 1, 1)
         self.horizontalLayout = QtWidgets.QHBoxLayout()
@@ -292,3 +292,4 @@ class Ui_Dialog(object):
         self.exportDatabaseButton.setText(QtWidgets.QApplication.translate("Dialog", "Export Database To Folder", None, -1))
         self.generateMGFromFIleButton.setText(QtWidgets.QApplication.translate("Dialog", "Generate Morphable Graph ", None, -1))
 
+from motion_analysis.gui.widgets.motion_list_view import MotionListView
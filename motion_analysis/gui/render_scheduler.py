@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 DFKI GmbH.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the
+# following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+# NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE
+# USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Renders the views of the editor dialogs on the frame clock of the ApplicationManager instead of one timer per dialog.
+A view is only rendered if its scene was marked as dirty, if it is animating or if the idle interval has passed.
+Mouse, wheel and key events in the view or in the widget of its dialog mark the scene as dirty automatically.
+The render times of each view are collected and can be queried with get_statistics.
+Dialogs remove their views when they are finished, because Esc, reject and done skip closeEvent.
+Hidden views are not rendered and views that were deleted without remove_view are dropped.
+"""
+import time
+from PySide2.QtCore import QObject, QEvent, Qt
+from PySide2.QtWidgets import QWidget
+from OpenGL.GL import *
+
+IDLE_INTERVAL = 0.5
+INPUT_EVENTS = (QEvent.MouseButtonPress, QEvent.MouseButtonRelease, QEvent.MouseButtonDblClick, QEvent.Wheel,
+                QEvent.KeyPress, QEvent.KeyRelease)
+VIEW_EVENTS = (QEvent.MouseMove, QEvent.Resize, QEvent.Show, QEvent.Paint)
+
+
+class RenderTarget(object):
+    def __init__(self, name, view, scene, draw_func=None, is_animating=None):
+        self.name = name
+        self.view = view
+        self.scene = scene
+        self.draw_func = draw_func
+        self.is_animating = is_animating
+        self.dirty = True
+        self.last_render_time = 0.0
+        self.n_rendered = 0
+        self.n_skipped = 0
+        self.render_time_sum = 0.0
+        self.max_render_time = 0.0
+
+    def needs_update(self, t, idle_interval):
+        if self.dirty or t - self.last_render_time > idle_interval:
+            return True
+        return self.is_animating is not None and self.is_animating()
+
+    def render(self):
+        if self.draw_func is not None:
+            self.draw_func()
+            return
+        if self.view.graphics_context is None:
+            return
+        self.view.makeCurrent()
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        self.view.graphics_context.render(self.scene)
+        self.view.swapBuffers()
+
+    def get_statistics(self):
+        stats = dict()
+        stats["n_rendered"] = self.n_rendered
+        stats["n_skipped"] = self.n_skipped
+        stats["mean_render_time"] = self.render_time_sum / self.n_rendered if self.n_rendered > 0 else 0.0
+        stats["max_render_time"] = self.max_render_time
+        return stats
+
+
+class _DirtyEventFilter(QObject):
+    """ marks the scene as dirty when the user interacts with the view or the widgets of the dialog """
+    def __init__(self, scheduler, scene, view):
+        QObject.__init__(self)
+        self.scheduler = scheduler
+        self.scene = scene
+        self.view = view
+
+    def eventFilter(self, obj, event):
+        event_type = event.type()
+        if event_type in INPUT_EVENTS:
+            self.scheduler.mark_dirty(self.scene)
+        elif event_type in VIEW_EVENTS:
+            if obj is self.view or (event_type == QEvent.MouseMove and event.buttons() != Qt.NoButton):
+                self.scheduler.mark_dirty(self.scene)
+        return False
+
+
+class RenderScheduler(object):
+    def __init__(self, idle_interval=IDLE_INTERVAL):
+        self.idle_interval = idle_interval
+        self.targets = []
+        self.event_filters = dict()
+
+    def add_view(self, name, view, scene, draw_func=None, is_animating=None, watched_widget=None):
+        """ draw_func replaces the default rendering of the scene on the view
+            is_animating is a function that returns True while the scene has to be updated every frame
+            input events in watched_widget and its children mark the scene as dirty
+        """
+        target = RenderTarget(name, view, scene, draw_func, is_animating)
+        self.targets.append(target)
+        event_filter = _DirtyEventFilter(self, scene, view)
+        widgets = [view]
+        if watched_widget is not None:
+            widgets += [watched_widget] + watched_widget.findChildren(QWidget)
+        for widget in widgets:
+            widget.installEventFilter(event_filter)
+        self.event_filters[id(view)] = (event_filter, widgets)
+        return target
+
+    def remove_view(self, view):
+        self.targets = [t for t in self.targets if t.view is not view]
+        if id(view) in self.event_filters:
+            event_filter, widgets = self.event_filters.pop(id(view))
+            for widget in widgets:
+                try:
+                    widget.removeEventFilter(event_filter)
+                except:
+                    pass
+
+    def mark_dirty(self, scene=None):
+        """ renders the views of the scene or all views in the next frame """
+        for target in self.targets:
+            if scene is None or target.scene is scene:
+                target.dirty = True
+
+    def update(self, dt):
+        """ updates each scene that needs to be rendered once and renders its views """
+        t = time.perf_counter()
+        updated_scenes = []
+        for target in list(self.targets):
+            try:
+                is_visible = target.view.isVisible()
+            except RuntimeError:
+                # the dialog deleted the view without calling remove_view
+                self.remove_view(target.view)
+                continue
+            if not is_visible or not target.needs_update(t, self.idle_interval):
+                target.n_skipped += 1
+                continue
+            if not any(target.scene is s for s in updated_scenes):
+                target.scene.update(dt)
+                updated_scenes.append(target.scene)
+            start = time.perf_counter()
+            target.render()
+            render_time = time.perf_counter() - start
+            target.dirty = False
+            target.last_render_time = t
+            target.n_rendered += 1
+            target.render_time_sum += render_time
+            target.max_render_time = max(target.max_render_time, render_time)
+
+    def get_statistics(self):
+        """ returns the number of rendered and skipped frames and the mean and maximum render time per view """
+        return dict((target.name, target.get_statistics()) for target in self.targets)
+
+    def reset_statistics(self):
+        for target in self.targets:
+            target.n_rendered = 0
+            target.n_skipped = 0
+            target.render_time_sum = 0.0
+            target.max_render_time = 0.0
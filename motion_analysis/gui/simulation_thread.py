@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 DFKI GmbH.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the
+# following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+# NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE
+# USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Advances the animation controllers of a scene on a worker thread with a fixed time step so that slow
+controllers do not block the event loop of the GUI. After each step the poses of the animation controllers
+are copied into a PoseSnapshotBuffer that keeps the two latest snapshots. The GUI thread renders between the
+two snapshots without waiting for the worker by interpolating the poses and writing them into the skeleton
+visualizations. While the worker owns the controllers, their visualizations are replaced by a
+DeferredVisualization that drops the pose updates of the worker, so only the GUI thread writes the
+visualizations. All other scene objects are updated by the GUI thread.
+The worker holds the scene lock during a step. Changes of the scene by the GUI thread are made while the
+worker is paused between two steps, see pause_requested.
+"""
+import time
+import threading
+import traceback
+import numpy as np
+from ..motion_synthesis.blend_animation_controller import quaternion_slerp_batch
+
+ANIMATION_COMPONENT = "animation_controller"
+PHASES = ["sim", "animation", "render"]
+MAX_STEP_LAG = 0.25
+PAUSE_WAIT_TIME = 0.005
+
+
+class PhaseTimings(object):
+    """ accumulates the durations of the update phases from several threads """
+    def __init__(self, phases=PHASES):
+        self.phases = phases
+        self._lock = threading.Lock()
+        self._sums = dict()
+        self._counts = dict()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            for phase in self.phases:
+                self._sums[phase] = 0.0
+                self._counts[phase] = 0
+
+    def add(self, phase, duration):
+        with self._lock:
+            self._sums[phase] += duration
+            self._counts[phase] += 1
+
+    def get_averages(self, reset=True):
+        """ returns the average duration of each phase in seconds since the last reset """
+        with self._lock:
+            averages = dict()
+            for phase in self.phases:
+                n = self._counts[phase]
+                averages[phase] = self._sums[phase] / n if n > 0 else 0.0
+                if reset:
+                    self._sums[phase] = 0.0
+                    self._counts[phase] = 0
+        return averages
+
+    def to_string(self, averages):
+        return " | ".join(phase + " " + str(round(averages[phase] * 1000, 1)) + " ms" for phase in self.phases)
+
+
+class DeferredVisualization(object):
+    """ replaces the visualization of a controller that is updated by the simulation thread.
+        Pose updates of the controller are dropped and all other attributes are forwarded to the visualization.
+    """
+    def __init__(self, visualization):
+        object.__setattr__(self, "visualization", visualization)
+
+    def updateTransformation(self, *args, **kwargs):
+        return
+
+    def __getattr__(self, name):
+        return getattr(self.visualization, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.visualization, name, value)
+
+
+def get_animation_controller(scene_object):
+    """ returns the animation controller of the object if it has a visualization or None """
+    if not scene_object.has_component(ANIMATION_COMPONENT):
+        return None
+    controller = scene_object._components[ANIMATION_COMPONENT]
+    if getattr(controller, "_visualization", None) is None:
+        return None
+    return controller
+
+
+def get_visualization(controller):
+    visualization = controller._visualization
+    if isinstance(visualization, DeferredVisualization):
+        return visualization.visualization
+    return visualization
+
+
+def attach_controllers(scene):
+    """ defers the visualization of each animation controller and returns the objects that are updated by the worker """
+    scene_objects = []
+    for scene_object in scene.objectList():
+        controller = get_animation_controller(scene_object)
+        if controller is None:
+            continue
+        if not isinstance(controller._visualization, DeferredVisualization):
+            controller._visualization = DeferredVisualization(controller._visualization)
+        scene_objects.append(scene_object)
+    return scene_objects
+
+
+def detach_controllers(scene_objects):
+    """ gives the animation controllers their visualizations back """
+    for scene_object in scene_objects:
+        controller = get_animation_controller(scene_object)
+        if controller is not None:
+            controller._visualization = get_visualization(controller)
+
+
+class PoseSnapshot(object):
+    """ current frames of the animation controllers of a scene at a step time """
+    def __init__(self, t):
+        self.time = t
+        self.frames = dict()
+
+    @classmethod
+    def from_objects(cls, scene_objects, t):
+        snapshot = cls(t)
+        for scene_object in scene_objects:
+            controller = get_animation_controller(scene_object)
+            if controller is None:
+                continue
+            frame = controller.get_current_frame()
+            if frame is not None:
+                snapshot.frames[scene_object.node_id] = (controller, np.array(frame, dtype=np.float64))
+        return snapshot
+
+
+def interpolate_frames(frame_a, frame_b, weight):
+    """ interpolates the root translation linearly and the joint quaternions with slerp """
+    if len(frame_a) != len(frame_b) or (len(frame_a) - 3) % 4 != 0:
+        return frame_b
+    frame = np.empty(len(frame_a))
+    frame[:3] = (1.0 - weight) * frame_a[:3] + weight * frame_b[:3]
+    q_a = frame_a[3:].reshape((-1, 4))
+    q_b = frame_b[3:].reshape((-1, 4))
+    frame[3:] = quaternion_slerp_batch(q_a, q_b, weight).reshape(-1)
+    return frame
+
+
+class PoseSnapshotBuffer(object):
+    """ double buffer of the previous and the latest snapshot written by the simulation thread """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._previous = None
+        self._latest = None
+
+    def write(self, snapshot):
+        with self._lock:
+            self._previous, self._latest = self._latest, snapshot
+
+    def read(self):
+        with self._lock:
+            return self._previous, self._latest
+
+    def clear(self):
+        with self._lock:
+            self._previous = None
+            self._latest = None
+
+    def apply(self, t):
+        """ writes the poses interpolated at time t into the skeleton visualizations.
+            t should lag one step behind the latest snapshot so that there are two snapshots around it.
+        """
+        previous, latest = self.read()
+        if latest is None:
+            return
+        weight = 1.0
+        if previous is not None and latest.time > previous.time:
+            weight = min(max((t - previous.time) / (latest.time - previous.time), 0.0), 1.0)
+        for node_id, (controller, frame) in latest.frames.items():
+            if previous is not None and weight < 1.0 and node_id in previous.frames:
+                frame = interpolate_frames(previous.frames[node_id][1], frame, weight)
+            get_visualization(controller).updateTransformation(frame, controller.scene_object.scale_matrix)
+
+
+def step_scene(scene, dt, sim_dt, n_sim_steps, timings=None):
+    """ runs the simulation steps and the update of the scene objects and records the duration of each phase """
+    start = time.perf_counter()
+    scene.before_update(dt)
+    for i in range(0, n_sim_steps):
+        scene.sim_update(sim_dt)
+    sim_end = time.perf_counter()
+    scene.update(dt)
+    scene.after_update(dt)
+    if timings is not None:
+        timings.add("sim", sim_end - start)
+        timings.add("animation", time.perf_counter() - sim_end)
+
+
+def step_objects(scene_objects, dt, timings=None):
+    """ updates only the given objects, which is used for the animation controllers on the simulation thread """
+    start = time.perf_counter()
+    for scene_object in scene_objects:
+        scene_object.update(dt)
+    if timings is not None:
+        timings.add("animation", time.perf_counter() - start)
+
+
+class SimulationThread(threading.Thread):
+    """ updates the objects returned by attach_controllers with a fixed time step and writes a pose snapshot after each step.
+        The objects may only be replaced with set_scene_objects while the scene lock is held.
+        If a step takes longer than the time step, the following steps are started immediately
+        until the thread lags more than MAX_STEP_LAG behind, then the missed steps are dropped.
+        No step is started while pause_requested is set, so the GUI thread can acquire the scene lock without blocking.
+        An exception in a step ends the thread and is stored in error.
+    """
+    def __init__(self, scene_objects, scene_lock, pose_buffer, step_dt=1.0/60, timings=None):
+        threading.Thread.__init__(self, name="simulation")
+        self.daemon = True
+        self.scene_objects = list(scene_objects)
+        self.scene_lock = scene_lock
+        self.pose_buffer = pose_buffer
+        self.step_dt = step_dt
+        self.timings = timings
+        self.n_steps = 0
+        self.n_dropped_steps = 0
+        self.error = None
+        self.pause_requested = threading.Event()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        next_step_time = time.perf_counter()
+        while not self._stop_event.is_set():
+            if self.pause_requested.is_set():
+                self._stop_event.wait(PAUSE_WAIT_TIME)
+                next_step_time = time.perf_counter()
+                continue
+            try:
+                with self.scene_lock:
+                    step_objects(self.scene_objects, self.step_dt, self.timings)
+                    snapshot = PoseSnapshot.from_objects(self.scene_objects, next_step_time)
+            except Exception:
+                self.error = traceback.format_exc()
+                print("Error: stop simulation thread after exception in step", self.n_steps)
+                print(self.error)
+                return
+            self.pose_buffer.write(snapshot)
+            self.n_steps += 1
+            next_step_time += self.step_dt
+            wait_time = next_step_time - time.perf_counter()
+            if wait_time > 0:
+                self._stop_event.wait(wait_time)
+            elif wait_time < -MAX_STEP_LAG:
+                n_dropped = int(-wait_time / self.step_dt)
+                self.n_dropped_steps += n_dropped
+                next_step_time += n_dropped * self.step_dt
+
+    def set_scene_objects(self, scene_objects):
+        self.scene_objects = list(scene_objects)
+
+    def stop(self, timeout=1.0):
+        self._stop_event.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
@@ -44,6 +44,7 @@ except:
 from motion_analysis.gui.dialogs.set_annotation_dialog import SetAnnotationDialog
 from motion_analysis.gui.dialogs.utils import load_local_skeleton, load_local_skeleton_model, save_local_skeleton, create_sections_from_annotation, create_section_dict_from_annotation
 from motion_analysis import constants
+from motion_analysis.annotation_intervals import IntervalSet, create_interval_set_from_indices
 from anim_utils.utilities.db_interface import replace_motion_in_db
 from motion_analysis.gui.application_manager import ApplicationManager
 from motion_analysis.session_manager import SessionManager
@@ -112,28 +113,20 @@ class AnimationPlayerBaseWidget(QWidget):
 
     def init_label_time_line(self):
         n_frames = self._controller.getNumberOfFrames()
-        self.labelView.clearScene()
-        self.labelView.create_frame_indicator()
-        self.labelView.setTimeLineParameters(n_frames, 10)
+        self.labelView.initTimeLine(n_frames, 10)
         self.labelView.set_edit_start_frame(self.prev_annotation_edit_frame_idx)
         semantic_annotation = self._controller.get_semantic_annotation()
         color_map = self._controller.get_label_color_map()
+        labels = []
         if semantic_annotation is not None and color_map is not None:
             for label, indices in semantic_annotation:
                 color = [0,0,1]
                 if label in color_map:
                     color = color_map[label]
-                joint_indices = []
-                n_entries = len(indices) 
-                if n_entries > 0 and type(indices[0]) == list:
-                    for i in range(n_entries):
-                        joint_indices += indices[i]
-                else:
-                    joint_indices = indices
-       
-                self.labelView.addLabel(label, joint_indices, color)
-        else:
-            self.labelView.addLabel("empty", [], [0,0,0])
+                labels.append((label, create_interval_set_from_indices(indices), color))
+        if len(labels) == 0:
+            labels.append(("empty", IntervalSet(), [0,0,0]))
+        self.labelView.setLabels(labels)
 
     def init_animation_player_actions(self):
         self.toggle_animation_action = QAction("Play", self)
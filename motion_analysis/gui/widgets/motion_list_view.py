@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 DFKI GmbH.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the
+# following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+# NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE
+# USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+List view for the motions and models of the database browser. The entries are stored as a list of (id, name)
+tuples in a QAbstractListModel, so no item object is created per motion. The view provides selectedItems,
+currentItem and clear like a QListWidget.
+"""
+from PySide2.QtCore import Qt, QAbstractListModel, QModelIndex
+from PySide2.QtWidgets import QListView
+
+
+class MotionListModel(QAbstractListModel):
+    def __init__(self, parent=None):
+        QAbstractListModel.__init__(self, parent)
+        self._items = []
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._items)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self._items):
+            return None
+        node_id, name = self._items[index.row()]
+        if role == Qt.DisplayRole or role == Qt.ToolTipRole:
+            return name
+        elif role == Qt.UserRole:
+            return node_id
+        return None
+
+    def set_items(self, items):
+        self.beginResetModel()
+        self._items = list(items)
+        self.endResetModel()
+
+    def get_item(self, row):
+        return self._items[row]
+
+
+class MotionListItem(object):
+    """ read only replacement of a QListWidgetItem for the row of a MotionListModel """
+    def __init__(self, node_id, name):
+        self.node_id = node_id
+        self.name = name
+
+    def text(self):
+        return self.name
+
+    def data(self, role):
+        if role == Qt.UserRole:
+            return self.node_id
+        elif role == Qt.DisplayRole:
+            return self.name
+        return None
+
+
+class MotionListView(QListView):
+    def __init__(self, parent=None):
+        QListView.__init__(self, parent)
+        self.list_model = MotionListModel(self)
+        self.setModel(self.list_model)
+        # all rows have the same height so the view does not measure every entry
+        self.setUniformItemSizes(True)
+        self.setLayoutMode(QListView.Batched)
+        self.setEditTriggers(QListView.NoEditTriggers)
+
+    def set_items(self, items):
+        self.list_model.set_items(items)
+
+    def clear(self):
+        self.list_model.set_items([])
+
+    def count(self):
+        return self.list_model.rowCount()
+
+    def selectedItems(self):
+        rows = sorted(index.row() for index in self.selectionModel().selectedRows())
+        return [MotionListItem(*self.list_model.get_item(row)) for row in rows]
+
+    def currentItem(self):
+        index = self.currentIndex()
+        if not index.isValid():
+            return None
+        return MotionListItem(*self.list_model.get_item(index.row()))
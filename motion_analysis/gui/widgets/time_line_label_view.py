@@ -20,9 +20,11 @@
 # DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
 # OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE
 # USE OR OTHER DEALINGS IN THE SOFTWARE.
+import bisect
 from PySide2.QtCore import QRectF, QPointF, Qt, QSizeF
 from PySide2.QtWidgets import  QGraphicsItem, QGraphicsView, QGraphicsScene
 from PySide2.QtGui import  QColor, QBrush, QFont, QTransform
+from motion_analysis.annotation_intervals import IntervalSet, create_interval_set_from_indices
 drag_mode = QGraphicsView.DragMode.RubberBandDrag # 1
 transform_anchor = QGraphicsView.ViewportAnchor.NoAnchor # 0
 blue = QColor()
@@ -73,14 +75,18 @@ class FrameIndicator(QGraphicsItem):
 
 
 class TimeLine(QGraphicsItem):
-    def __init__(self, label, indices, pos, length, height, label_width, frame_width, color, parent=None):
+    """ draws the sections of a label as one rectangle per run of consecutive frames.
+        Only the runs inside the exposed rect are drawn and the result is cached by Qt as a pixmap
+        in device coordinates, which is reused while the view is only translated and redrawn when the zoom changes.
+    """
+    def __init__(self, label, intervals, pos, length, height, label_width, frame_width, color, parent=None):
         super(TimeLine, self).__init__(parent)
         self._pos = pos
         self._length = length
         self._height = height
         self.label = label
         self._label_width = label_width
-        self._indices = indices
+        self._intervals = intervals
         self.frame_width = frame_width
 
         size = QSizeF()
@@ -92,23 +98,45 @@ class TimeLine(QGraphicsItem):
         self._bounding_rect.setSize(size)
         self._tpos = QPointF(pos)
         self._tpos.setY(pos.y()+self._height)
+        self.set_color(color)
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)
+        self.setCacheMode(QGraphicsItem.DeviceCoordinateCache)
+
+    def set_color(self, color):
+        self._color_values = list(color)
         self.color = QColor()
         self.color.setRed(color[0] * 255)
         self.color.setGreen(color[1]* 255)
         self.color.setBlue(color[2] * 255)
         self.color.setAlpha(255)
 
+    def set_intervals(self, intervals, color=None):
+        """ repaints the time line only if the sections or the color have changed """
+        changed = intervals.starts != self._intervals.starts or intervals.ends != self._intervals.ends
+        if color is not None and list(color) != self._color_values:
+            self.set_color(color)
+            changed = True
+        self._intervals = intervals
+        if changed:
+            self.update()
+        return changed
 
     def paint(self, painter, styleoptions, parent=None):
-        #brush = QtGui.QBrush()
-        #brush.setColor(blue)
         painter.setBrush(self.color)
-        for idx in self._indices:
-            x = self._pos.x() + self._label_width + self.frame_width * idx
-            painter.drawRect(x, self._pos.y(), self.frame_width, self._height)
+        x_offset = self._pos.x() + self._label_width
+        exposed_rect = styleoptions.exposedRect
+        start_frame = int((exposed_rect.left() - x_offset) / self.frame_width)
+        end_frame = int((exposed_rect.right() - x_offset) / self.frame_width) + 1
+        starts = self._intervals.starts
+        ends = self._intervals.ends
+        first = max(0, bisect.bisect_right(starts, start_frame) - 1)
+        last = bisect.bisect_right(starts, end_frame)
+        for i in range(first, last):
+            if ends[i] < start_frame:
+                continue
+            x = x_offset + self.frame_width * starts[i]
+            painter.drawRect(QRectF(x, self._pos.y(), self.frame_width * (ends[i] - starts[i]), self._height))
 
-        #brush = QtGui.QBrush()
-        #brush.setColor(red)
         painter.setBrush(black)
         painter.drawLine(self._pos.x(), self._pos.y(), self._pos.x()+self._length, self._pos.y())
         painter.setPen(black)
@@ -169,16 +197,32 @@ class TimeLineLabelView(QGraphicsView):
         self.labels = []
         self.time_lines = dict()
         self._label_scene.clear()
+        self.frame_indicator = None
+        self.edit_start_frame_indicator = None
+
+    def initTimeLine(self, n_frames, label_height=10):
+        """ clears the scene only if the number of frames has changed so that the time lines can be updated in place """
+        if self.frame_indicator is not None and self.time_line_length == self.frame_width*n_frames and self.label_height == label_height:
+            return
+        self.clearScene()
+        self.create_frame_indicator()
+        self.setTimeLineParameters(n_frames, label_height)
 
     def setTimeLineParameters(self, time_line_length, label_height):
         self.label_height = label_height
         self.time_line_length = self.frame_width*time_line_length
 
     def addLabel(self, l, indices, color):
+        """ indices is a list of frame indices or a list of lists of frame indices """
+        self.addLabelSections(l, create_interval_set_from_indices(indices), color)
+
+    def addLabelSections(self, l, intervals, color):
+        if not isinstance(intervals, IntervalSet):
+            intervals = IntervalSet(intervals)
         y = len(self.labels)*self.label_height
         pos = QPointF(0, y)
         label = l
-        timeline = TimeLine(label, indices, pos, self.time_line_length,
+        timeline = TimeLine(label, intervals, pos, self.time_line_length,
                                                 self.label_height,
                                                 self.label_width,
                                                 self.frame_width,
@@ -189,6 +233,22 @@ class TimeLineLabelView(QGraphicsView):
 
         self.setSceneRect(0, 0, self.time_line_length, self.label_height*len(self.labels))
 
+    def setLabels(self, labels):
+        """ labels is a list of tuples of label, IntervalSet and color
+            if the labels are the same as before only the changed time lines are repainted
+        """
+        names = [label for label, intervals, color in labels]
+        if names == self.labels and all(t._length == self.time_line_length for t in self.time_lines.values()):
+            for label, intervals, color in labels:
+                self.time_lines[label].set_intervals(intervals, color)
+            return
+        for timeline in self.time_lines.values():
+            self._label_scene.removeItem(timeline)
+        self.labels = []
+        self.time_lines = dict()
+        for label, intervals, color in labels:
+            self.addLabelSections(label, intervals, color)
+
     def mousePressEvent(self, event):
         if event.button() == Qt.LeftButton:
             self.m_originX = event.x()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 DFKI GmbH.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the
+# following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+# NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE
+# USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Runs the requests of the database browser in a thread pool so that the GUI thread does not wait for the server.
+Requests are grouped into channels, e.g. one per list of the browser. A new request on a channel makes the
+previous one stale: it is cancelled if it has not started yet and its result is dropped otherwise.
+The callbacks are called from the worker threads, so Qt code has to forward the results with a signal.
+"""
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncDBLoader(object):
+    def __init__(self, n_workers=4):
+        self.executor = ThreadPoolExecutor(max(1, n_workers))
+        self.lock = threading.RLock()
+        self.versions = dict()
+        self.futures = dict()
+        self.closed = False
+
+    def submit(self, channel, func, args, callback):
+        """ calls func(*args) in the background and callback(channel, version, result) if the request is still current
+            returns the version of the request that can be compared with is_current when the result arrives
+        """
+        with self.lock:
+            if self.closed:
+                return None
+            version = self.versions.get(channel, 0) + 1
+            self.versions[channel] = version
+            prev_future = self.futures.get(channel)
+            if prev_future is not None:
+                prev_future.cancel()
+            future = self.executor.submit(self._run, channel, version, func, args, callback)
+            self.futures[channel] = future
+            future.add_done_callback(lambda f: self._remove_future(channel, f))
+        return version
+
+    def _run(self, channel, version, func, args, callback):
+        if not self.is_current(channel, version):
+            return
+        try:
+            result = func(*args)
+        except:
+            print("Error: request", channel, "failed")
+            traceback.print_exc()
+            result = None
+        if self.is_current(channel, version):
+            callback(channel, version, result)
+
+    def _remove_future(self, channel, future):
+        with self.lock:
+            if self.futures.get(channel) is future:
+                del self.futures[channel]
+
+    def is_current(self, channel, version):
+        with self.lock:
+            return not self.closed and self.versions.get(channel) == version
+
+    def cancel(self, channel=None):
+        """ makes the pending requests of the channel or of all channels stale """
+        with self.lock:
+            if channel is None:
+                channels = list(self.versions.keys())
+            else:
+                channels = [channel]
+            for c in channels:
+                self.versions[c] = self.versions.get(c, 0) + 1
+                if c in self.futures:
+                    self.futures[c].cancel()
+
+    def close(self):
+        self.cancel()
+        with self.lock:
+            self.closed = True
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 DFKI GmbH.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the
+# following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+# NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE
+# USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Fetches the motion data, meta information and time functions of many clips with few requests.
+The ids are grouped into batches which are sent to the bulk endpoint of the server in parallel.
+If the server does not provide the endpoint, each item is requested with parallel single requests instead.
+A failed batch or item is skipped and its fields are None, so that one error does not abort the other requests.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import bson
+import requests
+
+BULK_METHOD = "get_motion_bundles"
+FIELDS = ("motion", "annotation", "time_function")
+UNSUPPORTED_STATUS_CODES = (400, 404, 405, 501)
+
+
+class BulkNotSupported(Exception):
+    pass
+
+
+class BulkMotionFetcher(object):
+    def __init__(self, client, batch_size=50, n_workers=8):
+        self.client = client
+        self.batch_size = max(1, batch_size)
+        self.n_workers = max(1, n_workers)
+        self.bulk_supported = None
+
+    def fetch(self, motion_ids, is_processed=False, fields=FIELDS):
+        """ returns a dict that maps each id to a dict with the requested fields
+            missing motions are None and missing annotations and time functions are empty strings
+            all fields of motions whose request failed are None
+        """
+        motion_ids = list(dict.fromkeys(motion_ids))
+        results = dict()
+        if len(motion_ids) == 0:
+            return results
+        batches = [motion_ids[i:i + self.batch_size] for i in range(0, len(motion_ids), self.batch_size)]
+        if self.bulk_supported is None:
+            # the first batch finds out if the server has a bulk endpoint
+            try:
+                results.update(self.fetch_batch(batches[0], is_processed, fields))
+                self.bulk_supported = True
+                batches = batches[1:]
+            except BulkNotSupported:
+                print("bulk requests are not supported by", self.client.url)
+                self.bulk_supported = False
+            except Exception as e:
+                # the support is checked again by the next call
+                print("Warning: bulk request failed", e)
+                results.update(self._get_failed_bundles(batches[0], fields))
+                batches = batches[1:]
+        with ThreadPoolExecutor(self.n_workers) as executor:
+            if self.bulk_supported is not False:
+                fetch_batch = lambda batch: self._try_fetch_batch(batch, is_processed, fields)
+                for batch_results in executor.map(fetch_batch, batches):
+                    results.update(batch_results)
+            else:
+                remaining_ids = [motion_id for batch in batches for motion_id in batch]
+                fetch_single = lambda motion_id: self._try_fetch_single(motion_id, is_processed, fields)
+                for motion_id, bundle in zip(remaining_ids, executor.map(fetch_single, remaining_ids)):
+                    results[motion_id] = bundle
+        return results
+
+    def _try_fetch_batch(self, motion_ids, is_processed, fields):
+        try:
+            return self.fetch_batch(motion_ids, is_processed, fields)
+        except Exception as e:
+            print("Warning: skip", len(motion_ids), "motions after failed bulk request", e)
+            return self._get_failed_bundles(motion_ids, fields)
+
+    def _try_fetch_single(self, motion_id, is_processed, fields):
+        try:
+            return self.fetch_single(motion_id, is_processed, fields)
+        except Exception as e:
+            print("Warning: skip motion", motion_id, "after failed request", e)
+            return self._get_failed_bundles([motion_id], fields)[motion_id]
+
+    def fetch_batch(self, motion_ids, is_processed, fields):
+        data = {"clip_ids": list(motion_ids), "is_processed": is_processed, "fields": list(fields)}
+        try:
+            content = self.client.post(BULK_METHOD, data)
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code in UNSUPPORTED_STATUS_CODES:
+                raise BulkNotSupported()
+            raise
+        results = dict()
+        for motion_id in motion_ids:
+            results[motion_id] = self._get_empty_bundle(fields)
+        for item in bson.loads(content)["results"]:
+            motion_id = item["clip_id"]
+            if motion_id in results:
+                for field in fields:
+                    if field in item:
+                        results[motion_id][field] = item[field]
+        return results
+
+    def fetch_single(self, motion_id, is_processed, fields):
+        bundle = dict()
+        if "motion" in fields:
+            bundle["motion"] = self.client.get_motion(motion_id, is_processed)
+        if "annotation" in fields:
+            bundle["annotation"] = self.client.get_annotation(motion_id, is_processed)
+        if "time_function" in fields:
+            bundle["time_function"] = self.client.get_time_function(motion_id)
+        return bundle
+
+    def _get_empty_bundle(self, fields):
+        bundle = dict()
+        for field in fields:
+            bundle[field] = None if field == "motion" else ""
+        return bundle
+
+    def _get_failed_bundles(self, motion_ids, fields):
+        return dict((motion_id, dict((field, None) for field in fields)) for motion_id in motion_ids)
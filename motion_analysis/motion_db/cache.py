@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 DFKI GmbH.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the
+# following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+# NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE
+# USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Persistent local cache for data downloaded from the motion database.
+The payloads are stored content addressed in DATA_DIR/db_cache/objects and an index maps the key of an item,
+i.e. the database url, the type of the data and its id, to the hash of the content and the stamp sent by the server.
+Entries are evicted in least recently used order when the size budget is exceeded.
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+import collections
+import bson
+from anim_utils.utilities.db_interface import get_skeleton_from_remote_db, load_skeleton_from_db
+from motion_analysis import constants
+from .client import MotionDBClient
+from .bulk import BulkMotionFetcher, FIELDS
+try:
+    from morphablegraphs.utilities.db_interface import download_motion_model_from_remote_db
+except:
+    pass
+
+INDEX_FILE = "index.json"
+CACHE_DIR_NAME = "db_cache"
+INDEX_SAVE_INTERVAL = 60  # seconds between index writes triggered by put
+
+
+class LocalDBCache(object):
+    def __init__(self, directory, size_budget=constants.DB_CACHE_SIZE):
+        self.directory = directory
+        self.object_dir = os.path.join(directory, "objects")
+        self.size_budget = size_budget
+        self.index = dict()
+        self.ref_counts = collections.Counter()
+        self.total_size = 0
+        self.lock = threading.RLock()
+        self.is_modified = False
+        self.last_save_time = time.time()
+        self._load_index()
+
+    def _load_index(self):
+        filename = os.path.join(self.directory, INDEX_FILE)
+        if os.path.isfile(filename):
+            try:
+                with open(filename, "rt") as in_file:
+                    self.index = json.load(in_file)
+            except:
+                print("Warning: could not read cache index", filename)
+                self.index = dict()
+        for key in list(self.index.keys()):
+            entry = self.index[key]
+            if not os.path.isfile(self._get_object_path(entry["hash"])):
+                del self.index[key]
+                continue
+            if self.ref_counts[entry["hash"]] == 0:
+                self.total_size += entry["size"]
+            self.ref_counts[entry["hash"]] += 1
+
+    def _save_index(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        filename = os.path.join(self.directory, INDEX_FILE)
+        tmp_filename = filename + ".tmp" + str(os.getpid())
+        with open(tmp_filename, "wt") as out_file:
+            json.dump(self.index, out_file)
+        os.replace(tmp_filename, filename)
+        self.is_modified = False
+        self.last_save_time = time.time()
+
+    def _get_object_path(self, content_hash):
+        return os.path.join(self.object_dir, content_hash[:2], content_hash)
+
+    def get(self, key):
+        """ returns the content, the stamp and the time the entry was stored or None """
+        with self.lock:
+            entry = self.index.get(key)
+            if entry is None:
+                return None
+            try:
+                with open(self._get_object_path(entry["hash"]), "rb") as in_file:
+                    content = in_file.read()
+            except IOError:
+                self._remove(key)
+                return None
+            entry["access"] = time.time()
+            self.is_modified = True
+            return content, entry["stamp"], entry["time"]
+
+    def get_info(self, key):
+        """ returns the stamp and the time the entry was stored without reading the content or None """
+        with self.lock:
+            entry = self.index.get(key)
+            if entry is None:
+                return None
+            if not os.path.isfile(self._get_object_path(entry["hash"])):
+                self._remove(key)
+                return None
+            return entry["stamp"], entry["time"]
+
+    def put(self, key, content, stamp=None, save_index=False):
+        """ stores the content. The index is written if save_index is set or if it was
+            not written for INDEX_SAVE_INTERVAL seconds, otherwise on flush
+        """
+        content_hash = hashlib.sha1(content).hexdigest()
+        with self.lock:
+            if key in self.index:
+                self._remove(key)
+            path = self._get_object_path(content_hash)
+            if self.ref_counts[content_hash] == 0:
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                tmp_path = path + ".tmp" + str(os.getpid())
+                with open(tmp_path, "wb") as out_file:
+                    out_file.write(content)
+                os.replace(tmp_path, path)
+                self.total_size += len(content)
+            self.ref_counts[content_hash] += 1
+            t = time.time()
+            self.index[key] = {"hash": content_hash, "size": len(content), "stamp": stamp, "time": t, "access": t}
+            self._evict()
+            self.is_modified = True
+            if save_index or time.time() - self.last_save_time > INDEX_SAVE_INTERVAL:
+                self._save_index()
+
+    def get_keys(self, prefix=""):
+        with self.lock:
+            return [key for key in self.index if key.startswith(prefix)]
+
+    def get_object_path(self, key):
+        """ returns the file of the content so that other processes can read it without the index or None """
+        with self.lock:
+            entry = self.index.get(key)
+            if entry is None:
+                return None
+            return self._get_object_path(entry["hash"])
+
+    def touch(self, key):
+        """ marks an entry as up to date after the server confirmed that it has not changed """
+        with self.lock:
+            if key in self.index:
+                self.index[key]["time"] = time.time()
+                self.is_modified = True
+
+    def invalidate(self, key):
+        with self.lock:
+            if key in self.index:
+                self._remove(key)
+                self._save_index()
+
+    def invalidate_prefix(self, prefix):
+        with self.lock:
+            keys = [key for key in self.index if key.startswith(prefix)]
+            for key in keys:
+                self._remove(key)
+            if len(keys) > 0:
+                self._save_index()
+
+    def _remove(self, key):
+        entry = self.index.pop(key)
+        content_hash = entry["hash"]
+        self.ref_counts[content_hash] -= 1
+        if self.ref_counts[content_hash] <= 0:
+            del self.ref_counts[content_hash]
+            self.total_size -= entry["size"]
+            try:
+                os.remove(self._get_object_path(content_hash))
+            except OSError:
+                pass
+        self.is_modified = True
+
+    def _evict(self):
+        if self.total_size <= self.size_budget:
+            return
+        for key in sorted(self.index, key=lambda k: self.index[k]["access"]):
+            if self.total_size <= self.size_budget:
+                break
+            self._remove(key)
+
+    def flush(self):
+        """ stores the access times """
+        with self.lock:
+            if self.is_modified:
+                self._save_index()
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.index.keys()):
+                self._remove(key)
+            self._save_index()
+
+
+_local_cache = None
+
+
+def get_local_cache():
+    """ returns the cache in constants.DATA_DIR that is shared by all dialogs """
+    global _local_cache
+    if _local_cache is None:
+        _local_cache = LocalDBCache(os.path.join(constants.DATA_DIR, CACHE_DIR_NAME), constants.DB_CACHE_SIZE)
+    return _local_cache
+
+
+class CachedMotionDB(object):
+    """ returns data of the motion database from the local cache.
+        Entries are used without a request if the server stamp of an item is given and matches
+        or, if no stamp is given, if the entry is younger than max_age. Older entries are revalidated with their stamp.
+        Skeletons are additionally kept in memory.
+    """
+    skeletons = dict()
+    skeleton_data = dict()
+
+    def __init__(self, db_url, session=None, cache=None, max_age=constants.DB_CACHE_MAX_AGE):
+        self.db_url = db_url
+        self.session = session
+        self.client = MotionDBClient(db_url, session)
+        self.fetcher = BulkMotionFetcher(self.client)
+        if cache is None:
+            cache = get_local_cache()
+        self.cache = cache
+        self.max_age = max_age
+
+    def _get_key(self, data_type, item_id):
+        return self.db_url + "|" + data_type + "|" + str(item_id)
+
+    def _is_fresh(self, cached_time, cached_stamp, stamp):
+        if stamp is not None:
+            return stamp == cached_stamp
+        return self.max_age is None or time.time() - cached_time < self.max_age
+
+    def _get(self, data_type, item_id, method, data, decode, stamp=None):
+        key = self._get_key(data_type, item_id)
+        entry = self.cache.get(key)
+        if entry is not None:
+            content, cached_stamp, cached_time = entry
+            if self._is_fresh(cached_time, cached_stamp, stamp):
+                return decode(content)
+            request_stamp = cached_stamp if stamp is None else None
+            new_content, new_stamp = self.client.post_conditional(method, data, request_stamp)
+            if new_content is None:
+                self.cache.touch(key)
+                return decode(content)
+        else:
+            new_content, new_stamp = self.client.post_conditional(method, data)
+        try:
+            result = decode(new_content)
+        except:
+            return None
+        self.cache.put(key, new_content, stamp if stamp is not None else new_stamp)
+        return result
+
+    def _get_from_function(self, data_type, item_id, download):
+        """ caches the result of a function of the db interface that returns a json serializable object """
+        key = self._get_key(data_type, item_id)
+        entry = self.cache.get(key)
+        if entry is not None and self._is_fresh(entry[2], entry[1], None):
+            return json.loads(entry[0].decode("utf-8"))
+        result = download()
+        if result is not None:
+            self.cache.put(key, json.dumps(result).encode("utf-8"))
+        return result
+
+    def get_motion(self, motion_id, is_processed=False, stamp=None):
+        data = {"clip_id": motion_id, "is_processed": is_processed}
+        return self._get("motion" + str(int(is_processed)), motion_id, "get_motion", data, bson.loads, stamp)
+
+    def get_annotation(self, motion_id, is_processed=False, stamp=None):
+        data = {"clip_id": motion_id, "is_processed": is_processed}
+        decode = lambda content: content.decode("utf-8")
+        return self._get("annotation" + str(int(is_processed)), motion_id, "download_annotation", data, decode, stamp)
+
+    def get_time_function(self, motion_id, stamp=None):
+        data = {"clip_id": motion_id}
+        decode = lambda content: content.decode("utf-8")
+        return self._get("time_function", motion_id, "get_time_function", data, decode, stamp)
+
+    def _is_cached(self, key):
+        info = self.cache.get_info(key)
+        return info is not None and self._is_fresh(info[1], info[0], None)
+
+    def prefetch_motions(self, motion_ids, is_processed=False, fields=FIELDS):
+        """ downloads the fields of all clips that are not in the cache with bulk requests """
+        keys = dict()
+        keys["motion"] = "motion" + str(int(is_processed))
+        keys["annotation"] = "annotation" + str(int(is_processed))
+        keys["time_function"] = "time_function"
+        missing_ids = []
+        for motion_id in motion_ids:
+            if not all(self._is_cached(self._get_key(keys[field], motion_id)) for field in fields):
+                missing_ids.append(motion_id)
+        if len(missing_ids) == 0:
+            return
+        print("prefetch", len(missing_ids), "motions")
+        for motion_id, bundle in self.fetcher.fetch(missing_ids, is_processed, fields).items():
+            for field in fields:
+                value = bundle.get(field)
+                if value is None:
+                    continue
+                if field == "motion":
+                    content = bson.dumps(value)
+                else:
+                    content = value.encode("utf-8")
+                self.cache.put(self._get_key(keys[field], motion_id), content)
+        self.cache.flush()
+
+    def get_skeleton_data(self, skeleton_name):
+        key = (self.db_url, skeleton_name)
+        if key not in CachedMotionDB.skeleton_data:
+            download = lambda: get_skeleton_from_remote_db(self.db_url, skeleton_name, self.session)
+            skeleton_data = self._get_from_function("skeleton", skeleton_name, download)
+            if skeleton_data is None:
+                return None
+            CachedMotionDB.skeleton_data[key] = skeleton_data
+        return CachedMotionDB.skeleton_data[key]
+
+    def load_skeleton(self, skeleton_name):
+        """ returns the skeleton object which is only kept in memory """
+        key = (self.db_url, skeleton_name)
+        if key not in CachedMotionDB.skeletons:
+            skeleton = load_skeleton_from_db(self.db_url, skeleton_name, self.session)
+            if skeleton is None:
+                return None
+            CachedMotionDB.skeletons[key] = skeleton
+        return CachedMotionDB.skeletons[key]
+
+    def get_motion_model(self, model_id):
+        key = self._get_key("model", model_id)
+        entry = self.cache.get(key)
+        if entry is not None and self._is_fresh(entry[2], entry[1], None):
+            return entry[0].decode("utf-8")
+        model_data_str = download_motion_model_from_remote_db(self.db_url, model_id, self.session)
+        if model_data_str is not None:
+            self.cache.put(key, model_data_str.encode("utf-8"))
+        return model_data_str
+
+    def invalidate_motion(self, motion_id):
+        self.invalidate_motion_data(motion_id)
+        for data_type in ["annotation0", "annotation1", "time_function"]:
+            self.cache.invalidate(self._get_key(data_type, motion_id))
+
+    def invalidate_motion_data(self, motion_id):
+        """ removes only the raw and the processed frames of the motion and keeps the annotations """
+        for data_type in ["motion0", "motion1"]:
+            self.cache.invalidate(self._get_key(data_type, motion_id))
+
+    def invalidate_skeleton(self, skeleton_name):
+        CachedMotionDB.skeletons.pop((self.db_url, skeleton_name), None)
+        CachedMotionDB.skeleton_data.pop((self.db_url, skeleton_name), None)
+        self.cache.invalidate(self._get_key("skeleton", skeleton_name))
+
+    def invalidate_model(self, model_id):
+        self.cache.invalidate(self._get_key("model", model_id))
+
+    def close(self):
+        self.cache.flush()
+        self.client.close()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 DFKI GmbH.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the
+# following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+# NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE
+# USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Client for the motion database that keeps one HTTP connection per thread alive.
+The requests have the same format as the functions in anim_utils.utilities.db_interface,
+which open a new connection for every call.
+"""
+import json
+import threading
+import bson
+import requests
+
+
+class MotionDBClient(object):
+    def __init__(self, url, session=None, timeout=60):
+        self.url = url
+        self.session = session
+        self.timeout = timeout
+        self._local = threading.local()
+        self._http_sessions = []
+        self._lock = threading.Lock()
+
+    def _get_http_session(self):
+        http_session = getattr(self._local, "http_session", None)
+        if http_session is None:
+            http_session = requests.Session()
+            self._local.http_session = http_session
+            with self._lock:
+                self._http_sessions.append(http_session)
+        return http_session
+
+    def post(self, method, data):
+        """ returns the content of the response and raises requests.RequestException on connection and server errors """
+        if self.session is not None:
+            data.update(self.session)
+        response = self._get_http_session().post(self.url + method, data=json.dumps(data), timeout=self.timeout)
+        response.raise_for_status()
+        return response.content
+
+    def post_conditional(self, method, data, stamp=None):
+        """ sends the stamp of a cached response as If-None-Match header
+            returns None as content if the server reports that the data has not changed
+            and the ETag or Last-Modified header of the response as new stamp
+        """
+        if self.session is not None:
+            data.update(self.session)
+        headers = dict()
+        if stamp is not None:
+            headers["If-None-Match"] = stamp
+        response = self._get_http_session().post(self.url + method, data=json.dumps(data), headers=headers, timeout=self.timeout)
+        if response.status_code == 304:
+            return None, stamp
+        response.raise_for_status()
+        new_stamp = response.headers.get("ETag", response.headers.get("Last-Modified"))
+        return response.content, new_stamp
+
+    def get_motion(self, motion_id, is_processed=False):
+        data = {"clip_id": motion_id, "is_processed": is_processed}
+        result = self.post("get_motion", data)
+        try:
+            return bson.loads(result)
+        except:
+            return None
+
+    def get_annotation(self, motion_id, is_processed=False):
+        data = {"clip_id": motion_id, "is_processed": is_processed}
+        return self.post("download_annotation", data).decode("utf-8")
+
+    def get_time_function(self, motion_id):
+        data = {"clip_id": motion_id}
+        return self.post("get_time_function", data).decode("utf-8")
+
+    def close(self):
+        with self._lock:
+            for http_session in self._http_sessions:
+                http_session.close()
+            self._http_sessions = []
+        self._local = threading.local()
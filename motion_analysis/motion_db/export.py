@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 DFKI GmbH.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the
+# following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+# NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE
+# USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Concurrent export of motion clips and motion models from the motion database into a directory tree.
+A bounded number of downloads run on a thread pool with one persistent connection per thread
+while a writer thread stores the results. Each directory gets a manifest of the finished items
+so that an interrupted export continues where it stopped.
+
+Usage without the GUI:
+    python -m motion_analysis.motion_db.export skeleton_name out_dir --collection 3
+"""
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+import collections
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+import bson
+from anim_utils.animation_data import MotionVector
+from anim_utils.utilities.db_interface import get_motion_list_from_remote_db, get_collections_by_parent_id_from_remote_db, \
+                                        load_skeleton_from_db, get_bvh_string
+from .client import MotionDBClient
+try:
+    from morphablegraphs.utilities.db_interface import get_model_list_from_remote_db, download_motion_model_from_remote_db, \
+                                        download_cluster_tree_from_remote_db
+except:
+    pass
+
+MANIFEST_FILE = "export_manifest.jsonl"
+N_RETRIES = 2
+RETRY_WAIT_TIME = 1.0
+
+ExportJob = collections.namedtuple("ExportJob", ["key", "directory", "download"])
+
+
+class ExportManifest(object):
+    """ stores one json line per finished item in the directory of the item """
+    def __init__(self):
+        self.finished = dict()
+        self.lock = threading.Lock()
+
+    def _get_keys(self, directory):
+        if directory in self.finished:
+            return self.finished[directory]
+        keys = set()
+        filename = os.path.join(directory, MANIFEST_FILE)
+        if os.path.isfile(filename):
+            with open(filename, "rt") as in_file:
+                for line in in_file:
+                    try:
+                        keys.add(json.loads(line)["key"])
+                    except:
+                        # incomplete line of an interrupted export
+                        pass
+        self.finished[directory] = keys
+        return keys
+
+    def is_finished(self, directory, key):
+        with self.lock:
+            return key in self._get_keys(directory)
+
+    def add(self, directory, key, files):
+        with self.lock:
+            keys = self._get_keys(directory)
+            with open(os.path.join(directory, MANIFEST_FILE), "at") as out_file:
+                out_file.write(json.dumps({"key": key, "files": files}) + "\n")
+            keys.add(key)
+
+
+class CollectionExporter(object):
+    """ collects export jobs and runs them with n_workers concurrent downloads
+        the results are written while the next items are downloaded
+    """
+    def __init__(self, db_url, session=None, n_workers=8, export_bvh=False, export_json=False, export_bson=True, progress_callback=None):
+        self.db_url = db_url
+        self.session = session
+        self.n_workers = max(1, n_workers)
+        self.max_in_flight = 2 * self.n_workers
+        self.export_bvh = export_bvh
+        self.export_json = export_json
+        self.export_bson = export_bson
+        self.progress_callback = progress_callback
+        self.client = MotionDBClient(db_url, session)
+        self.manifest = ExportManifest()
+        self.jobs = []
+        self.skeletons = dict()
+        # stays set once stop is called so that an export that is still collecting jobs does not start
+        self.stop_export = threading.Event()
+
+    def get_skeleton(self, skeleton_name):
+        if skeleton_name not in self.skeletons:
+            self.skeletons[skeleton_name] = load_skeleton_from_db(self.db_url, skeleton_name)
+        return self.skeletons[skeleton_name]
+
+    def add_job(self, key, directory, download):
+        self.jobs.append(ExportJob(key, directory, download))
+
+    def add_motion_clip(self, skeleton, motion_id, name, directory):
+        download = partial(self.download_motion_clip, skeleton, motion_id, name)
+        self.add_job("motion_" + str(motion_id), directory, download)
+
+    def add_collection(self, c_id, skeleton_name, directory, is_aligned=0):
+        """ returns the number of added clips """
+        if self.stop_export.is_set():
+            return 0
+        motion_list = get_motion_list_from_remote_db(self.db_url, c_id, skeleton_name, is_aligned, self.session)
+        if motion_list is None:
+            print("could not find motions")
+            return 0
+        if len(motion_list) < 1:
+            print("no motions", c_id)
+            return 0
+        skeleton = None
+        if self.export_bvh:
+            skeleton = self.get_skeleton(skeleton_name)
+        for motion_id, name in motion_list:
+            self.add_motion_clip(skeleton, motion_id, name, directory)
+        return len(motion_list)
+
+    def add_collection_tree(self, skeleton_name, out_dir, parent=0, is_aligned=0, collection_filter=None):
+        """ adds the clips of all collections below parent, each collection is exported into a sub directory """
+        if self.stop_export.is_set():
+            return
+        for col in get_collections_by_parent_id_from_remote_db(self.db_url, parent, self.session):
+            col_id, col_name, col_type, owner = col
+            directory = out_dir + os.sep + col_name
+            if collection_filter is None or col_name in collection_filter:
+                self.add_collection(col_id, skeleton_name, directory, is_aligned)
+            self.add_collection_tree(skeleton_name, directory, col_id, is_aligned, collection_filter)
+
+    def add_motion_primitive_models(self, mp_name, skeleton_name, directory):
+        if self.stop_export.is_set():
+            return
+        for model_id, name in get_model_list_from_remote_db(self.db_url, mp_name, skeleton_name, self.session):
+            download = partial(self.download_motion_model, model_id, name)
+            self.add_job("model_" + str(model_id), directory, download)
+
+    def add_model_tree(self, skeleton_name, out_dir, parent=0):
+        if self.stop_export.is_set():
+            return
+        for col in get_collections_by_parent_id_from_remote_db(self.db_url, parent, self.session):
+            col_id, col_name, col_type, owner = col
+            directory = out_dir + os.sep + col_name
+            self.add_motion_primitive_models(col_id, skeleton_name, directory)
+            self.add_model_tree(skeleton_name, directory, col_id)
+
+    def download_motion_clip(self, skeleton, motion_id, name):
+        """ returns a list of file names and contents
+            raises an exception if the motion cannot be decoded so that the clip is retried and not added to the manifest
+        """
+        files = []
+        if self.export_bvh or self.export_json or self.export_bson:
+            motion_dict = self.client.get_motion(motion_id, is_processed=False)
+            if motion_dict is None:
+                raise ValueError("Could not decode motion " + str(motion_id))
+            if self.export_bvh:
+                motion_vector = MotionVector()
+                motion_vector.from_custom_unity_format(motion_dict)
+                filename = name
+                if not name.endswith(".bvh"):
+                    filename += ".bvh"
+                files.append((filename, get_bvh_string(skeleton, motion_vector.frames)))
+            if self.export_json:
+                files.append((name + ".json", json.dumps(motion_dict)))
+            if self.export_bson:
+                files.append((name + ".bson", bson.dumps(motion_dict)))
+        annotation_str = self.client.get_annotation(motion_id, is_processed=False)
+        if annotation_str != "":
+            files.append((name + "_meta_info.json", annotation_str))
+        time_function_str = self.client.get_time_function(motion_id)
+        if time_function_str != "":
+            files.append((name + "_time_function.json", time_function_str))
+        return files
+
+    def download_motion_model(self, model_id, name):
+        files = [(name + "_quaternion_mm.json", download_motion_model_from_remote_db(self.db_url, model_id, self.session))]
+        cluster_tree_data_str = download_cluster_tree_from_remote_db(self.db_url, model_id, self.session)
+        if cluster_tree_data_str is not None and len(cluster_tree_data_str) > 0:
+            files.append((name + "_cluster_tree.json", cluster_tree_data_str))
+        return files
+
+    def _download(self, job, write_queue):
+        error = None
+        for idx in range(N_RETRIES + 1):
+            if self.stop_export.is_set():
+                break
+            try:
+                write_queue.put((job, job.download(), None))
+                return
+            except Exception as e:
+                error = e
+                if idx < N_RETRIES:
+                    time.sleep(RETRY_WAIT_TIME * (idx + 1))
+        write_queue.put((job, None, error))
+
+    def _write_files(self, job, files):
+        if not os.path.isdir(job.directory):
+            os.makedirs(job.directory)
+        for filename, content in files:
+            mode = "wb" if isinstance(content, bytes) else "wt"
+            with open(job.directory + os.sep + filename, mode) as out_file:
+                out_file.write(content)
+        self.manifest.add(job.directory, job.key, [f for f, c in files])
+
+    def _write_results(self, write_queue, in_flight, stats):
+        while True:
+            item = write_queue.get()
+            if item is None:
+                break
+            job, files, error = item
+            try:
+                if files is not None:
+                    try:
+                        self._write_files(job, files)
+                    except Exception as e:
+                        files = None
+                        error = e
+                if files is not None:
+                    stats["n_exported"] += 1
+                else:
+                    print("could not export", job.key, error)
+                    stats["failed"].append(job.key)
+                n_done = stats["n_exported"] + len(stats["failed"])
+                print("exported", str(n_done) + "/" + str(stats["n_jobs"]), job.key)
+                if self.progress_callback is not None:
+                    try:
+                        self.progress_callback(n_done, stats["n_jobs"], job.key)
+                    except Exception as e:
+                        print("Warning: progress callback failed", e)
+            finally:
+                # run() waits for a free slot before each download
+                in_flight.release()
+
+    def run(self):
+        """ exports all jobs that are not in the manifest and returns statistics """
+        start = time.time()
+        jobs = [job for job in self.jobs if not self.manifest.is_finished(job.directory, job.key)]
+        stats = dict()
+        stats["n_jobs"] = len(jobs)
+        stats["n_skipped"] = len(self.jobs) - len(jobs)
+        stats["n_exported"] = 0
+        stats["failed"] = []
+        write_queue = queue.Queue()
+        in_flight = threading.BoundedSemaphore(self.max_in_flight)
+        writer = threading.Thread(target=self._write_results, args=(write_queue, in_flight, stats))
+        writer.start()
+        with ThreadPoolExecutor(self.n_workers) as executor:
+            for job in jobs:
+                in_flight.acquire()
+                if self.stop_export.is_set():
+                    in_flight.release()
+                    break
+                executor.submit(self._download, job, write_queue)
+        write_queue.put(None)
+        writer.join()
+        self.jobs = []
+        stats["duration"] = time.time() - start
+        print("finished export of", stats["n_exported"], "items in", stats["duration"], "s,", len(stats["failed"]), "failed,", stats["n_skipped"], "skipped")
+        return stats
+
+    def stop(self):
+        self.stop_export.set()
+
+    def close(self):
+        self.client.close()
+
+
+def export_collection(db_url, c_id, skeleton_name, directory, is_aligned=0, session=None, n_workers=8, recursive=False, **kwargs):
+    exporter = CollectionExporter(db_url, session, n_workers, **kwargs)
+    if recursive:
+        exporter.add_collection_tree(skeleton_name, directory, c_id, is_aligned)
+    else:
+        exporter.add_collection(c_id, skeleton_name, directory, is_aligned)
+    stats = exporter.run()
+    exporter.close()
+    return stats
+
+
+def main():
+    from motion_analysis import constants
+    from motion_analysis.session_manager import SessionManager
+    parser = argparse.ArgumentParser(description="Export motions from the motion database into a directory.")
+    parser.add_argument("skeleton", help="skeleton name")
+    parser.add_argument("out_dir", help="output directory")
+    parser.add_argument("--collection", type=int, default=0, help="collection id, 0 exports all collections")
+    parser.add_argument("--recursive", action="store_true", help="export the sub collections into sub directories")
+    parser.add_argument("--aligned", action="store_true", help="export the aligned motions")
+    parser.add_argument("--bvh", action="store_true", help="export the motions also as bvh files")
+    parser.add_argument("--workers", type=int, default=8, help="number of concurrent downloads")
+    parser.add_argument("--url", default=None, help="url of the motion database")
+    args = parser.parse_args()
+    if os.path.isfile(constants.CONFIG_FILE):
+        constants.set_constants_from_file(constants.CONFIG_FILE)
+    db_url = args.url if args.url is not None else constants.DB_URL
+    session = SessionManager().session
+    recursive = args.recursive or args.collection == 0
+    export_collection(db_url, args.collection, args.skeleton, args.out_dir, int(args.aligned), session,
+                      args.workers, recursive, export_bvh=args.bvh)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 DFKI GmbH.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the
+# following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+# NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE
+# USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Streaming import of a directory of BVH files into a collection of the motion database.
+The files are visited one by one. Reading, validation and the lookup of the annotation files run in a
+process pool, and the uploads run on a bounded thread pool with retries. At most max_pending clips
+are held in memory at the same time, independent of the size of the directory.
+"""
+import os
+import json
+import time
+import threading
+import collections
+from multiprocessing import cpu_count
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from anim_utils.utilities.db_interface import upload_motion_to_db
+
+KEYFRAME_FILE = "keyframes.json"
+N_RETRIES = 3
+RETRY_WAIT_TIME = 2.0
+
+
+def create_sections_from_annotation(annotations):
+    motion_sections = dict()
+    for label in annotations:
+        annotations[label].sort()
+        section = dict()
+        section["start_idx"] = annotations[label][0]
+        section["end_idx"] = annotations[label][-1]
+        motion_sections[section["start_idx"]] = section
+    return list(collections.OrderedDict(sorted(motion_sections.items())).values())
+
+
+def read_annotation_file(annotation_filepath):
+    meta_info_str = ""
+    with open(annotation_filepath, "rt") as annotation_file:
+        print("read meta info from", annotation_filepath)
+        annotation_str = annotation_file.read()
+        annotation_data = json.loads(annotation_str)
+        meta_info_data = dict()
+        meta_info_data["sections"] = create_sections_from_annotation(annotation_data["semantic_annotation"])
+        meta_info_str = json.dumps(meta_info_data)
+    return meta_info_str
+
+
+def get_meta_info_for_file(filename):
+    """ returns the meta info from the section or meta info file next to a bvh file or an empty string """
+    annotation_file_option1 = filename[:-4]+"_section.json"
+    annotation_file_option2 = filename[:-4]+"_sections.json"
+    meta_info_file = filename+"_meta_info.json"
+    if os.path.isfile(annotation_file_option1):
+        return read_annotation_file(annotation_file_option1)
+    elif os.path.isfile(annotation_file_option2):
+        return read_annotation_file(annotation_file_option2)
+    elif os.path.isfile(meta_info_file):
+        with open(meta_info_file, "rt") as in_file:
+            return in_file.read()
+    print("Did not find meta info for", filename)
+    return ""
+
+
+def get_meta_info_from_keyframe(keyframe_data, key):
+    """ splits the motion into two sections at the keyframe """
+    if key not in keyframe_data:
+        return ""
+    meta_info_data = dict()
+    meta_info_data["sections"] = []
+    section = dict()
+    section["start_idx"] = 0
+    section["end_idx"] = keyframe_data[key]
+    meta_info_data["sections"].append(section)
+    section = dict()
+    section["start_idx"] = keyframe_data[key]
+    section["end_idx"] = -1
+    meta_info_data["sections"].append(section)
+    return json.dumps(meta_info_data)
+
+
+def load_keyframe_data(directory):
+    keyframe_file_name = directory+os.sep+KEYFRAME_FILE
+    if not os.path.isfile(keyframe_file_name):
+        return None
+    with open(keyframe_file_name, "rt") as keyframe_file:
+        keyframe_data = json.load(keyframe_file)
+    print("found keyframes", keyframe_data.keys())
+    return keyframe_data
+
+
+def iterate_bvh_files(directory):
+    """ yields the bvh files of the directory without listing all of them first """
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.is_file() and entry.name.endswith(".bvh"):
+                yield entry.path
+
+
+def count_bvh_files(directory):
+    return sum(1 for _ in iterate_bvh_files(directory))
+
+
+def validate_bvh_string(bvh_str):
+    """ returns an error message or None if the hierarchy is complete and the number of frames matches the header """
+    if not bvh_str.lstrip().startswith("HIERARCHY"):
+        return "missing hierarchy"
+    motion_start = bvh_str.find("MOTION")
+    if motion_start < 0:
+        return "missing motion"
+    lines = bvh_str[motion_start:].splitlines()
+    n_frames = None
+    frame_lines = 0
+    for idx, line in enumerate(lines):
+        if line.startswith("Frames:"):
+            n_frames = int(line.split(":")[1])
+        elif line.startswith("Frame Time:"):
+            frame_lines = sum(1 for l in lines[idx+1:] if l.strip() != "")
+            break
+    if n_frames is None:
+        return "missing number of frames"
+    if frame_lines < n_frames:
+        return "expected " + str(n_frames) + " frames but found " + str(frame_lines)
+    return None
+
+
+def prepare_motion_file(filename, keyframe_data, skeleton_model):
+    """ reads and validates a bvh file and finds its meta info, is called in a worker process """
+    name = os.path.basename(filename)
+    with open(filename, "rt") as in_file:
+        bvh_str = in_file.read()
+    error = validate_bvh_string(bvh_str)
+    if error is not None:
+        return name, None, error
+    if keyframe_data is not None:
+        meta_info_str = get_meta_info_from_keyframe(keyframe_data, name[:-4])
+    else:
+        meta_info_str = get_meta_info_for_file(filename)
+    data = dict()
+    data["bvh_str"] = bvh_str
+    data["meta_info"] = meta_info_str
+    data["skeleton_model"] = skeleton_model
+    return name, data, None
+
+
+class FolderImporter(object):
+    """ uploads the bvh files of a directory into a collection
+        progress_callback is called with the number of finished files, the number of files, the name and an error or None
+    """
+    def __init__(self, db_url, collection, session=None, skeleton_model="custom", n_processes=None,
+                 n_uploads=4, max_pending=None, is_processed=False, progress_callback=None):
+        self.db_url = db_url
+        self.collection = collection
+        self.session = session
+        self.skeleton_model = skeleton_model
+        if n_processes is None:
+            n_processes = max(1, cpu_count() - 1)
+        self.n_processes = n_processes
+        self.n_uploads = max(1, n_uploads)
+        if max_pending is None:
+            max_pending = 2 * (self.n_processes + self.n_uploads)
+        self.max_pending = max_pending
+        self.is_processed = is_processed
+        self.progress_callback = progress_callback
+        self.stop_import = False
+        self.lock = threading.Lock()
+
+    def upload(self, name, data):
+        error = None
+        for idx in range(N_RETRIES + 1):
+            if self.stop_import:
+                return "stopped"
+            try:
+                upload_motion_to_db(self.db_url, name, data["bvh_str"], self.collection, data["skeleton_model"],
+                                    data["meta_info"], self.is_processed, self.session)
+                return None
+            except Exception as e:
+                error = e
+                print("upload of", name, "failed", e)
+                if idx < N_RETRIES:
+                    time.sleep(RETRY_WAIT_TIME * (idx + 1))
+        return str(error)
+
+    def _finish(self, name, error, pending, stats):
+        with self.lock:
+            if error is None:
+                stats["n_uploaded"] += 1
+            else:
+                stats["failed"].append((name, error))
+            n_done = stats["n_uploaded"] + len(stats["failed"])
+        pending.release()
+        print("imported", str(n_done)+"/"+str(stats["n_files"]), name, "" if error is None else error)
+        if self.progress_callback is not None:
+            try:
+                self.progress_callback(n_done, stats["n_files"], name, error)
+            except Exception as e:
+                print("Warning: progress callback failed", e)
+
+    def _upload_prepared(self, future, filename, uploader, pending, stats):
+        try:
+            name, data, error = future.result()
+        except Exception as e:
+            self._finish(os.path.basename(filename), str(e), pending, stats)
+            return
+        if error is not None:
+            self._finish(name, error, pending, stats)
+            return
+        upload_future = uploader.submit(self.upload, name, data)
+        upload_future.add_done_callback(lambda f: self._finish(name, f.result(), pending, stats))
+
+    def run(self, directory):
+        """ imports all bvh files of the directory and returns statistics """
+        start = time.time()
+        keyframe_data = load_keyframe_data(directory)
+        stats = dict()
+        stats["n_files"] = count_bvh_files(directory)
+        stats["n_uploaded"] = 0
+        stats["failed"] = []
+        self.stop_import = False
+        pending = threading.BoundedSemaphore(self.max_pending)
+        with ProcessPoolExecutor(self.n_processes) as pool, ThreadPoolExecutor(self.n_uploads) as uploader:
+            for filename in iterate_bvh_files(directory):
+                pending.acquire()
+                if self.stop_import:
+                    pending.release()
+                    break
+                future = pool.submit(prepare_motion_file, filename, keyframe_data, self.skeleton_model)
+                future.add_done_callback(lambda f, filename=filename: self._upload_prepared(f, filename, uploader, pending, stats))
+            # wait until the last uploads were submitted before the upload pool is shut down
+            for _ in range(self.max_pending):
+                pending.acquire()
+        stats["duration"] = time.time() - start
+        print("finished import of", stats["n_uploaded"], "files in", stats["duration"], "s,", len(stats["failed"]), "failed")
+        return stats
+
+    def stop(self):
+        self.stop_import = True
+
+
+def import_collection_from_folder(db_url, directory, collection, session=None, skeleton_model="custom", **kwargs):
+    importer = FolderImporter(db_url, collection, session, skeleton_model, **kwargs)
+    return importer.run(directory)
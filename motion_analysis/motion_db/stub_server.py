@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 DFKI GmbH.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the
+# following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+# NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE
+# USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Minimal local motion database server that answers the requests of MotionDBClient and BulkMotionFetcher
+with generated clips after a configurable latency. It is used to measure the throughput of the client side.
+
+Usage:
+    python -m motion_analysis.motion_db.stub_server --n_motions 1000 --latency 0.02
+"""
+import json
+import time
+import argparse
+import threading
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+import numpy as np
+import bson
+from .client import MotionDBClient
+from .bulk import BulkMotionFetcher, BULK_METHOD
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        return
+
+    def do_POST(self):
+        stub = self.server.stub
+        length = int(self.headers.get("Content-Length", 0))
+        data = json.loads(self.rfile.read(length).decode("utf-8"))
+        method = self.path.strip("/").split("/")[-1]
+        stub.count_request(method)
+        time.sleep(stub.latency)
+        content = stub.handle(method, data)
+        if content is None or stub.is_failing(data):
+            self.send_response(404 if content is None else 500)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(content)))
+        self.send_header("ETag", stub.etag)
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class StubMotionDBServer(object):
+    def __init__(self, n_motions=100, n_frames=100, n_params=79, latency=0.01, enable_bulk=True, port=0, failing_ids=None):
+        self.n_frames = n_frames
+        self.n_params = n_params
+        self.latency = latency
+        self.enable_bulk = enable_bulk
+        self.motion_ids = list(range(n_motions))
+        self.failing_ids = set(failing_ids) if failing_ids is not None else set()
+        self.etag = "1"
+        self.n_requests = dict()
+        self.lock = threading.Lock()
+        self.server = _ThreadingHTTPServer(("127.0.0.1", port), StubRequestHandler)
+        self.server.stub = self
+        self.thread = None
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:" + str(self.server.server_address[1]) + "/"
+
+    def count_request(self, method):
+        with self.lock:
+            self.n_requests[method] = self.n_requests.get(method, 0) + 1
+
+    def get_n_requests(self):
+        with self.lock:
+            return sum(self.n_requests.values())
+
+    def is_failing(self, data):
+        """ requests that contain one of the failing ids are answered with a server error """
+        motion_ids = data.get("clip_ids", [data.get("clip_id")])
+        return any(motion_id in self.failing_ids for motion_id in motion_ids)
+
+    def get_motion(self, motion_id):
+        if motion_id not in self.motion_ids:
+            return None
+        frames = np.full((self.n_frames, self.n_params), float(motion_id))
+        return {"name": "clip" + str(motion_id), "frame_time": 1.0 / 30, "poses": frames.tolist()}
+
+    def get_annotation(self, motion_id):
+        if motion_id not in self.motion_ids:
+            return ""
+        return json.dumps({"sections": [[0, self.n_frames]]})
+
+    def get_time_function(self, motion_id):
+        if motion_id not in self.motion_ids:
+            return ""
+        return json.dumps(list(range(self.n_frames)))
+
+    def handle(self, method, data):
+        if method == "get_motion":
+            motion = self.get_motion(data["clip_id"])
+            return bson.dumps(motion) if motion is not None else b""
+        elif method == "download_annotation":
+            return self.get_annotation(data["clip_id"]).encode("utf-8")
+        elif method == "get_time_function":
+            return self.get_time_function(data["clip_id"]).encode("utf-8")
+        elif method == BULK_METHOD and self.enable_bulk:
+            results = []
+            for motion_id in data["clip_ids"]:
+                item = {"clip_id": motion_id}
+                if "motion" in data["fields"]:
+                    item["motion"] = self.get_motion(motion_id)
+                if "annotation" in data["fields"]:
+                    item["annotation"] = self.get_annotation(motion_id)
+                if "time_function" in data["fields"]:
+                    item["time_function"] = self.get_time_function(motion_id)
+                results.append(item)
+            return bson.dumps({"results": results})
+        return None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+def measure_throughput(server, batch_size=50, n_workers=8):
+    """ returns the number of fetched clips per second and the number of requests """
+    client = MotionDBClient(server.url)
+    fetcher = BulkMotionFetcher(client, batch_size, n_workers)
+    n_requests = server.get_n_requests()
+    start = time.time()
+    results = fetcher.fetch(server.motion_ids)
+    duration = time.time() - start
+    client.close()
+    return len(results) / duration, server.get_n_requests() - n_requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the throughput of bulk and single requests against a local stub server.")
+    parser.add_argument("--n_motions", type=int, default=1000)
+    parser.add_argument("--n_frames", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--batch_size", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+    for enable_bulk in [True, False]:
+        server = StubMotionDBServer(args.n_motions, args.n_frames, latency=args.latency, enable_bulk=enable_bulk)
+        server.start()
+        clips_per_second, n_requests = measure_throughput(server, args.batch_size, args.workers)
+        server.stop()
+        print("bulk" if enable_bulk else "single", clips_per_second, "clips/s", n_requests, "requests")
+
+
+if __name__ == "__main__":
+    main()
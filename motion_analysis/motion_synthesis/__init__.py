@@ -2,6 +2,7 @@ import os
 import pickle
 import json
 from .blend_animation_controller import BlendAnimationController, AnimationBlendNode
+from .blend_node_io import save_blend_node, load_blend_node, is_blend_node_file
 from .simple_navigation_agent import SimpleNavigationAgent
 from .joint_control_knob import JointControlKnob
 from vis_utils.graphics import materials
@@ -50,17 +51,21 @@ def create_blend_controller(self, name, skeleton, motions, joint_name=None, cons
 
 
 def load_blend_controller(self, filename):
-    with open(filename, "rb") as in_file:
-        node = pickle.load(in_file)
-        scene_object = SceneObject()
-        name = filename.split("/")[-1]
-        scene_object.name = name
-        blend_animation_controller = BlendAnimationController(scene_object)
-        blend_animation_controller.set_track(node)
-        blend_animation_controller.set_skeleton(node.skeleton)
-        blend_animation_controller.updateTransformation(0)
-        scene_object.add_component("blend_controller", blend_animation_controller)
-        self._scene.addAnimationController(scene_object, "blend_controller")
+    if is_blend_node_file(filename):
+        node = load_blend_node(filename)
+    else:
+        # files written before the introduction of the blend node format contain a pickled node
+        with open(filename, "rb") as in_file:
+            node = pickle.load(in_file)
+    scene_object = SceneObject()
+    name = filename.split("/")[-1]
+    scene_object.name = name
+    blend_animation_controller = BlendAnimationController(scene_object)
+    blend_animation_controller.set_track(node)
+    blend_animation_controller.set_skeleton(node.skeleton)
+    blend_animation_controller.updateTransformation(0)
+    scene_object.add_component("blend_controller", blend_animation_controller)
+    self._scene.addAnimationController(scene_object, "blend_controller")
 
 
 def load_morphable_graphs_file(builder, filename):
@@ -20,16 +20,21 @@
 # DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
 # OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE
 # USE OR OTHER DEALINGS IN THE SOFTWARE.
+import os
+import shutil
+import tempfile
 import collections
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
 from vis_utils.animation.animation_controller import AnimationController
 from vis_utils.animation.skeleton_visualization import SkeletonVisualization
 from vis_utils.scene.components import ComponentBase
 from vis_utils.animation.skeleton_animation_controller import LegacySkeletonAnimationController
-import operator
 from anim_utils.animation_data import MotionVector
-from anim_utils.animation_data.motion_blending import generate_frame_using_iterative_slerp
 import heapq
+import itertools
+
+SLERP_EPS = np.finfo(float).eps * 4.0
 
 
 def generate_frame_linear(skeleton, motions, frame_idx, weights):
@@ -68,6 +73,231 @@ def generate_blend_weights(positions, new_p, n_neighbors):
     return weights
 
 
+def get_knn_blend_weights(positions, points, n_neighbors):
+    """ vectorized version of AnimationBlendNode.set_blend_parameter for one or more points
+        returns one weight vector over all motions per point, motions outside of the
+        k nearest neighbors get a weight of zero
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    positions = positions.reshape((len(positions), -1))
+    points = np.asarray(points, dtype=np.float64).reshape((-1, positions.shape[1]))
+    n_points, n_motions = len(points), len(positions)
+    k = max(1, min(n_neighbors, n_motions))
+    distances = np.linalg.norm(points[:, np.newaxis, :] - positions[np.newaxis, :, :], axis=2)
+    order = np.argsort(distances, axis=1, kind="mergesort")[:, :k]
+    rows = np.arange(n_points)[:, np.newaxis]
+    sorted_distances = distances[rows, order]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        inv_distances = 1.0 / sorted_distances - 1.0 / sorted_distances[:, -1:]
+        inv_sums = np.sum(inv_distances, axis=1)
+        new_weights = inv_distances / inv_sums[:, np.newaxis]
+    # use the nearest motion if the point lies on it or all neighbors are equally far away
+    nearest_only = (sorted_distances[:, 0] <= 0) | ~(inv_sums > 0)
+    new_weights[nearest_only] = 0.0
+    new_weights[nearest_only, 0] = 1.0
+    weights = np.zeros((n_points, n_motions))
+    weights[rows, order] = new_weights
+    return weights
+
+
+def quaternion_slerp_batch(q0, q1, fraction):
+    """ vectorized version of transformations.quaternion_slerp with shortestpath=True
+        for arrays of quaternions with shape (..., 4) and a scalar fraction or
+        an array of fractions that can be broadcast to the shape (...)
+    """
+    q0 = q0 / np.linalg.norm(q0, axis=-1)[..., np.newaxis]
+    q1 = q1 / np.linalg.norm(q1, axis=-1)[..., np.newaxis]
+    fraction = np.asarray(fraction, dtype=np.float64)
+    if fraction.ndim == 0:
+        if fraction == 0.0:
+            return q0
+        elif fraction == 1.0:
+            return q1
+    d = np.sum(q0 * q1, axis=-1)
+    q1_short = np.where((d < 0.0)[..., np.newaxis], -q1, q1)
+    d = np.abs(d)
+    angle = np.arccos(np.minimum(d, 1.0))
+    use_q0 = (np.abs(d - 1.0) < SLERP_EPS) | (np.abs(angle) < SLERP_EPS)
+    isin = 1.0 / np.where(use_q0, 1.0, np.sin(angle))
+    w0 = np.where(use_q0, 1.0, np.sin((1.0 - fraction) * angle) * isin)
+    w1 = np.where(use_q0, 0.0, np.sin(fraction * angle) * isin)
+    result = w0[..., np.newaxis] * q0 + w1[..., np.newaxis] * q1_short
+    if fraction.ndim > 0:
+        fraction = np.broadcast_to(fraction, d.shape)[..., np.newaxis]
+        result = np.where(fraction == 0.0, q0, np.where(fraction == 1.0, q1, result))
+    return result
+
+
+def _get_blend_indices(weights, order):
+    if order is None:
+        return np.flatnonzero(weights > 0)
+    return [idx for idx in order if weights[idx] > 0]
+
+
+def generate_frame_using_batched_slerp(frames, weights, n_joints, order=None):
+    """ vectorized version of generate_frame_using_iterative_slerp that blends all joints at once
+        frames: n_motions x n_params for one frame index
+        weights: n_motions, motions with a weight of zero are skipped
+        order: motion indices in the order in which they are blended, by default the index order
+    """
+    indices = _get_blend_indices(weights, order)
+    if len(indices) == 0:
+        return None
+    frame = np.array(frames[indices[0]], dtype=np.float64)
+    q_end_idx = 3 + n_joints * 4
+    quats = frame[3:q_end_idx].reshape((n_joints, 4))
+    w_sum = weights[indices[0]]
+    for idx in indices[1:]:
+        new_w_sum = w_sum + weights[idx]
+        w_a = w_sum / new_w_sum
+        w_b = weights[idx] / new_w_sum
+        frame_b = frames[idx]
+        frame[:3] = w_a * frame[:3] + w_b * frame_b[:3]
+        new_q = quaternion_slerp_batch(quats, frame_b[3:q_end_idx].reshape((n_joints, 4)), w_b)
+        quats[:] = new_q / np.linalg.norm(new_q, axis=1)[:, np.newaxis]
+        w_sum = new_w_sum
+    return frame
+
+
+def generate_frames_using_batched_slerp(motions, lengths, weights, n_joints, order=None):
+    """ blends complete motions with the iterative slerp of generate_frame_using_batched_slerp
+        motions: n_motions x n_frames x n_params, lengths: n_motions, weights: n_motions
+        the weights are renormalized per frame over the motions that contain the frame
+        and frames without a valid motion keep the padded values of the first weighted motion
+    """
+    n_frames = motions.shape[1]
+    indices = _get_blend_indices(weights, order)
+    if len(indices) == 0:
+        return None
+    valid = np.asarray(lengths)[:, np.newaxis] > np.arange(n_frames)[np.newaxis, :]
+    frame_weights = np.where(valid, np.asarray(weights)[:, np.newaxis], 0.0)
+    q_end_idx = 3 + n_joints * 4
+    frames = np.array(motions[indices[0]], dtype=np.float64)
+    w_sum = frame_weights[indices[0]]
+    for idx in indices[1:]:
+        new_w_sum = w_sum + frame_weights[idx]
+        has_weight = new_w_sum > 0
+        safe_w_sum = np.where(has_weight, new_w_sum, 1.0)
+        w_a = np.where(has_weight, w_sum / safe_w_sum, 1.0)
+        w_b = np.where(has_weight, frame_weights[idx] / safe_w_sum, 0.0)
+        frames[:, :3] = w_a[:, np.newaxis] * frames[:, :3] + w_b[:, np.newaxis] * motions[idx, :, :3]
+        q_a = frames[:, 3:q_end_idx].reshape((n_frames, n_joints, 4))
+        q_b = motions[idx, :, 3:q_end_idx].reshape((n_frames, n_joints, 4))
+        new_q = quaternion_slerp_batch(q_a, q_b, w_b[:, np.newaxis])
+        new_q /= np.linalg.norm(new_q, axis=2)[:, :, np.newaxis]
+        # keep the frames in which the motion has no weight unchanged as in the iterative version
+        new_q = np.where((w_b > 0)[:, np.newaxis, np.newaxis], new_q, q_a)
+        frames[:, 3:q_end_idx] = new_q.reshape((n_frames, -1))
+        w_sum = new_w_sum
+    return frames
+
+
+def _get_export_file_name(directory, prefix, sample_idx, file_format):
+    return os.path.join(directory, prefix + "_" + str(sample_idx) + "." + file_format)
+
+
+def export_blend_samples(motion_file, lengths, skeleton, frame_time, sample_indices, weights,
+                         directory, prefix, file_format, out_file=None):
+    """ task function of export_blend_space_samples that blends and writes one chunk of samples
+        the motion array and the output array of the npy format are memory mapped
+    """
+    motions = np.load(motion_file, mmap_mode="r")
+    out_frames = None
+    if file_format == "npy":
+        out_frames = np.load(out_file, mmap_mode="r+")
+    n_joints = len(skeleton.animated_joints)
+    for sample_idx, w in zip(sample_indices, weights):
+        frames = generate_frames_using_batched_slerp(motions, lengths, w, n_joints)
+        if out_frames is not None:
+            out_frames[sample_idx] = frames
+        else:
+            mv = MotionVector()
+            mv.frames = skeleton.add_fixed_joint_parameters_to_motion(frames)
+            mv.n_frames = len(frames)
+            mv.frame_time = frame_time
+            mv.export(skeleton, _get_export_file_name(directory, prefix, sample_idx, file_format), False)
+    if out_frames is not None:
+        out_frames.flush()
+    return len(sample_indices)
+
+
+def export_blend_space_samples(node, parameters, directory, n_neighbors, file_format="bvh",
+                               n_workers=1, prefix="sample", chunk_size=16):
+    """ blends one clip per row of parameters and writes it to directory
+        file_format "bvh" writes one file per sample, "npy" writes the blended frames of all
+        samples into one array of shape n_samples x n_frames x n_params in prefix.npy and the
+        parameters into prefix_parameters.npy. The clips are written chunk by chunk, so only
+        chunk_size clips per worker are kept in memory.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    parameters = np.asarray(parameters, dtype=np.float64).reshape((len(parameters), -1))
+    n_samples = len(parameters)
+    weights = get_knn_blend_weights(node.get_position_array(), parameters, n_neighbors)
+    motions = node.get_motion_array()
+    out_file = None
+    if file_format == "npy":
+        out_file = os.path.join(directory, prefix + ".npy")
+        out_frames = np.lib.format.open_memmap(out_file, mode="w+", dtype=np.float64,
+                                               shape=(n_samples,) + motions.shape[1:])
+        del out_frames
+        np.save(os.path.join(directory, prefix + "_parameters.npy"), parameters)
+    chunks = [list(range(start, min(start + chunk_size, n_samples))) for start in range(0, n_samples, chunk_size)]
+    tmp_dir = tempfile.mkdtemp(prefix="blend_export_")
+    try:
+        motion_file = os.path.join(tmp_dir, "motions.npy")
+        np.save(motion_file, motions)
+        task_args = [(motion_file, node._motion_lengths, node.skeleton, node.frame_time, chunk, weights[chunk],
+                      directory, prefix, file_format, out_file) for chunk in chunks]
+        count = 0
+        if n_workers > 1:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                futures = [executor.submit(export_blend_samples, *args) for args in task_args]
+                for future in as_completed(futures):
+                    count += future.result()
+                    print("exported", str(count) + "/" + str(n_samples))
+        else:
+            for args in task_args:
+                count += export_blend_samples(*args)
+                print("exported", str(count) + "/" + str(n_samples))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return n_samples
+
+
+class BlendWeightLattice(object):
+    """ blend weights precomputed on a regular grid over the parameter range
+        the weights of a parameter are interpolated multilinearly from the surrounding grid points
+    """
+    def __init__(self, positions, min_pos, max_pos, n_neighbors, resolution=32):
+        self.n_neighbors = n_neighbors
+        self.min_pos = np.atleast_1d(np.asarray(min_pos, dtype=np.float64))
+        self.max_pos = np.atleast_1d(np.asarray(max_pos, dtype=np.float64))
+        self.resolution = max(2, int(resolution))
+        n_dims = len(self.min_pos)
+        axes = [np.linspace(self.min_pos[d], self.max_pos[d], self.resolution) for d in range(n_dims)]
+        grid = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape((-1, n_dims))
+        n_motions = len(positions)
+        self.weights = get_knn_blend_weights(positions, grid, n_neighbors)
+        self.weights = self.weights.reshape(tuple([self.resolution] * n_dims) + (n_motions,))
+        self.corners = list(itertools.product([0, 1], repeat=n_dims))
+
+    def get_weights(self, p):
+        p = np.atleast_1d(np.asarray(p, dtype=np.float64))
+        extent = self.max_pos - self.min_pos
+        extent[extent <= 0] = 1.0
+        t = np.clip((p - self.min_pos) / extent, 0.0, 1.0) * (self.resolution - 1)
+        lower = np.minimum(np.floor(t).astype(np.int64), self.resolution - 2)
+        alpha = t - lower
+        weights = np.zeros(self.weights.shape[-1])
+        for corner in self.corners:
+            corner = np.array(corner)
+            c = np.prod(np.where(corner == 1, alpha, 1.0 - alpha))
+            if c > 0:
+                weights += c * self.weights[tuple(lower + corner)]
+        return weights / np.sum(weights)
+
+
 class AnimationBlendNode(object):
     def __init__(self):
         self._motions = collections.OrderedDict()
@@ -81,6 +311,17 @@ class AnimationBlendNode(object):
         self.n_blend_space_params = 0
         self.frame_time = 1.0/30.0
         self.parameter_labels = [""]
+        self._motion_array = None  # n_motions x n_frames x n_params, created on demand
+        self._motion_lengths = None
+        self._weight_vector = None
+        self.weight_lattice = None
+
+    def __getstate__(self):
+        # the packed motion array is recreated from the motions on demand
+        state = self.__dict__.copy()
+        state["_motion_array"] = None
+        state["_motion_lengths"] = None
+        return state
 
     def set_parameter_labels(self, labels):
         self.parameter_labels = labels
@@ -90,6 +331,9 @@ class AnimationBlendNode(object):
         n_frames = len(frames)
         self._motions[name] = frames
         self._positions[name] = position
+        self._motion_array = None
+        self._weight_vector = None
+        self.weight_lattice = None
         self.update_parameter_range()
         if n_frames > self.n_frames:
             self.n_frames = n_frames
@@ -111,22 +355,52 @@ class AnimationBlendNode(object):
         p = (self._min_pos + self._max_pos) / 2.0
         self.set_blend_parameter(p, len(self._positions))
 
-    def set_blend_parameter_new(self, new_p, n_neighbors):
-        self._weights = generate_blend_weights(self._positions, new_p, n_neighbors)
+    def get_motion_array(self):
+        """ packs the example motions into one array padded with the last frame of each motion """
+        if getattr(self, "_motion_array", None) is None:
+            n_motions = len(self._motions)
+            self._motion_array = np.zeros((n_motions, self.n_frames, self.n_params))
+            self._motion_lengths = np.zeros(n_motions, dtype=np.int64)
+            for idx, frames in enumerate(self._motions.values()):
+                n_frames = len(frames)
+                self._motion_array[idx, :n_frames] = frames
+                self._motion_array[idx, n_frames:] = frames[-1]
+                self._motion_lengths[idx] = n_frames
+        return self._motion_array
+
+    def get_position_array(self):
+        return np.array([np.atleast_1d(p) for p in self._positions.values()], dtype=np.float64)
+
+    def build_weight_lattice(self, n_neighbors, resolution=32):
+        """ precomputes the weights over the parameter range so that set_blend_parameter
+            only needs to interpolate when it is called with the same number of neighbors
+        """
+        self.weight_lattice = BlendWeightLattice(self.get_position_array(), self._min_pos, self._max_pos,
+                                                 n_neighbors, resolution)
+
+    def get_weight_vector(self):
+        if getattr(self, "_weight_vector", None) is None:
+            self.set_weight_vector(np.array([self._weights.get(name, 0.0) for name in self._motions.keys()]))
+        return self._weight_vector
+
+    def set_weight_vector(self, weights):
+        self._weight_vector = weights
+        self._weights = collections.OrderedDict()
+        for idx, name in enumerate(self._motions.keys()):
+            if weights[idx] > 0:
+                self._weights[name] = weights[idx]
 
     def set_blend_parameter(self, new_p, n_neighbors):
-        distances = {(n, np.linalg.norm(new_p - p)) for n, p in self._positions.items()}
-        sorted_distances = sorted(distances, key=operator.itemgetter(1))
-        sorted_names = [name for name, v in sorted_distances[:n_neighbors]]
-        sorted_values = np.array([v for name, v in sorted_distances[:n_neighbors]])
-        if sorted_values[0] <= 0:
-            self._weights[sorted_names[0]] = 1.0
+        lattice = getattr(self, "weight_lattice", None)
+        if lattice is not None and lattice.n_neighbors == n_neighbors:
+            weights = lattice.get_weights(new_p)
         else:
-            inv_k_distance = 1.0 / sorted_values[-1]
-            inv_distances = 1.0 / sorted_values - inv_k_distance
-            new_weights = inv_distances / np.sum(inv_distances)
-            for idx, n in enumerate(sorted_names):
-                self._weights[n] = new_weights[idx]
+            weights = get_knn_blend_weights(self.get_position_array(), new_p, n_neighbors)[0]
+        self.set_weight_vector(weights)
+
+    def set_blend_parameter_new(self, new_p, n_neighbors):
+        self._weights = generate_blend_weights(self._positions, new_p, n_neighbors)
+        self._weight_vector = None
 
     def set_blend_parameter_prev2(self, new_p, k):
         """ Use inverse distance to estimate weights according to [Johansen 2009]"""
@@ -144,6 +418,7 @@ class AnimationBlendNode(object):
             weights = inv_distances / h_sum
             for idx, n in enumerate(self._positions.keys()):
                 self._weights[n] = weights[idx]
+        self._weight_vector = None
         print("update weights", self._weights)
 
     def get_valid_weights(self, frame_idx):
@@ -157,16 +432,44 @@ class AnimationBlendNode(object):
             weights[name] /= w_sum
         return weights
 
+    def get_blend_order(self):
+        """ indices of the weighted motions in the order of the weights dict, which is the order of the slerp """
+        indices = {name: idx for idx, name in enumerate(self._motions.keys())}
+        return [indices[name] for name in self._weights.keys()]
+
+    def get_valid_weight_vector(self, frame_idx):
+        """ weights of the motions that contain frame_idx normalized to a sum of one or None """
+        motions = self.get_motion_array()
+        if not 0 <= frame_idx < motions.shape[1]:
+            return None
+        weights = np.where(self._motion_lengths > frame_idx, self.get_weight_vector(), 0.0)
+        w_sum = np.sum(weights)
+        if w_sum <= 0:
+            return None
+        return weights / w_sum
+
     def get_frame(self, frame_idx):
-        weights = self.get_valid_weights(frame_idx)
-        if len(weights) == 0:
+        weights = self.get_valid_weight_vector(frame_idx)
+        if weights is None:
             return
-        return generate_frame_using_iterative_slerp(self.skeleton, self._motions, frame_idx, weights)
+        n_joints = len(self.skeleton.animated_joints)
+        return generate_frame_using_batched_slerp(self._motion_array[:, frame_idx], weights, n_joints,
+                                                  self.get_blend_order())
+
+    def to_frames(self, weights=None):
+        """ blends all frames at once using the current weights or the given weight vector
+            which is blended in the index order of the motions
+        """
+        order = None
+        if weights is None:
+            weights = self.get_weight_vector()
+            order = self.get_blend_order()
+        n_joints = len(self.skeleton.animated_joints)
+        return generate_frames_using_batched_slerp(self.get_motion_array(), self._motion_lengths, weights, n_joints,
+                                                   order)
 
     def to_motion_vector(self):
-        frames = []
-        for idx in range(self.n_frames):
-            frames.append(self.get_frame(idx))
+        frames = self.to_frames()
         mv = MotionVector()
         mv.frames = self.skeleton.add_fixed_joint_parameters_to_motion(frames)
         mv.n_frames = self.n_frames
@@ -236,6 +539,10 @@ class BlendAnimationController(LegacySkeletonAnimationController):
     def set_n_neighbors(self, n_neighbors):
         self.n_neighbors = n_neighbors
 
+    def build_weight_lattice(self, resolution=32):
+        """ precompute the blend weights for the current number of neighbors to speed up scrubbing """
+        self.track.build_weight_lattice(self.n_neighbors, resolution)
+
     def isLoadedCorrectly(self):
         return len(self.track._motions) > 0
 
@@ -255,9 +562,8 @@ class BlendAnimationController(LegacySkeletonAnimationController):
         return self.track.parameter_labels
 
     def save_to_file(self, filename):
-        import pickle
-        with open(filename, "wb") as out_file:
-            pickle.dump(self.track, out_file)
+        from .blend_node_io import save_blend_node
+        save_blend_node(self.track, filename)
 
     def getFrameTime(self):
         return self.track.frame_time
@@ -266,6 +572,11 @@ class BlendAnimationController(LegacySkeletonAnimationController):
         mv = self.track.to_motion_vector()
         mv.export(self.track.skeleton, filename, False)
 
+    def export_blend_space_samples(self, parameters, directory, file_format="bvh", n_workers=1, prefix="sample"):
+        """ exports one blended clip per row of parameters, see export_blend_space_samples """
+        return export_blend_space_samples(self.track, parameters, directory, self.n_neighbors,
+                                          file_format, n_workers, prefix)
+
     def set_frame_time(self, frame_time):
         self.track.frame_time = frame_time
 
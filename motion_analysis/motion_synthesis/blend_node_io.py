@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 DFKI GmbH.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the
+# following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+# NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE
+# USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+File format for AnimationBlendNode that replaces the pickled node.
+The file starts with a magic string and the length of a json header followed by the header
+and one contiguous float32 block of the example motions with the shape
+n_motions x n_frames x n_params. Shorter motions are padded with their last frame.
+The block starts at a multiple of DATA_ALIGNMENT so that it can be memory mapped.
+"""
+import json
+import struct
+import numpy as np
+from anim_utils.animation_data import SkeletonBuilder
+from .blend_animation_controller import AnimationBlendNode
+
+MAGIC = b"BLENDNOD"
+FORMAT_VERSION = 1
+DATA_ALIGNMENT = 64
+
+
+def is_blend_node_file(filename):
+    with open(filename, "rb") as in_file:
+        return in_file.read(len(MAGIC)) == MAGIC
+
+
+def _get_data_offset(header_size):
+    offset = len(MAGIC) + 4 + header_size
+    return ((offset + DATA_ALIGNMENT - 1) // DATA_ALIGNMENT) * DATA_ALIGNMENT
+
+
+def save_blend_node(node, filename, skeleton_name=None):
+    """ writes the header and then the frames motion by motion without creating a float64 copy of all frames """
+    names = list(node._motions.keys())
+    lengths = [len(node._motions[name]) for name in names]
+    header = dict()
+    header["version"] = FORMAT_VERSION
+    header["names"] = names
+    header["lengths"] = lengths
+    header["positions"] = [np.atleast_1d(np.asarray(node._positions[name], dtype=np.float64)).tolist() for name in names]
+    header["weights"] = np.asarray(node.get_weight_vector(), dtype=np.float64).tolist()
+    header["shape"] = [len(names), int(node.n_frames), int(node.n_params)]
+    header["dtype"] = "float32"
+    header["frame_time"] = node.frame_time
+    header["parameter_labels"] = list(node.parameter_labels)
+    header["skeleton_name"] = skeleton_name
+    header["skeleton"] = node.skeleton.to_json() if node.skeleton is not None else None
+    header_bytes = json.dumps(header).encode("utf-8")
+    offset = _get_data_offset(len(header_bytes))
+    with open(filename, "wb") as out_file:
+        out_file.write(MAGIC)
+        out_file.write(struct.pack("<I", len(header_bytes)))
+        out_file.write(header_bytes)
+        out_file.write(b"\0" * (offset - out_file.tell()))
+        for name, n_frames in zip(names, lengths):
+            frames = np.zeros((node.n_frames, node.n_params), dtype=np.float32)
+            frames[:n_frames] = node._motions[name]
+            frames[n_frames:] = frames[n_frames - 1]
+            out_file.write(frames.tobytes())
+
+
+def read_blend_node_header(filename):
+    with open(filename, "rb") as in_file:
+        if in_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("Not a blend node file " + filename)
+        header_size = struct.unpack("<I", in_file.read(4))[0]
+        header = json.loads(in_file.read(header_size).decode("utf-8"))
+    if header["version"] > FORMAT_VERSION:
+        raise ValueError("Unsupported blend node file version " + str(header["version"]))
+    return header, _get_data_offset(header_size)
+
+
+def load_blend_node(filename, skeleton=None, mmap_mode="r"):
+    """ maps the frame block into memory so that only the frames that are played are read from disk
+        the skeleton stored in the file is used if no skeleton is given
+    """
+    header, offset = read_blend_node_header(filename)
+    shape = tuple(header["shape"])
+    node = AnimationBlendNode()
+    if shape[0] > 0:
+        data = np.memmap(filename, dtype=np.dtype(header["dtype"]), mode=mmap_mode, offset=offset, shape=shape)
+    else:
+        data = np.zeros(shape, dtype=np.dtype(header["dtype"]))
+    for idx, name in enumerate(header["names"]):
+        node._motions[name] = data[idx, :header["lengths"][idx]]
+        node._positions[name] = np.array(header["positions"][idx])
+    node.n_frames = shape[1]
+    node.n_params = shape[2]
+    node._motion_array = data
+    node._motion_lengths = np.array(header["lengths"], dtype=np.int64)
+    if shape[0] > 0:
+        node.update_parameter_range()
+    node.set_parameter_labels(header["parameter_labels"])
+    node.frame_time = header["frame_time"]
+    if skeleton is None and header["skeleton"] is not None:
+        skeleton = SkeletonBuilder().load_from_json_data(header["skeleton"])
+    node.skeleton = skeleton
+    if len(header["weights"]) == shape[0]:
+        node.set_weight_vector(np.array(header["weights"]))
+    return node
@@ -48,6 +48,7 @@ from morphablegraphs.motion_model.static_motion_primitive import StaticMotionPri
 from morphablegraphs.motion_generator.mg_state_planner import MGStatePlanner, get_node_aligning_2d_transform, ANIMATED_JOINTS_CUSTOM
 from morphablegraphs.constraints.constraint_builder import UnityFrameConstraint
 from morphablegraphs.motion_generator.mg_state_queue import StateQueueEntry
+from .state_look_ahead import StateLookAhead
 
 
 def rotate_vector_deg(vec, a):
@@ -128,6 +129,7 @@ class MorphableGraphStateMachine(StateMachineController):
         self.action_constraint = None
         self.target_projection_len = 0
         self.n_joints = len(self.skeleton.animated_joints)
+        # number of updates the render thread waits for a late planner before it transitions to idle
         self.n_max_state_queries = 20
 
         self.retarget_engine = None
@@ -153,6 +155,13 @@ class MorphableGraphStateMachine(StateMachineController):
         self.stop_current_state = False
         self.lock = threading.Lock()
         self.recorded_poses = list()
+        self.n_waiting_updates = 0
+        self.n_stalls = 0
+        self.n_stalled_updates = 0
+        self.n_idle_fallbacks = 0
+        self.n_synchronous_transitions = 0
+        self.look_ahead = StateLookAhead(self, config.get("look_ahead_depth", 2))
+        self.look_ahead.start()
         #if pfnn_data is not None:
         #    self.planner.pfnn_wrapper = PFNNWrapper.load_from_dict(self.skeleton, pfnn_data["weights"], pfnn_data["means"])
         #    self.planner.use_pfnn = True
@@ -179,6 +188,7 @@ class MorphableGraphStateMachine(StateMachineController):
         self.current_node = self.start_node
         self.set_initial_idle_state(self.planner.settings.use_all_joints)
         self.planner.state_queue.reset()
+        self.look_ahead.invalidate()
         self.lock.release()
         if self.animation_server is not None:
             #self.animation_server.start()
@@ -242,7 +252,7 @@ class MorphableGraphStateMachine(StateMachineController):
         if self.play:
             transition = self.state.update(self.speed * dt)
             self.lock.acquire()
-            if transition or (len(self.planner.state_queue) > 0 and self.stop_current_state):
+            if transition or self.n_waiting_updates > 0 or (len(self.planner.state_queue) > 0 and self.stop_current_state):
                 # decide if the state planner should be used based on a given task and the number of states in the queue
                 use_state_planner = False
                 #self.planner.state_queue.mutex.acquire()
@@ -250,24 +260,30 @@ class MorphableGraphStateMachine(StateMachineController):
                     use_state_planner = True
                 #self.planner.state_queue.mutex.release()
                 if use_state_planner:
-                    # if the state planner should be used wait until a state was generated
-                    success = False
-                    n_queries = 0
-                    while not success and n_queries < self.n_max_state_queries:
-                        self.planner.state_queue.mutex.acquire()
-                        success = self.pop_motion_state_from_queue()
-                        if not success:
-                            #print("Warning: state queue is empty")
-                            n_queries += 1
-                        self.planner.state_queue.mutex.release()
-                    if not success:
+                    # if the state planner should be used take the next state without waiting for the planner thread
+                    self.planner.state_queue.mutex.acquire()
+                    success = self.pop_motion_state_from_queue()
+                    self.planner.state_queue.mutex.release()
+                    if success:
+                        self.n_waiting_updates = 0
+                        self.stop_current_state = False
+                    elif self.planner.is_processing and self.n_waiting_updates < self.n_max_state_queries:
+                        # hold the last frame and try again in the next update
+                        if self.n_waiting_updates == 0:
+                            self.n_stalls += 1
+                        self.n_waiting_updates += 1
+                        self.n_stalled_updates += 1
+                        self.state.hold_last_frame = True
+                    else:
                         print("Warning: transition to idle state due to empty state queue")
                         state_entry = self.planner.state_queue.generate_idle_state(dt, self.pose_buffer, False)
                         self.set_state_entry(state_entry)
-                    self.stop_current_state = False
+                        self.n_idle_fallbacks += 1
+                        self.n_waiting_updates = 0
+                        self.stop_current_state = False
                 else:
                     # otherwise transition to new state without the planner, e.g. to idle state
-                    self.transition_to_next_state_controlled()
+                    self.transition_to_next_state_controlled(dt)
                     #print("WAIT")
             self.lock.release()
             self.update_transformation()
@@ -292,6 +308,7 @@ class MorphableGraphStateMachine(StateMachineController):
         self.lock.acquire()
         self.state.set_position(position)
         self.set_buffer_position(position)
+        self.look_ahead.invalidate()
         self.lock.release()
         assert not np.isnan(self.pose_buffer[-1]).any(), "Error in set pos "+str(position)
 
@@ -299,6 +316,7 @@ class MorphableGraphStateMachine(StateMachineController):
         self.lock.acquire()
         self.state.set_orientation(orientation)
         self.set_buffer_orientation(orientation)
+        self.look_ahead.invalidate()
         self.lock.release()
         assert not np.isnan(self.pose_buffer[-1]).any(), "Error in set orientation "+str(orientation)
 
@@ -327,6 +345,7 @@ class MorphableGraphStateMachine(StateMachineController):
             state_entry = StateQueueEntry(node_id, node_type, state, pose_buffer)
             self.set_state_entry(state_entry)
             self.planner.state_queue.reset()
+            self.look_ahead.invalidate()
             print("set state entry ", clip_name)
             self.planner.state_queue.mutex.release()
             self.lock.release()
@@ -407,18 +426,23 @@ class MorphableGraphStateMachine(StateMachineController):
         self.planner.state_queue.mutex.release()
         self.planner.stop_thread = False
         self.planner.is_processing = True
-        if refresh:
-            self.lock.acquire()
-            self.stop_current_state = True
-            pose_buffer = []
-            for p in self.pose_buffer:
-                pose_buffer.append(p)
-            #self.transition_to_next_state_controlled()
-            self.lock.release()
-
-        method_args = (_action_sequence, start_node, start_node_type, pose_buffer, dt)
-        self.thread = threading.Thread(target=self.planner.generate_motion_states_from_action_sequence, name="c", args=method_args)
-        self.thread.start()
+        # the planner thread shares the motion primitive generator with the look-ahead thread,
+        # which does not start a new slot while the planner is processing.
+        # invalidate cancels a running slot before the lock is taken so that the lock is released after the current step
+        self.look_ahead.invalidate()
+        with self.look_ahead.generation_lock:
+            if refresh:
+                self.lock.acquire()
+                self.stop_current_state = True
+                pose_buffer = []
+                for p in self.pose_buffer:
+                    pose_buffer.append(p)
+                #self.transition_to_next_state_controlled()
+                self.lock.release()
+
+            method_args = (_action_sequence, start_node, start_node_type, pose_buffer, dt)
+            self.thread = threading.Thread(target=self.planner.generate_motion_states_from_action_sequence, name="c", args=method_args)
+            self.thread.start()
 
     def draw(self, modelMatrix, viewMatrix, projectionMatrix, lightSources):
         return
@@ -440,43 +464,92 @@ class MorphableGraphStateMachine(StateMachineController):
 
     def set_aligning_transform(self):
         """ uses a random sample of the morphable model to find an aligning transformation to bring constraints into the local coordinate system"""
-        sample = self._graph.nodes[self.current_node].sample(False)
+        self.aligning_transform = self.get_aligning_transform(self.current_node, self.pose_buffer)
+
+    def get_aligning_transform(self, node, pose_buffer):
+        sample = self._graph.nodes[node].sample(False)
         frames = sample.get_motion_vector()
         m = get_node_aligning_2d_transform(self.skeleton, self.skeleton.aligning_root_node,
-                                           self.pose_buffer, frames)
-        self.aligning_transform = np.linalg.inv(m)
-
-    def transition_to_next_state_controlled(self):
-        self.current_node, self.node_type, self.node_queue = self.select_next_node(self.current_node, self.node_type, self.node_queue, self.target_projection_len)
-        #print("transition", self.current_node, self.node_type, self.target_projection_len)
-        self.set_aligning_transform()
-        if isinstance(self._graph.nodes[self.current_node].motion_primitive, StaticMotionPrimitive):
-            spline = self._graph.nodes[self.current_node].sample()
+                                           pose_buffer, frames)
+        return np.linalg.inv(m)
+
+    def transition_to_next_state_controlled(self, dt=0.0):
+        """ takes the next state from the look-ahead thread without waiting for it.
+            While the matching state is missing the last frame is held for up to n_max_state_queries updates,
+            then the controller transitions to an idle state.
+        """
+        if self.look_ahead.thread is None:
+            # the look-ahead is deactivated so the state is generated on this thread
+            self.n_synchronous_transitions += 1
+            result = self.generate_state_entry(self.current_node, self.node_type, self.node_queue, self.target_projection_len,
+                                               self.direction_vector, self.pose_buffer)
+        else:
+            is_waiting = self.n_waiting_updates > 0
+            result = self.look_ahead.pop(self.current_node, self.node_type, self.node_queue, self.target_projection_len, is_waiting)
+        if result is None:
+            if self.n_waiting_updates < self.n_max_state_queries:
+                if self.n_waiting_updates == 0:
+                    self.n_stalls += 1
+                self.n_waiting_updates += 1
+                self.n_stalled_updates += 1
+                self.state.hold_last_frame = True
+            else:
+                print("Warning: transition to idle state due to missing look-ahead state")
+                state_entry = self.planner.state_queue.generate_idle_state(dt, self.pose_buffer, False)
+                self.set_state_entry(state_entry)
+                self.node_queue = []
+                self.n_idle_fallbacks += 1
+                self.n_waiting_updates = 0
+                self.look_ahead.invalidate()
+            return
+        self.n_waiting_updates = 0
+        state_entry, self.node_queue = result
+        self.state = state_entry.state
+        self.current_node = state_entry.node
+        self.node_type = state_entry.node_type
+        self.state.play = self.play
+        self.emit_update()
+
+    def generate_state_entry(self, current_node, current_node_type, node_queue, step_distance, direction_vector, pose_buffer, next_node_type=None, is_cancelled=None):
+        """ generates the state following current_node without changing the controller
+            returns the state queue entry and the remaining node queue or None if is_cancelled returns True between the steps
+        """
+        node, node_type, node_queue = self.select_next_node(current_node, current_node_type, node_queue, step_distance, next_node_type)
+        #print("transition", node, node_type, step_distance)
+        aligning_transform = self.get_aligning_transform(node, pose_buffer)
+        if is_cancelled is not None and is_cancelled():
+            return None
+        if isinstance(self._graph.nodes[node].motion_primitive, StaticMotionPrimitive):
+            spline = self._graph.nodes[node].sample()
             new_frames = spline.get_motion_vector()
         else:
-            mp_constraints = self.planner.constraint_builder.generate_walk_constraints(self.current_node, self.aligning_transform, self.direction_vector, self.target_projection_len, self.pose_buffer)
-            s = self.planner.mp_generator.generate_constrained_sample(self._graph.nodes[self.current_node], mp_constraints)
-            spline = self._graph.nodes[self.current_node].back_project(s, use_time_parameters=False)
+            mp_constraints = self.planner.constraint_builder.generate_walk_constraints(node, aligning_transform, direction_vector, step_distance, pose_buffer)
+            if is_cancelled is not None and is_cancelled():
+                return None
+            s = self.planner.mp_generator.generate_constrained_sample(self._graph.nodes[node], mp_constraints)
+            spline = self._graph.nodes[node].back_project(s, use_time_parameters=False)
             new_frames = spline.get_motion_vector()
-            #new_frames = self.planner.generate_constrained_motion_primitive(self.current_node, mp_constraints.constraints, self.pose_buffer)
-        
+            #new_frames = self.planner.generate_constrained_motion_primitive(node, mp_constraints.constraints, pose_buffer)
+
+        if is_cancelled is not None and is_cancelled():
+            return None
         if self.planner.settings.use_all_joints:
-            new_frames = self.planner.complete_frames(self.current_node, new_frames)
-        #new_frames = self.state.get_frames()
+            new_frames = self.planner.complete_frames(node, new_frames)
         ignore_rotation = False
-        if self.current_node[1] == "idle" and self.planner.settings.ignore_idle_rotation:
+        if node[1] == "idle" and self.planner.settings.ignore_idle_rotation:
             ignore_rotation = True
-        self.state = self.planner.state_queue.build_state(new_frames, self.pose_buffer, ignore_rotation)
-        self.state.play = self.play
-        self.emit_update()
+        state = self.planner.state_queue.build_state(new_frames, pose_buffer, ignore_rotation)
+        return StateQueueEntry(node, node_type, state, pose_buffer), node_queue
 
-    def select_next_node(self, current_node, current_node_type, node_queue, step_distance):
+    def select_next_node(self, current_node, current_node_type, node_queue, step_distance, next_node_type=None):
+        """ the next node type is derived from the step distance unless it is given """
         if len(node_queue):
             next_node, node_type = node_queue[0]
             node_queue = node_queue[1:]
             next_node_type = node_type
         else:
-            next_node_type = self.planner.get_next_node_type(current_node_type, step_distance)
+            if next_node_type is None:
+                next_node_type = self.planner.get_next_node_type(current_node_type, step_distance)
             next_node = self._graph.nodes[current_node].generate_random_transition(next_node_type)
             if next_node is None:
                next_node = self.start_node
@@ -564,6 +637,7 @@ class MorphableGraphStateMachine(StateMachineController):
             self.node_queue.append(((action, node_name), node_type))
         if self.node_type == NODE_TYPE_IDLE:
             self.node_queue.append((self.start_node, NODE_TYPE_IDLE))
+        self.look_ahead.invalidate()
         self.transition_to_next_state_controlled()
 
     def rotate_dir_vector(self, angle):
@@ -682,6 +756,7 @@ class MorphableGraphStateMachine(StateMachineController):
             self.planner.state_queue.reset()
             self.pose_buffer = list()
             self.set_initial_idle_state(self.use_all_joints)
+            self.look_ahead.invalidate()
 
         self.planner.state_queue.mutex.release()
         return
@@ -724,9 +799,28 @@ class MorphableGraphStateMachine(StateMachineController):
         self.planner.state_queue.mutex.acquire()
         self.planner.state_queue.reset()
         self.planner.state_queue.mutex.release()
+        self.look_ahead.invalidate()
         self.planner.stop_thread = False
         self.planner.is_processing = True
         
         self.stop_current_state = True
         #self.transition_to_next_state_controlled()
-        self.lock.release()
\ No newline at end of file
+        self.lock.release()
+
+    def cleanup(self):
+        """ stops the look-ahead and the planner thread when the controller is removed from the scene """
+        self.look_ahead.stop()
+        if self.thread is not None:
+            self.planner.stop_thread = True
+            self.thread.join()
+            self.thread = None
+
+    def get_scheduling_metrics(self):
+        """ returns the depth of the state queues and the number of times the render thread had to wait """
+        metrics = self.look_ahead.get_metrics()
+        metrics["planner_queue_depth"] = len(self.planner.state_queue)
+        metrics["n_stalls"] = self.n_stalls
+        metrics["n_stalled_updates"] = self.n_stalled_updates
+        metrics["n_idle_fallbacks"] = self.n_idle_fallbacks
+        metrics["n_synchronous_transitions"] = self.n_synchronous_transitions
+        return metrics
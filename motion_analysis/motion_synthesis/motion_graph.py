@@ -26,15 +26,26 @@ This file implements the similarity motion graphs
 Author: Xi Li
 """
 
+import os
 import random
+import shutil
+import tempfile
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from transformations import quaternion_multiply, quaternion_inverse, quaternion_from_euler, quaternion_matrix
 from anim_utils.animation_data.motion_vector import MotionVector
 from anim_utils.animation_data.motion_distance import convert_quat_frame_to_point_cloud
 from anim_utils.utils import calculate_point_cloud_distance
 from tarjan import tarjan
+from .motion_graph_edges import pack_node_features, find_transitions, find_transitions_using_index, TransitionCandidateIndex,\
+    save_node_features, get_row_shards, find_transitions_in_shard
+from .motion_graph_cache import get_motion_graph_key, save_graph_arrays, load_graph_arrays
+from motion_analysis import constants
 
 DEBUG = 1
+SHARDS_PER_WORKER = 4  # more shards than workers balance the load at the end of the build
+GRAPH_CACHE_DIR_NAME = "motion_graph_cache"
 
 
 def get_quat_from_two_vectors(u, v):
@@ -46,8 +57,20 @@ def get_quat_from_two_vectors(u, v):
     return q
 
 
+def quaternion_multiply_batch(q1, q2):
+    """ quaternion_multiply for arrays of quaternions in w, x, y, z convention """
+    w1, x1, y1, z1 = q1[..., 0], q1[..., 1], q1[..., 2], q1[..., 3]
+    w2, x2, y2, z2 = q2[..., 0], q2[..., 1], q2[..., 2], q2[..., 3]
+    return np.stack([w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2,
+                     w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+                     w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+                     w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2], axis=-1)
+
+
 class MGNode(object):
     """node class for motion similarity graph"""
+    __slots__ = ["pose", "velocity", "frame_id", "contact"]
+
     def __init__(self, pose, velocity, bvh_id, contact, weights = None):
         self.pose = pose
         self.velocity = velocity
@@ -60,11 +83,75 @@ class MotionGraphBuilder(object):
         self.measure_method = "motion_field"  # measure method for edges, option: motion_field, TODO
         self.distance_threshold = 0.05
         self.default_pos = [0.0, 100.0, 0.0]
+        self.tile_size = 512  # number of rows and columns of a block of the distance matrix
+        # optional candidate search with a k-d tree before the exact distance evaluation
+        self.use_candidate_index = False
+        self.candidate_dims = 16  # lower values make the tree faster but return more candidates
+        self.candidate_radius_scale = 1.0  # values below 1.0 trade recall for speed
+        self.n_comparisons = 0
+        self.n_skipped_comparisons = 0
+        # directory for finished graphs, set to None to deactivate the cache
+        self.cache_dir = os.path.join(constants.DATA_DIR, GRAPH_CACHE_DIR_NAME)
 
     def build(self, skeleton, motion_vectors):
-        """create MG by motion vectors"""
+        """create MG by motion vectors or load it from the cache"""
+        cache_key = self.get_cache_key(skeleton, motion_vectors)
+        graph = self.load_from_cache(skeleton, cache_key)
+        if graph is not None:
+            return graph
         nodes = self.create_nodes_by_motion_vectors(skeleton, motion_vectors)
         edges = self.create_edges_by_nodes(skeleton, nodes)
+        graph = self.create_motion_graph(skeleton, nodes, edges)
+        self.save_to_cache(graph, cache_key)
+        return graph
+
+    def parallel_build(self, skeleton, motion_vectors, n_workers=None):
+        """create MG by motion vectors and distribute the edge creation over n_workers processes
+           the result is the same as the result of build
+        """
+        cache_key = self.get_cache_key(skeleton, motion_vectors)
+        graph = self.load_from_cache(skeleton, cache_key)
+        if graph is not None:
+            return graph
+        nodes = self.create_nodes_by_motion_vectors(skeleton, motion_vectors)
+        edges = self.create_edges_in_parallel(skeleton, nodes, n_workers)
+        graph = self.create_motion_graph(skeleton, nodes, edges)
+        self.save_to_cache(graph, cache_key)
+        return graph
+
+    def get_cache_parameters(self):
+        parameters = dict()
+        parameters["distance_threshold"] = self.distance_threshold
+        parameters["measure_method"] = self.measure_method
+        parameters["default_pos"] = [float(v) for v in self.default_pos]
+        if self.use_candidate_index and self.candidate_radius_scale < 1.0:
+            # only a reduced radius changes the result
+            parameters["candidate_radius_scale"] = self.candidate_radius_scale
+        return parameters
+
+    def get_cache_key(self, skeleton, motion_vectors):
+        if self.cache_dir is None:
+            return None
+        return get_motion_graph_key(skeleton, motion_vectors, self.get_cache_parameters())
+
+    def load_from_cache(self, skeleton, cache_key):
+        if cache_key is None:
+            return None
+        result = load_graph_arrays(os.path.join(self.cache_dir, cache_key))
+        if result is None:
+            return None
+        if DEBUG:
+            print('load motion graph from cache ', cache_key)
+        return MotionGraph.from_arrays(skeleton, result[0])
+
+    def save_to_cache(self, graph, cache_key):
+        if cache_key is None:
+            return
+        meta_info = dict()
+        meta_info["parameters"] = self.get_cache_parameters()
+        save_graph_arrays(os.path.join(self.cache_dir, cache_key), graph.to_arrays(), meta_info)
+
+    def create_motion_graph(self, skeleton, nodes, edges):
         if DEBUG:
             print('original edges: ', edges)
         # implment strongest components by tarjan's algorithm
@@ -212,29 +299,67 @@ class MotionGraphBuilder(object):
         return distance
 
     def create_edges_by_nodes(self, skeleton, nodes):
-        """create edges for each node, edge value is the similarity between nodes"""
+        """create edges for each node, edge value is the similarity between nodes
+           the distances are evaluated block-wise on packed arrays, see motion_graph_edges
+        """
+        features = pack_node_features(skeleton, nodes)
+        n_nodes = len(nodes) - 1
+        n_pairs = max(n_nodes, 0) ** 2
+        if self.use_candidate_index and self.measure_method == "motion_field" and n_nodes > 1:
+            edges = self.create_edges_using_candidate_index(features)
+        else:
+            edges = find_transitions(features, 0, n_nodes, self.distance_threshold,
+                                     self.measure_method, self.tile_size)
+            self.n_comparisons = n_pairs
+        self.n_skipped_comparisons = n_pairs - self.n_comparisons
+        if DEBUG:
+            print('exact comparisons: ', self.n_comparisons, ' skipped: ', self.n_skipped_comparisons)
+        return edges
+
+    def create_edges_in_parallel(self, skeleton, nodes, n_workers=None):
+        """shard the rows of the similarity matrix over a process pool
+           the packed features are shared with the workers as memory mapped .npy files
+           and the edges of the shards are merged in the order of the rows
+        """
+        if n_workers is None:
+            n_workers = os.cpu_count() or 1
+        n_nodes = len(nodes) - 1
+        if n_workers <= 1 or n_nodes < 2:
+            return self.create_edges_by_nodes(skeleton, nodes)
+        features = pack_node_features(skeleton, nodes)
+        index_settings = None
+        if self.use_candidate_index and self.measure_method == "motion_field":
+            index_settings = (self.candidate_dims, self.candidate_radius_scale)
+        shards = get_row_shards(n_nodes, n_workers * SHARDS_PER_WORKER)
         edges = dict()
-        num_nodes = len(nodes) - 1
-        for i in range(num_nodes):
-            print('find edge for ', i, ' of ', num_nodes, ' nodes')
-            if nodes[i].frame_id == nodes[i + 1].frame_id:
-                edges[i] = [i + 1]
-            else:
-                edges[i] = []
-            for j in range(num_nodes):
-                if i == j or i + 1 == j:  # skip itself and its next
-                    continue
-                node1 = nodes[i]
-                node2 = nodes[j]
-                # we first estimate if the contact state of two nodes are same
-                contact_state = self.estimate_contact_state(node1, node2)
-                if contact_state:  # same contact state
-                    # then measure the similarity distance, smaller -> similar
-                    similarity = self.get_pose_similarity(skeleton, node1, node2)
-                    # if DEBUG:
-                    #    print "frame ", i, " frame ", j, " distance: ", similarity_distance
-                    if similarity < self.distance_threshold:
-                        edges[i].append(j)
+        self.n_comparisons = 0
+        temp_dir = tempfile.mkdtemp(prefix="motion_graph_")
+        try:
+            save_node_features(features, temp_dir)
+            del features
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                futures = [executor.submit(find_transitions_in_shard, temp_dir, start, end,
+                                           self.distance_threshold, self.measure_method,
+                                           self.tile_size, index_settings)
+                           for start, end in shards]
+                for idx, future in enumerate(futures):
+                    shard_edges, n_comparisons = future.result()
+                    edges.update(shard_edges)
+                    self.n_comparisons += n_comparisons
+                    if DEBUG:
+                        print('merged shard ', idx + 1, ' of ', len(shards))
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        self.n_skipped_comparisons = n_nodes * n_nodes - self.n_comparisons
+        return edges
+
+    def create_edges_using_candidate_index(self, features):
+        """evaluate the exact distance only for the neighbors found in the candidate index"""
+        index = TransitionCandidateIndex(features, self.distance_threshold,
+                                         self.candidate_dims, self.candidate_radius_scale)
+        edges, self.n_comparisons = find_transitions_using_index(features, index, 0, features.n_nodes - 1,
+                                                                 self.distance_threshold, self.measure_method,
+                                                                 self.tile_size)
         return edges
 
     def find_strongly_connected_components(self, edges):
@@ -254,27 +379,128 @@ class MotionGraphBuilder(object):
 
     def prune_edges(self, edges, node_filter):
         """prune the edge to preserve the strong components' node"""
+        n_ids = max([max(node_filter, default=-1)] + [max(i, max(t, default=-1)) for i, t in edges.items()]) + 1
+        in_filter = np.zeros(n_ids, dtype=bool)
+        in_filter[np.asarray(node_filter, dtype=np.int64)] = True
         for i in list(edges):
-            if i not in node_filter:
+            if not in_filter[i]:
                 # remove edges from this node
                 edges.pop(i, None)
                 continue
-            preseved_list = []
-            #print(i)
-            for j in edges[i]:
-                if j in node_filter:
-                    # remove the item
-                    preseved_list.append(j)
-            edges[i] = preseved_list
+            targets = np.asarray(edges[i], dtype=np.int64)
+            edges[i] = targets[in_filter[targets]].tolist()
         return edges
 
 
+class MGNodeCollection(Mapping):
+    """ read-only dict-like access to the nodes of a MotionGraph
+        the MGNode objects are created on demand as views on the node arrays
+    """
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __getitem__(self, node_id):
+        if not 0 <= node_id < self._graph.n_nodes:
+            raise KeyError(node_id)
+        return self._graph.get_pose_by_node_id(node_id)
+
+    def __iter__(self):
+        return iter(range(self._graph.n_nodes))
+
+    def __len__(self):
+        return self._graph.n_nodes
+
+
+class MGEdgeCollection(Mapping):
+    """ read-only dict-like access to the CSR edges of a MotionGraph
+        only nodes that kept their edges after the pruning are contained
+    """
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __getitem__(self, node_id):
+        if not 0 <= node_id < self._graph.n_nodes or not self._graph.has_edges[node_id]:
+            raise KeyError(node_id)
+        return self._graph.get_edges(node_id)
+
+    def __iter__(self):
+        return iter(np.flatnonzero(self._graph.has_edges).tolist())
+
+    def __len__(self):
+        return int(np.count_nonzero(self._graph.has_edges))
+
+
 class MotionGraph(object):
+    """ stores the nodes as structure of arrays and the edges in compressed sparse row format
+        the edges of node i are edge_indices[edge_indptr[i]:edge_indptr[i+1]]
+    """
     def __init__(self, skeleton, nodes, edges, strong_components):
         self.skeleton = skeleton
-        self.nodes = nodes
-        self.edges = edges
         self.strong_components = strong_components
+        self.set_nodes(nodes)
+        self.set_edges(edges)
+
+    def set_nodes(self, nodes):
+        """ copies the attributes of the MGNode objects with the ids 0 to n-1 into arrays """
+        n_nodes = len(nodes)
+        self.n_nodes = n_nodes
+        self.poses = np.array([nodes[i].pose for i in range(n_nodes)], dtype=np.float64)
+        self.velocities = np.array([nodes[i].velocity for i in range(n_nodes)], dtype=np.float64)
+        self.contacts = np.array([nodes[i].contact for i in range(n_nodes)], dtype=np.float64).reshape((n_nodes, -1))
+        self.motion_ids = np.array([nodes[i].frame_id for i in range(n_nodes)], dtype=np.int64)
+
+    def set_edges(self, edges):
+        """ converts a dict of edge lists into the CSR arrays """
+        counts = np.zeros(self.n_nodes, dtype=np.int64)
+        self.has_edges = np.zeros(self.n_nodes, dtype=bool)
+        for i, targets in edges.items():
+            counts[i] = len(targets)
+            self.has_edges[i] = True
+        self.edge_indptr = np.zeros(self.n_nodes + 1, dtype=np.int64)
+        self.edge_indptr[1:] = np.cumsum(counts)
+        self.edge_indices = np.zeros(self.edge_indptr[-1], dtype=np.int64)
+        for i, targets in edges.items():
+            self.edge_indices[self.edge_indptr[i]:self.edge_indptr[i + 1]] = targets
+
+    @property
+    def nodes(self):
+        return MGNodeCollection(self)
+
+    @property
+    def edges(self):
+        return MGEdgeCollection(self)
+
+    def get_edges(self, node_id):
+        return self.edge_indices[self.edge_indptr[node_id]:self.edge_indptr[node_id + 1]]
+
+    def to_arrays(self):
+        """ returns the node arrays and the CSR edge arrays """
+        arrays = dict()
+        arrays["poses"] = self.poses
+        arrays["velocities"] = self.velocities
+        arrays["contacts"] = self.contacts
+        arrays["motion_ids"] = self.motion_ids
+        arrays["has_edges"] = self.has_edges
+        arrays["edge_indptr"] = self.edge_indptr
+        arrays["edge_indices"] = self.edge_indices
+        arrays["strong_components"] = np.array(self.strong_components, dtype=np.int64)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, skeleton, arrays):
+        """ creates the graph from the result of to_arrays without copying the arrays """
+        graph = cls.__new__(cls)
+        graph.skeleton = skeleton
+        graph.strong_components = arrays["strong_components"].tolist()
+        graph.n_nodes = len(arrays["motion_ids"])
+        graph.poses = arrays["poses"]
+        graph.velocities = arrays["velocities"]
+        graph.contacts = arrays["contacts"]
+        graph.motion_ids = arrays["motion_ids"]
+        graph.has_edges = arrays["has_edges"]
+        graph.edge_indptr = arrays["edge_indptr"]
+        graph.edge_indices = arrays["edge_indices"]
+        return graph
 
     def get_pose_by_trajectory(self, node, last_pose, trj_type, trj_value, direction, orientation):
         pose = np.copy(node.pose)
@@ -289,20 +515,103 @@ class MotionGraph(object):
 
     def sample_next_node_id(self, node_id):
         # here, we find the node based on lowest transition value
-        if len(self.edges[node_id]) <= 0:
+        start = self.edge_indptr[node_id]
+        length = self.edge_indptr[node_id + 1] - start
+        if length <= 0:
             return -1
-        length = len(self.edges[node_id])
         random_index = random.randrange(0, length, 1)
         #random_index = random.randrange(0, 3, 1) #greedy chose from three largest
 
         # prevent local minimum
-        if node_id - self.edges[node_id][random_index] > 0 and node_id - self.edges[node_id][random_index] < 10:
-            return self.edges[node_id][random.randrange(0, length, 1)]
-
-        return self.edges[node_id][random_index]  #0 cause sliding
+        next_node_id = int(self.edge_indices[start + random_index])
+        if 0 < node_id - next_node_id < 10:
+            return int(self.edge_indices[start + random.randrange(0, length, 1)])
+
+        return next_node_id  #0 cause sliding
+
+    def sample_next_node_ids(self, node_ids, rng):
+        """ vectorized version of sample_next_node_id for an array of node ids
+            rng is a numpy RandomState, dead ends and invalid ids result in -1
+        """
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        next_node_ids = np.full(len(node_ids), -1, dtype=np.int64)
+        valid = node_ids >= 0
+        start = self.edge_indptr[node_ids[valid]]
+        length = self.edge_indptr[node_ids[valid] + 1] - start
+        has_edges = length > 0
+        samples = rng.random_sample((2, len(start)))
+        random_index = start + np.minimum((samples[0] * length).astype(np.int64), length - 1)
+        candidates = np.full(len(start), -1, dtype=np.int64)
+        candidates[has_edges] = self.edge_indices[random_index[has_edges]]
+        # prevent local minimum
+        offset = node_ids[valid] - candidates
+        resample = has_edges & (offset > 0) & (offset < 10)
+        if np.any(resample):
+            random_index = start + np.minimum((samples[1] * length).astype(np.int64), length - 1)
+            candidates[resample] = self.edge_indices[random_index[resample]]
+        next_node_ids[valid] = candidates
+        return next_node_ids
 
     def get_pose_by_node_id(self, id):
-        return self.nodes[id]
+        return MGNode(self.poses[id], self.velocities[id], int(self.motion_ids[id]), self.contacts[id])
+
+    def generate_motion_batch(self, trajectory, n_walks, rng=None, start_node_ids=None, out=None):
+        """generate n_walks random walks along a pre-defined trajectory in lockstep
+           rng can be a seed or a numpy RandomState. The walks of different processes are
+           independent when each process uses its own seed.
+           returns the frames with shape (n_walks, n_frames, n_params) and the node ids
+           with shape (n_walks, n_frames). A walk that reaches a dead end repeats its last node.
+        """
+        if not isinstance(rng, np.random.RandomState):
+            rng = np.random.RandomState(rng)
+        n_frames = 0
+        orientation = 0
+        direction = np.zeros(3)
+        if trajectory.getType() == "euler":
+            n_frames = trajectory.getFrame()
+            # compute the translation along the walking direction
+            radian = np.deg2rad(trajectory.getValue()[0])
+            direction = np.array([np.sin(radian), 0, -1 * np.cos(radian)])  # walk toward to [0 0 -1]
+            orientation = -radian
+        n_params = self.poses.shape[1]
+        if out is None:
+            out = np.empty((n_walks, n_frames, n_params))
+        node_ids = np.empty((n_walks, n_frames), dtype=np.int64)
+        if n_frames == 0:
+            return out, node_ids
+        if start_node_ids is None:
+            start_node_ids = np.full(n_walks, min(self.strong_components), dtype=np.int64)
+        node_ids[:, 0] = start_node_ids
+        n_dead_ends = 0
+        for frame_idx in range(1, n_frames):
+            next_node_ids = self.sample_next_node_ids(node_ids[:, frame_idx - 1], rng)
+            dead_ends = next_node_ids < 0
+            n_dead_ends += int(np.count_nonzero(dead_ends & (node_ids[:, frame_idx - 1] >= 0)))
+            next_node_ids[dead_ends] = node_ids[dead_ends, frame_idx - 1]
+            node_ids[:, frame_idx] = next_node_ids
+        if DEBUG and n_dead_ends > 0:
+            print('not find any edge, dead ends: ', n_dead_ends)
+
+        np.take(self.poses, node_ids, axis=0, out=out)
+        # integrate the root translation along the walking direction
+        speeds = np.linalg.norm(self.velocities[node_ids, :3], axis=2)
+        speeds[:, 0] = 0
+        # the graph has no self loops, so a repeated node marks a dead end
+        speeds[:, 1:][node_ids[:, 1:] == node_ids[:, :-1]] = 0
+        distances = np.cumsum(speeds, axis=1)
+        out[:, :, :3] = out[:, :1, :3] + distances[:, :, np.newaxis] * direction
+        rotation = quaternion_from_euler(orientation, 0, 0)
+        root_quats = quaternion_multiply_batch(out[:, :, 3:7], self.velocities[node_ids, 3:7])
+        out[:, :, 3:7] = quaternion_multiply_batch(root_quats, rotation)
+        return out, node_ids
+
+    def generate_motion(self, trajectory, rng=None):
+        """generate motion vector by pre-defined trajectory using a single walk of generate_motion_batch"""
+        frames, node_ids = self.generate_motion_batch(trajectory, 1, rng)
+        out_mv = MotionVector()
+        out_mv.frames = frames[0]
+        out_mv.n_frames = len(frames[0])
+        return out_mv
 
     def generate_motion_old(self, trajectory):
         """generate motion vector by pre-defined trajectory"""
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 DFKI GmbH.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the
+# following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+# NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE
+# USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+On-disk cache for motion graphs. Each graph is stored in a directory named after a hash
+of the input frames, the skeleton and the builder parameters. The directory contains one
+.npy file per array, which can be memory mapped, and a small json file with meta information.
+"""
+import os
+import json
+import glob
+import shutil
+import hashlib
+import numpy as np
+
+CACHE_VERSION = 2
+META_FILE = "meta.json"
+
+
+def get_skeleton_description(skeleton):
+    """ returns the skeleton properties that influence the graph construction as json serializable dict """
+    desc = dict()
+    desc["animated_joints"] = list(skeleton.animated_joints)
+    desc["frame_time"] = float(getattr(skeleton, "frame_time", 0) or 0)
+    desc["nodes"] = dict()
+    for name, node in skeleton.nodes.items():
+        node_desc = dict()
+        node_desc["index"] = int(getattr(node, "index", -1))
+        offset = getattr(node, "offset", None)
+        if offset is not None:
+            node_desc["offset"] = [float(v) for v in offset]
+        node_desc["children"] = [getattr(c, "node_name", str(c)) for c in getattr(node, "children", [])]
+        desc["nodes"][name] = node_desc
+    return desc
+
+
+def get_motion_graph_key(skeleton, motion_vectors, parameters):
+    """ hash of the content of the input frames, the skeleton and the builder parameters
+        needs to be called before the nodes are created because the builder modifies the frames
+    """
+    sha = hashlib.sha1()
+    header = dict()
+    header["version"] = CACHE_VERSION
+    header["parameters"] = parameters
+    header["skeleton"] = get_skeleton_description(skeleton)
+    sha.update(json.dumps(header, sort_keys=True).encode("utf-8"))
+    for mv in motion_vectors:
+        frames = np.ascontiguousarray(mv.frames, dtype=np.float64)
+        sha.update(str(frames.shape).encode("utf-8"))
+        sha.update(frames.tobytes())
+    return sha.hexdigest()
+
+
+def save_graph_arrays(directory, arrays, meta_info=None):
+    """ writes the arrays into a temporary directory first and renames it
+        so that a partially written cache entry is never loaded
+    """
+    if os.path.isdir(directory):
+        return
+    parent_dir = os.path.dirname(os.path.abspath(directory))
+    if not os.path.isdir(parent_dir):
+        os.makedirs(parent_dir)
+    tmp_dir = directory + ".tmp" + str(os.getpid())
+    if os.path.isdir(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, name + ".npy"), np.ascontiguousarray(array))
+    if meta_info is None:
+        meta_info = dict()
+    meta_info["version"] = CACHE_VERSION
+    meta_info["arrays"] = list(arrays.keys())
+    with open(os.path.join(tmp_dir, META_FILE), "wt") as out_file:
+        json.dump(meta_info, out_file)
+    try:
+        os.rename(tmp_dir, directory)
+    except OSError:
+        # another process has written the same entry in the meantime
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def load_graph_arrays(directory, mmap_mode="r"):
+    """ returns the memory mapped arrays and the meta information or None if the entry does not exist """
+    meta_file = os.path.join(directory, META_FILE)
+    if not os.path.isfile(meta_file):
+        return None
+    with open(meta_file, "rt") as in_file:
+        meta_info = json.load(in_file)
+    if meta_info.get("version") != CACHE_VERSION:
+        return None
+    arrays = dict()
+    for name in meta_info["arrays"]:
+        arrays[name] = np.load(os.path.join(directory, name + ".npy"), mmap_mode=mmap_mode)
+    return arrays, meta_info
+
+
+def clear_cache(cache_dir):
+    for directory in glob.glob(os.path.join(cache_dir, "*")):
+        if os.path.isdir(directory):
+            shutil.rmtree(directory, ignore_errors=True)
@@ -52,22 +52,25 @@ class MotionGraphController(ComponentBase, AnimationController):
         self._visualization = SkeletonVisualization(self.scene_object, color)
         self.name = ""
         strong_components = self._motion_graph.strong_components
-        self.current_node_id = min(strong_components)
+        self.start_node_id = min(strong_components)
+        self.current_node_id = self.start_node_id
         self.current_direction = []
         self.current_root_pos = []
         self.current_root_quat = []
         self.angleX = 0
         self.frameTime = 0
         self.animationSpeed = 1
+        # buffers that are reused in every frame
+        self._pose = np.zeros(self._motion_graph.poses.shape[1])
+        self._root_offset = np.zeros(3)
 
     def init_visualization(self):
-        msg_node = self._motion_graph.get_pose_by_node_id(self.current_node_id)
-        pose = np.copy(msg_node.pose)
+        pose = np.copy(self._motion_graph.poses[self.current_node_id])
         self.current_direction = quat_rotate_vector(pose[3:7], np.array([0, 0, 1]))
         self.current_direction[1] = 0 #prevent error accumulation in y axis
-        self.current_root_pos = pose[:3]
+        self.current_root_pos = np.array(pose[:3])
         self.current_root_quat = pose[3:7]
-        self._visualization.updateTransformation(msg_node.pose, self.scene_object.scale_matrix)
+        self._visualization.updateTransformation(pose, self.scene_object.scale_matrix)
 
     def set_skeleton(self, skeleton):
         self._visualization.set_skeleton(skeleton)
@@ -91,25 +94,32 @@ class MotionGraphController(ComponentBase, AnimationController):
             self.animationSpeed = 1
         #for i in range(self.animationSpeed):
 
-        self.current_node_id = self._motion_graph.sample_next_node_id(self.current_node_id)
+        next_node_id = self._motion_graph.sample_next_node_id(self.current_node_id)
+        if next_node_id < 0:
+            # dead end, continue the walk at the start of the strongly connected component
+            print("Warning: node", self.current_node_id, "has no edges, restart from node", self.start_node_id)
+            next_node_id = self.start_node_id
+        self.current_node_id = next_node_id
 
         self.scene_object.scene.global_vars["node_id"] = self.current_node_id
 
-        current_node = self._motion_graph.get_pose_by_node_id(self.current_node_id)
-
-
-        pose = np.copy(current_node.pose)
-        root_velocity = np.linalg.norm(current_node.velocity[:3])
+        # copy the node into the pose buffer instead of allocating a new pose
+        pose = self._pose
+        pose[:] = self._motion_graph.poses[self.current_node_id]
+        velocity = self._motion_graph.velocities[self.current_node_id]
+        root_velocity = math.sqrt(velocity[0] * velocity[0] + velocity[1] * velocity[1] + velocity[2] * velocity[2])
         if (math.isclose(self.angleX, 0.0)): #walking direction remains unchanged
-            self.current_root_pos = self.current_root_pos + root_velocity * self.current_direction
+            np.multiply(self.current_direction, root_velocity, out=self._root_offset)
+            self.current_root_pos += self._root_offset
             pose[:3] = self.current_root_pos
         else:
-            pose[3:7] = quaternion_multiply(pose[3:7], current_node.velocity[3:7])
+            pose[3:7] = quaternion_multiply(pose[3:7], velocity[3:7])
             pose[3:7] = quaternion_multiply(pose[3:7], quaternion_from_euler(self.angleX, 0, 0))
-            self.current_root_quat = pose[3:7]
+            self.current_root_quat = np.array(pose[3:7])
             self.current_direction = quat_rotate_vector(pose[3:7], np.array([0, 0, 1]))
             self.current_direction[1] = 0  # prevent error accumulation in y axis
-            self.current_root_pos = self.current_root_pos + root_velocity * self.current_direction
+            np.multiply(self.current_direction, root_velocity, out=self._root_offset)
+            self.current_root_pos += self._root_offset
             pose[:3] = self.current_root_pos
 
         self._visualization.updateTransformation(pose, self.scene_object.scale_matrix)
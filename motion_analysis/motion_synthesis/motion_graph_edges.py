@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 DFKI GmbH.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the
+# following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+# NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE
+# USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Batched edge construction for the motion similarity graph.
+The node features are packed into contiguous arrays and the distances are evaluated
+in blocks of tile_size x tile_size node pairs so that the peak memory stays bounded.
+"""
+import os
+import numpy as np
+from scipy.spatial.distance import cdist
+
+ROOT_POS_OFFSET = 3
+VELOCITY_WEIGHT = 0.5
+UNDEFINED_CONTACT_STATE = -1
+
+
+FEATURE_ARRAYS = ["quaternions", "velocities", "contact_states", "foot_heights", "motion_ids"]
+
+
+class MGNodeFeatures(object):
+    """ structure of arrays of the node features that are used to find transitions """
+    def __init__(self, quaternions, velocities, contact_states, foot_heights, motion_ids):
+        self.quaternions = quaternions  # n_nodes x n_joints x 4, normalized
+        self.velocities = velocities  # n_nodes x n_velocity_params
+        self.contact_states = contact_states  # n_nodes
+        self.foot_heights = foot_heights  # n_nodes
+        self.motion_ids = motion_ids  # n_nodes
+
+    @property
+    def n_nodes(self):
+        return len(self.motion_ids)
+
+
+def save_node_features(features, directory):
+    """ writes each array into a separate .npy file so that it can be memory mapped """
+    for name in FEATURE_ARRAYS:
+        np.save(os.path.join(directory, name + ".npy"), getattr(features, name))
+
+
+def load_node_features(directory, mmap_mode="r"):
+    arrays = [np.load(os.path.join(directory, name + ".npy"), mmap_mode=mmap_mode) for name in FEATURE_ARRAYS]
+    return MGNodeFeatures(*arrays)
+
+
+def get_joint_quaternion_indices(skeleton):
+    indices = []
+    for joint in skeleton.animated_joints:
+        offset = skeleton.nodes[joint].index * 4 + ROOT_POS_OFFSET
+        indices.append(list(range(offset, offset + 4)))
+    return np.array(indices, dtype=np.int64).reshape((-1, 4))
+
+
+def get_contact_states(contacts):
+    """ vectorized version of MotionGraphBuilder.get_contact_state
+        states that are not covered by the cases are set to UNDEFINED_CONTACT_STATE
+    """
+    contacts = np.asarray(contacts, dtype=np.float64)
+    states = np.full(len(contacts), UNDEFINED_CONTACT_STATE, dtype=np.int8)
+    states[contacts[:, 0] < 0] = 2
+    states[contacts[:, 0] > 0] = 1
+    # the intermediate phase has priority over the other cases
+    states[contacts[:, 0] * contacts[:, 1] < 0] = 0
+    return states
+
+
+def pack_node_features(skeleton, nodes):
+    """ copies the pose, velocity and contact information of the nodes into contiguous arrays
+        nodes is expected to be a dict with the keys 0 to n_nodes-1
+    """
+    n_nodes = len(nodes)
+    quat_indices = get_joint_quaternion_indices(skeleton)
+    n_joints = len(quat_indices)
+    if n_nodes == 0:
+        return MGNodeFeatures(np.zeros((0, n_joints, 4)), np.zeros((0, n_joints * 4 + 3)),
+                              np.zeros(0, dtype=np.int8), np.zeros(0), np.zeros(0, dtype=np.int64))
+    poses = np.array([nodes[i].pose for i in range(n_nodes)], dtype=np.float64)
+    quaternions = np.ascontiguousarray(poses[:, quat_indices])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        quaternions /= np.linalg.norm(quaternions, axis=2)[:, :, np.newaxis]
+    velocities = np.array([nodes[i].velocity for i in range(n_nodes)], dtype=np.float64)
+    contacts = np.array([nodes[i].contact for i in range(n_nodes)], dtype=np.float64)
+    contact_states = get_contact_states(contacts)
+    foot_heights = np.ascontiguousarray(contacts[:, 2])
+    motion_ids = np.array([nodes[i].frame_id for i in range(n_nodes)], dtype=np.int64)
+    return MGNodeFeatures(quaternions, velocities, contact_states, foot_heights, motion_ids)
+
+
+def get_contact_mask(features, rows, cols):
+    """ vectorized version of MotionGraphBuilder.estimate_contact_state for a block of node pairs """
+    state_a = features.contact_states[rows][:, np.newaxis]
+    state_b = features.contact_states[cols][np.newaxis, :]
+    height_a = features.foot_heights[rows][:, np.newaxis]
+    height_b = features.foot_heights[cols][np.newaxis, :]
+    mask = (state_a == 0) | ((state_a == 1) & (height_b > height_a)) | ((state_a == 2) & (height_b < height_a))
+    mask &= state_a == state_b
+    return mask
+
+
+def get_pose_distances(features, rows, cols):
+    """ vectorized version of MotionGraphBuilder.quaternion_distance_between_frames
+        the joints are processed one after another to keep the memory at n_rows x n_cols
+    """
+    qa = features.quaternions[rows]
+    qb = features.quaternions[cols]
+    distances = np.zeros((len(qa), len(qb)))
+    with np.errstate(invalid="ignore"):
+        for joint_idx in range(qa.shape[1]):
+            # the real part of qb * inverse(qa) after normalization
+            angles = np.arccos(np.dot(qa[:, joint_idx], qb[:, joint_idx].T))
+            distances += angles * angles
+    return distances
+
+
+def get_pose_similarities(features, rows, cols, measure_method="motion_field"):
+    """ vectorized version of MotionGraphBuilder.get_pose_similarity """
+    n_rows = len(features.motion_ids[rows])
+    n_cols = len(features.motion_ids[cols])
+    if measure_method != "motion_field":
+        return np.zeros((n_rows, n_cols))
+    distances = get_pose_distances(features, rows, cols)
+    distances += VELOCITY_WEIGHT * cdist(features.velocities[rows], features.velocities[cols])
+    return distances
+
+
+def get_transition_mask(features, rows, cols, distance_threshold, measure_method="motion_field"):
+    """ returns a boolean matrix of the node pairs that have the same contact state
+        and a similarity distance below the threshold
+    """
+    mask = get_contact_mask(features, rows, cols)
+    if np.any(mask):
+        mask &= get_pose_similarities(features, rows, cols, measure_method) < distance_threshold
+    return mask
+
+
+def find_transitions(features, row_start, row_end, distance_threshold, measure_method="motion_field", tile_size=512):
+    """ creates the edge lists for the nodes row_start to row_end
+        The result is identical to comparing all pairs with MotionGraphBuilder.estimate_contact_state
+        and get_pose_similarity: the last node is neither a source nor a target and each list starts
+        with the next frame of the same motion followed by the transitions in ascending order.
+    """
+    n_nodes = features.n_nodes - 1
+    row_end = min(row_end, n_nodes)
+    tile_size = max(1, int(tile_size))
+    edges = dict()
+    for start in range(row_start, row_end, tile_size):
+        end = min(start + tile_size, row_end)
+        rows = slice(start, end)
+        band = np.zeros((end - start, n_nodes), dtype=bool)
+        for col_start in range(0, n_nodes, tile_size):
+            cols = slice(col_start, min(col_start + tile_size, n_nodes))
+            band[:, cols] = get_transition_mask(features, rows, cols, distance_threshold, measure_method)
+        for i in range(start, end):
+            row = band[i - start]
+            row[i] = False  # skip itself and its next
+            if i + 1 < n_nodes:
+                row[i + 1] = False
+            if features.motion_ids[i] == features.motion_ids[i + 1]:
+                edges[i] = [i + 1]
+            else:
+                edges[i] = []
+            edges[i] += np.flatnonzero(row).tolist()
+    return edges
+
+
+def get_pair_similarities(features, a, b, measure_method="motion_field"):
+    """ similarity of the node pairs (a[k], b[k]) as in MotionGraphBuilder.get_pose_similarity """
+    if measure_method != "motion_field":
+        return np.zeros(len(a))
+    with np.errstate(invalid="ignore"):
+        angles = np.arccos(np.einsum("ijk,ijk->ij", features.quaternions[a], features.quaternions[b]))
+    distances = np.sum(angles * angles, axis=1)
+    distances += VELOCITY_WEIGHT * np.linalg.norm(features.velocities[a] - features.velocities[b], axis=1)
+    return distances
+
+
+class TransitionCandidateIndex(object):
+    """ k-d tree over an embedding of the nodes that returns a superset of the transitions of a node.
+        The embedding concatenates the normalized joint quaternions and the velocity scaled by
+        0.5/sqrt(threshold). Because the chord length of two unit quaternions is never larger than
+        their angle, two nodes with a similarity below the threshold are closer than sqrt(threshold)
+        in this space. The embedding is projected onto its n_dims principal axes, which can only
+        shorten distances, so the candidate set stays complete for radius_scale=1.0.
+        A radius_scale below 1.0 trades recall for speed.
+    """
+    def __init__(self, features, distance_threshold, n_dims=16, radius_scale=1.0):
+        from scipy.spatial import cKDTree
+        self.features = features
+        self.radius = np.sqrt(distance_threshold) * radius_scale
+        self.radius *= 1.0 + 1e-9  # keep pairs that lie on the boundary due to rounding
+        n_nodes = features.n_nodes - 1
+        points = self.get_embedding(features, distance_threshold)[:n_nodes]
+        self.projection = self.get_principal_axes(points, n_dims)
+        points = np.dot(points, self.projection)
+        self.points = points
+        self.trees = dict()
+        self.node_ids = dict()
+        for state in (0, 1, 2):
+            # only nodes with the same contact state can be connected
+            ids = np.flatnonzero(features.contact_states[:n_nodes] == state)
+            if len(ids) > 0:
+                self.node_ids[state] = ids
+                self.trees[state] = cKDTree(points[ids])
+
+    @staticmethod
+    def get_embedding(features, distance_threshold):
+        n_nodes = features.n_nodes
+        velocity_scale = VELOCITY_WEIGHT / np.sqrt(distance_threshold)
+        poses = features.quaternions.reshape((n_nodes, -1))
+        embedding = np.hstack([poses, velocity_scale * features.velocities])
+        # invalid quaternions are never accepted by the exact test
+        embedding[~np.isfinite(embedding)] = 0.0
+        return embedding
+
+    @staticmethod
+    def get_principal_axes(points, n_dims):
+        n_params = points.shape[1]
+        if n_dims is None or n_dims >= n_params or len(points) < 2:
+            return np.eye(n_params)
+        centered = points - np.mean(points, axis=0)
+        eigen_values, eigen_vectors = np.linalg.eigh(np.dot(centered.T, centered))
+        return eigen_vectors[:, ::-1][:, :n_dims]
+
+    def query(self, rows):
+        """ returns the candidate pairs of the node ids in rows as two index arrays """
+        rows = np.asarray(rows)
+        pairs_a = []
+        pairs_b = []
+        for state, tree in self.trees.items():
+            state_rows = rows[self.features.contact_states[rows] == state]
+            if len(state_rows) == 0:
+                continue
+            neighbors = tree.query_ball_point(self.points[state_rows], self.radius)
+            for row, candidates in zip(state_rows, neighbors):
+                if len(candidates) > 0:
+                    pairs_a.append(np.full(len(candidates), row, dtype=np.int64))
+                    pairs_b.append(self.node_ids[state][candidates])
+        if len(pairs_a) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate(pairs_a), np.concatenate(pairs_b)
+
+
+def find_transitions_using_index(features, index, row_start, row_end, distance_threshold,
+                                 measure_method="motion_field", tile_size=512):
+    """ creates the same edge lists as find_transitions but evaluates the exact distance
+        only for the candidates returned by the index
+        returns the edges and the number of exact distance evaluations
+    """
+    n_nodes = features.n_nodes - 1
+    row_end = min(row_end, n_nodes)
+    tile_size = max(1, int(tile_size))
+    edges = dict()
+    n_comparisons = 0
+    for start in range(row_start, row_end, tile_size):
+        end = min(start + tile_size, row_end)
+        a, b = index.query(np.arange(start, end))
+        valid = (b != a) & (b != a + 1)
+        a, b = a[valid], b[valid]
+        state = features.contact_states[a]
+        height_a = features.foot_heights[a]
+        height_b = features.foot_heights[b]
+        valid = (state == 0) | ((state == 1) & (height_b > height_a)) | ((state == 2) & (height_b < height_a))
+        a, b = a[valid], b[valid]
+        n_comparisons += len(a)
+        valid = get_pair_similarities(features, a, b, measure_method) < distance_threshold
+        a, b = a[valid], b[valid]
+        order = np.lexsort((b, a))
+        a, b = a[order], b[order]
+        bounds = np.searchsorted(a, np.arange(start, end + 1))
+        for i in range(start, end):
+            if features.motion_ids[i] == features.motion_ids[i + 1]:
+                edges[i] = [i + 1]
+            else:
+                edges[i] = []
+            edges[i] += b[bounds[i - start]:bounds[i - start + 1]].tolist()
+    return edges, n_comparisons
+
+
+def get_row_shards(n_rows, n_shards):
+    """ splits the rows into n_shards contiguous ranges of almost equal size """
+    n_shards = max(1, min(n_shards, n_rows))
+    bounds = np.linspace(0, n_rows, n_shards + 1).astype(np.int64)
+    return [(int(bounds[i]), int(bounds[i + 1])) for i in range(n_shards) if bounds[i] < bounds[i + 1]]
+
+
+_worker_cache = dict()
+
+
+def _get_worker_data(directory, distance_threshold, index_settings):
+    """ loads the memory mapped features once per worker process and keeps them for the following shards """
+    key = (directory, distance_threshold, index_settings)
+    if key not in _worker_cache:
+        _worker_cache.clear()
+        features = load_node_features(directory)
+        index = None
+        if index_settings is not None:
+            n_dims, radius_scale = index_settings
+            index = TransitionCandidateIndex(features, distance_threshold, n_dims, radius_scale)
+        _worker_cache[key] = features, index
+    return _worker_cache[key]
+
+
+def find_transitions_in_shard(directory, row_start, row_end, distance_threshold, measure_method,
+                              tile_size, index_settings=None):
+    """ task function of the worker processes used by MotionGraphBuilder.parallel_build
+        the features are read from the .npy files in directory instead of being pickled
+        returns the edges of the shard and the number of exact distance evaluations
+    """
+    features, index = _get_worker_data(directory, distance_threshold, index_settings)
+    if index is not None:
+        return find_transitions_using_index(features, index, row_start, row_end, distance_threshold,
+                                            measure_method, tile_size)
+    edges = find_transitions(features, row_start, row_end, distance_threshold, measure_method, tile_size)
+    n_comparisons = (min(row_end, features.n_nodes - 1) - row_start) * (features.n_nodes - 1)
+    return edges, n_comparisons
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 DFKI GmbH.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the
+# following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+# NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE
+# USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Background generation of the states that follow the current state of a MorphableGraphStateMachine
+when it is controlled directly, i.e. without a task of the state planner.
+Each look-ahead slot contains one state per likely next node type so that a change of the
+step distance does not require a synchronous generation on the render thread.
+The render thread never waits for the worker. On a miss it holds the last frame and takes the
+state in a later update, while the worker abandons stale work between the generation steps.
+"""
+import threading
+import collections
+import numpy as np
+
+WORKER_WAIT_TIME = 0.05
+
+
+class LookAheadSlot(object):
+    """ states that can follow the source node, one branch per next node type """
+    def __init__(self, source_node, source_node_type):
+        self.source_node = source_node
+        self.source_node_type = source_node_type
+        self.predicted_node_type = None
+        self.branches = dict()
+
+
+class StateLookAhead(object):
+    """ keeps up to depth slots of StateQueueEntry items pre-generated on a background thread.
+        Only the branch of the predicted node type is extended to the next slot.
+        All slots are discarded when the inputs of the controller change.
+    """
+    def __init__(self, controller, depth=2, n_branches=3):
+        self.controller = controller
+        self.depth = depth
+        self.n_branches = n_branches
+        self.slots = collections.deque()
+        self.condition = threading.Condition()
+        self.generation_lock = threading.Lock()
+        self.version = 0
+        self.direction_vector = None
+        self.step_distance = None
+        self.stop_thread = False
+        self.thread = None
+        self.n_hits = 0
+        self.n_misses = 0
+        self.n_discarded = 0
+
+    def start(self):
+        if self.thread is not None or self.depth <= 0:
+            return
+        self.stop_thread = False
+        self.thread = threading.Thread(target=self.run, name="look_ahead")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stop_thread = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def invalidate(self):
+        with self.condition:
+            self.version += 1
+            self.n_discarded += len(self.slots)
+            self.slots.clear()
+            self.condition.notify_all()
+
+    def get_depth(self):
+        with self.condition:
+            return len(self.slots)
+
+    def get_metrics(self):
+        with self.condition:
+            metrics = dict()
+            metrics["look_ahead_depth"] = len(self.slots)
+            metrics["look_ahead_hits"] = self.n_hits
+            metrics["look_ahead_misses"] = self.n_misses
+            metrics["look_ahead_discarded"] = self.n_discarded
+            return metrics
+
+    def _has_same_inputs(self):
+        c = self.controller
+        return self.step_distance == c.target_projection_len and np.allclose(self.direction_vector, c.direction_vector)
+
+    def pop(self, current_node, current_node_type, node_queue, step_distance, accept_changed_inputs=False):
+        """ returns the pre-generated state entry and the remaining node queue or None
+            needs to be called while the lock of the controller is held.
+            accept_changed_inputs is used while the controller waits after a miss, so that steering
+            during the wait does not discard the state that is generated for it.
+        """
+        with self.condition:
+            result = None
+            has_same_inputs = self._has_same_inputs()
+            if len(self.slots) > 0 and (accept_changed_inputs or has_same_inputs) \
+                    and self.slots[0].source_node == current_node and self.slots[0].source_node_type == current_node_type:
+                slot = self.slots.popleft()
+                if len(node_queue) > 0:
+                    next_node_type = node_queue[0][1]
+                else:
+                    next_node_type = self.controller.planner.get_next_node_type(current_node_type, step_distance)
+                if next_node_type in slot.branches:
+                    result = slot.branches[next_node_type]
+                    if next_node_type != slot.predicted_node_type:
+                        # the following slots were generated from a different branch
+                        self.n_discarded += len(self.slots)
+                        self.slots.clear()
+            if result is not None:
+                self.n_hits += 1
+            elif not accept_changed_inputs:
+                self.n_misses += 1
+                if len(self.slots) > 0 or not has_same_inputs:
+                    # restart from the current state of the controller unless the worker is already generating it
+                    self.version += 1
+                    self.n_discarded += len(self.slots)
+                    self.slots.clear()
+            self.condition.notify_all()
+            return result
+
+    def _is_stale(self, version):
+        return self.stop_thread or version != self.version
+
+    def _is_idle(self):
+        c = self.controller
+        return len(self.slots) >= self.depth or c.planner.is_processing or len(c.planner.state_queue) > 0
+
+    def _get_start_point(self, slot):
+        """ returns the node, node type, node queue and pose buffer from which the next slot is generated """
+        if slot is not None:
+            entry, node_queue = slot.branches[slot.predicted_node_type]
+            pose_buffer = [np.array(f) for f in entry.state.get_frames()[-self.controller.buffer_size:]]
+            return entry.node, entry.node_type, node_queue, pose_buffer
+        c = self.controller
+        with c.lock:
+            # the played and grounded poses are used like in the synchronous transition,
+            # followed by the frames of the current state that have not been played yet
+            remaining_frames = c.state.get_frames()[c.state.frame_idx + 1:]
+            pose_buffer = [np.array(f) for f in c.pose_buffer] + [np.array(f) for f in remaining_frames]
+            pose_buffer = pose_buffer[-c.buffer_size:]
+            with self.condition:
+                self.direction_vector = np.array(c.direction_vector)
+                self.step_distance = c.target_projection_len
+            return c.current_node, c.node_type, list(c.node_queue), pose_buffer
+
+    def _get_branch_node_types(self, node_type, node_queue, step_distance):
+        """ returns the predicted node type first followed by the node types of likely changes of the step distance """
+        if len(node_queue) > 0:
+            return [node_queue[0][1]]
+        planner = self.controller.planner
+        node_types = [planner.get_next_node_type(node_type, step_distance)]
+        for d in [0, self.controller.max_step_length]:
+            t = planner.get_next_node_type(node_type, d)
+            if t not in node_types and len(node_types) < self.n_branches:
+                node_types.append(t)
+        return node_types
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.stop_thread and self._is_idle():
+                    self.condition.wait(WORKER_WAIT_TIME)
+                if self.stop_thread:
+                    return
+                version = self.version
+                last_slot = self.slots[-1] if len(self.slots) > 0 else None
+            node, node_type, node_queue, pose_buffer = self._get_start_point(last_slot)
+            with self.condition:
+                if version != self.version:
+                    continue
+                step_distance = self.step_distance
+                direction_vector = np.array(self.direction_vector)
+            slot = LookAheadSlot(node, node_type)
+            is_cancelled = lambda: self._is_stale(version)
+            with self.generation_lock:
+                for next_node_type in self._get_branch_node_types(node_type, node_queue, step_distance):
+                    if is_cancelled():
+                        break
+                    branch = self.controller.generate_state_entry(node, node_type, node_queue, step_distance,
+                                                                  direction_vector, pose_buffer, next_node_type, is_cancelled)
+                    if branch is None:
+                        break
+                    slot.branches[next_node_type] = branch
+                    if slot.predicted_node_type is None:
+                        slot.predicted_node_type = next_node_type
+            with self.condition:
+                if version == self.version and slot.predicted_node_type is not None:
+                    self.slots.append(slot)
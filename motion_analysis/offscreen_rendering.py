@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 DFKI GmbH.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the
+# following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+# NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE
+# USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Renders motions into PNG sequences and contact sheets without a window, e.g. on a server with software OpenGL.
+Each worker process of a TaskScheduler creates one offscreen OpenGL context with EGL or OSMesa,
+one EditorScene and one GraphicsContext and renders the clips one after the other from each camera preset.
+PyOpenGL selects the platform when it is imported for the first time, which already happens when the
+motion_analysis package is imported. So PYOPENGL_PLATFORM has to be set in the environment before Python starts:
+    PYOPENGL_PLATFORM=egl python -m motion_analysis.offscreen_rendering ...
+"""
+import os
+import json
+import time
+import ctypes
+import argparse
+import collections
+import numpy as np
+from .batch_retargeting import TaskScheduler, load_motion_vector, iterate_clip_files, load_skeleton, create_report
+
+BACKENDS = ["egl", "osmesa"]
+PLATFORM_VARIABLE = "PYOPENGL_PLATFORM"
+REPORT_FILE = "render_report.json"
+CAMERA_PRESETS = collections.OrderedDict()
+CAMERA_PRESETS["front"] = {"pitch": -15.0, "yaw": 0.0, "zoom": -500.0, "follow": True}
+CAMERA_PRESETS["side"] = {"pitch": -15.0, "yaw": 90.0, "zoom": -500.0, "follow": True}
+CAMERA_PRESETS["back"] = {"pitch": -15.0, "yaw": 180.0, "zoom": -500.0, "follow": True}
+CAMERA_PRESETS["top"] = {"pitch": -89.0, "yaw": 0.0, "zoom": -800.0, "follow": False}
+
+_render_state = dict()
+
+
+class RenderSettings(object):
+    """ is sent once to each worker process """
+    def __init__(self, skeleton, presets=None, width=320, height=240, backend="egl", frame_step=1,
+                 write_sequence=False, write_sheet=True, n_sheet_frames=12, sheet_columns=4):
+        self.skeleton = skeleton
+        if presets is None:
+            presets = collections.OrderedDict([("front", CAMERA_PRESETS["front"])])
+        self.presets = presets
+        self.width = width
+        self.height = height
+        self.backend = backend
+        self.frame_step = max(1, frame_step)
+        self.write_sequence = write_sequence
+        self.write_sheet = write_sheet
+        self.n_sheet_frames = max(1, n_sheet_frames)
+        self.sheet_columns = max(1, sheet_columns)
+
+
+class OffscreenContext(object):
+    """ OpenGL context that renders into the default framebuffer of an EGL pbuffer or of an OSMesa buffer """
+    def __init__(self, width, height, backend="egl"):
+        self.width = width
+        self.height = height
+        self.backend = backend
+        if backend == "osmesa":
+            self._create_osmesa_context()
+        elif backend == "egl":
+            self._create_egl_context()
+        else:
+            raise ValueError("Unknown backend " + backend)
+
+    def _create_osmesa_context(self):
+        from OpenGL import osmesa, arrays
+        from OpenGL.GL import GL_UNSIGNED_BYTE
+        self.context = osmesa.OSMesaCreateContextExt(osmesa.OSMESA_RGBA, 24, 0, 0, None)
+        if not self.context:
+            raise RuntimeError("Could not create OSMesa context")
+        self.buffer = arrays.GLubyteArray.zeros((self.height, self.width, 4))
+        if not osmesa.OSMesaMakeCurrent(self.context, self.buffer, GL_UNSIGNED_BYTE, self.width, self.height):
+            raise RuntimeError("Could not activate OSMesa context")
+
+    def _create_egl_context(self):
+        from OpenGL import EGL, arrays
+        self.display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+        major, minor = ctypes.c_long(), ctypes.c_long()
+        if not EGL.eglInitialize(self.display, major, minor):
+            raise RuntimeError("Could not initialize EGL display")
+        config_attributes = arrays.GLintArray.asArray([
+            EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+            EGL.EGL_RED_SIZE, 8, EGL.EGL_GREEN_SIZE, 8, EGL.EGL_BLUE_SIZE, 8, EGL.EGL_ALPHA_SIZE, 8,
+            EGL.EGL_DEPTH_SIZE, 24,
+            EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+            EGL.EGL_NONE])
+        configs = (EGL.EGLConfig * 1)()
+        n_configs = ctypes.c_long()
+        if not EGL.eglChooseConfig(self.display, config_attributes, configs, 1, n_configs) or n_configs.value < 1:
+            raise RuntimeError("Could not find EGL config")
+        surface_attributes = arrays.GLintArray.asArray([EGL.EGL_WIDTH, self.width, EGL.EGL_HEIGHT, self.height, EGL.EGL_NONE])
+        self.surface = EGL.eglCreatePbufferSurface(self.display, configs[0], surface_attributes)
+        EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+        self.context = EGL.eglCreateContext(self.display, configs[0], EGL.EGL_NO_CONTEXT, None)
+        if not EGL.eglMakeCurrent(self.display, self.surface, self.surface, self.context):
+            raise RuntimeError("Could not activate EGL context")
+
+    def read_pixels(self):
+        """ returns the content of the framebuffer as RGBA image with the first row at the top """
+        from OpenGL.GL import glFinish, glReadPixels, GL_RGBA, GL_UNSIGNED_BYTE
+        glFinish()
+        data = glReadPixels(0, 0, self.width, self.height, GL_RGBA, GL_UNSIGNED_BYTE)
+        return np.frombuffer(data, dtype=np.uint8).reshape(self.height, self.width, 4)[::-1]
+
+    def destroy(self):
+        if self.backend == "osmesa":
+            from OpenGL import osmesa
+            osmesa.OSMesaDestroyContext(self.context)
+        else:
+            from OpenGL import EGL
+            EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+            EGL.eglDestroySurface(self.display, self.surface)
+            EGL.eglDestroyContext(self.display, self.context)
+            EGL.eglTerminate(self.display)
+
+
+def check_platform(backend):
+    """ raises a RuntimeError if PyOpenGL was not started with the platform of the backend """
+    platform = os.environ.get(PLATFORM_VARIABLE)
+    if platform != backend:
+        raise RuntimeError(PLATFORM_VARIABLE + " is " + str(platform) + " instead of " + backend + ". Set it before starting Python, e.g. "
+                           + PLATFORM_VARIABLE + "=" + backend + " python -m motion_analysis.offscreen_rendering")
+
+
+def _get_render_state(settings):
+    """ creates the context, the scene and the graphics context once per worker process """
+    if "context" not in _render_state:
+        check_platform(settings.backend)
+        from vis_utils.scene.editor_scene import EditorScene
+        from vis_utils.graphics.graphics_context import GraphicsContext
+        _render_state["context"] = OffscreenContext(settings.width, settings.height, settings.backend)
+        _render_state["graphics_context"] = GraphicsContext(settings.width, settings.height, use_frame_buffer=False)
+        _render_state["graphics_context"].resize(settings.width, settings.height)
+        _render_state["scene"] = EditorScene(True)
+    return _render_state["context"], _render_state["graphics_context"], _render_state["scene"]
+
+
+def set_camera_preset(graphics_context, preset, scene_object):
+    camera = graphics_context.camera
+    camera.removeTarget()
+    camera.updateRotationMatrix(preset.get("pitch", 0.0), preset.get("yaw", 0.0))
+    camera.zoom = preset.get("zoom", camera.zoom)
+    if "position" in preset:
+        camera.position[:] = preset["position"]
+    if preset.get("follow", False):
+        camera.setTarget(scene_object)
+
+
+def render_frame(context, graphics_context, scene, controller, frame_idx):
+    from OpenGL.GL import glClear, GL_COLOR_BUFFER_BIT, GL_DEPTH_BUFFER_BIT
+    controller.setCurrentFrameNumber(frame_idx)
+    scene.update(0.0)
+    graphics_context.update(0.0)
+    glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+    graphics_context.render(scene)
+    return context.read_pixels()
+
+
+def create_contact_sheet(images, n_columns):
+    """ returns one image with the images in a grid """
+    height, width = images[0].shape[:2]
+    n_rows = int(np.ceil(len(images) / n_columns))
+    sheet = np.zeros((n_rows * height, n_columns * width, 4), dtype=np.uint8)
+    for idx, image in enumerate(images):
+        row, col = divmod(idx, n_columns)
+        sheet[row * height:(row + 1) * height, col * width:(col + 1) * width] = image
+    return sheet
+
+
+def save_image(image, filename):
+    from PIL import Image
+    directory = os.path.dirname(filename)
+    if directory != "" and not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+    Image.fromarray(image, "RGBA").save(filename)
+
+
+def render_motion(settings, name, motion_vector, out_dir):
+    """ renders the motion from each camera preset and returns the number of written images """
+    context, graphics_context, scene = _get_render_state(settings)
+    o = scene.object_builder.create_object("animation_controller", name, settings.skeleton, motion_vector, motion_vector.frame_time)
+    controller = o._components["animation_controller"]
+    n_frames = controller.getNumberOfFrames()
+    n_images = 0
+    try:
+        for preset_name, preset in settings.presets.items():
+            set_camera_preset(graphics_context, preset, o)
+            if settings.write_sequence:
+                for frame_idx in range(0, n_frames, settings.frame_step):
+                    image = render_frame(context, graphics_context, scene, controller, frame_idx)
+                    save_image(image, os.path.join(out_dir, name, preset_name, "frame_%05d.png" % frame_idx))
+                    n_images += 1
+            if settings.write_sheet:
+                n_sheet_frames = min(settings.n_sheet_frames, n_frames)
+                frame_indices = np.linspace(0, n_frames - 1, n_sheet_frames).astype(int)
+                images = [render_frame(context, graphics_context, scene, controller, idx) for idx in frame_indices]
+                sheet = create_contact_sheet(images, settings.sheet_columns)
+                save_image(sheet, os.path.join(out_dir, name + "_" + preset_name + ".png"))
+                n_images += 1
+    finally:
+        graphics_context.camera.removeTarget()
+        scene.removeObject(o.node_id)
+    return n_frames, n_images
+
+
+def render_clip_task(settings, item, out_dir):
+    """ item is a tuple of the relative output name and the source file """
+    name, filename = item
+    start = time.time()
+    motion_vector = load_motion_vector(filename)
+    load_time = time.time() - start
+    start = time.time()
+    n_frames, n_images = render_motion(settings, name, motion_vector, out_dir)
+    result = dict()
+    result["n_frames"] = n_frames
+    result["n_images"] = n_images
+    result["load_time"] = load_time
+    result["render_time"] = time.time() - start
+    return result
+
+
+def render_db_motion_task(settings, item, out_dir, db_url, is_processed, session):
+    """ item is a tuple of the output name and the id of a motion in the database """
+    from anim_utils.animation_data import MotionVector
+    from .motion_db.client import MotionDBClient
+    name, motion_id = item
+    start = time.time()
+    if "client" not in _render_state:
+        _render_state["client"] = MotionDBClient(db_url, session)
+    motion_data = _render_state["client"].get_motion(motion_id, is_processed)
+    if motion_data is None:
+        raise ValueError("Motion data of " + str(motion_id) + " is empty")
+    motion_vector = MotionVector()
+    motion_vector.from_custom_db_format(motion_data)
+    load_time = time.time() - start
+    start = time.time()
+    n_frames, n_images = render_motion(settings, name, motion_vector, out_dir)
+    result = dict()
+    result["n_frames"] = n_frames
+    result["n_images"] = n_images
+    result["load_time"] = load_time
+    result["render_time"] = time.time() - start
+    return result
+
+
+def _run_render_jobs(settings, items, task_func, task_args, out_dir, n_workers, progress_callback):
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    scheduler = TaskScheduler(settings, task_func, task_args, n_workers, progress_callback, task_name="render motion")
+    start = time.time()
+    results = scheduler.run(items)
+    report = create_report(results, time.time() - start, scheduler.n_workers)
+    report["n_images"] = sum(clip.get("n_images", 0) for clip in report["clips"])
+    with open(os.path.join(out_dir, REPORT_FILE), "wt") as out_file:
+        json.dump(report, out_file, indent=4)
+    print("rendered", report["n_done"], "clips into", report["n_images"], "images in", report["duration"], "s,",
+          report["clips_per_second"], "clips/s,", report["n_failed"], "failed")
+    return report
+
+
+def render_clips_to_directory(settings, clips, out_dir, n_workers=None, progress_callback=None):
+    """ renders the clips given as tuples of name and file in parallel and writes the images and a report into out_dir """
+    return _run_render_jobs(settings, clips, render_clip_task, (out_dir,), out_dir, n_workers, progress_callback)
+
+
+def render_db_motions_to_directory(settings, motions, out_dir, db_url, is_processed=False, session=None, n_workers=None, progress_callback=None):
+    """ renders the motions given as tuples of name and id from the database """
+    task_args = (out_dir, db_url, is_processed, session)
+    return _run_render_jobs(settings, motions, render_db_motion_task, task_args, out_dir, n_workers, progress_callback)
+
+
+def load_camera_presets(names, filename=None):
+    """ returns the presets with the given names from CAMERA_PRESETS or from a json file with a dict of presets """
+    presets = CAMERA_PRESETS
+    if filename is not None:
+        with open(filename, "rt") as in_file:
+            presets = json.load(in_file, object_pairs_hook=collections.OrderedDict)
+    if names is None or len(names) == 0:
+        names = list(presets.keys())[:1]
+    return collections.OrderedDict((name, presets[name]) for name in names)
+
+
+def main():
+    from motion_analysis import constants
+    parser = argparse.ArgumentParser(description="Render bvh or bson files or motions of the database into images without a window.")
+    parser.add_argument("source", help="directory with bvh or bson files, or 'db'")
+    parser.add_argument("skeleton", help="bvh or json file or name of a local, cached or database skeleton")
+    parser.add_argument("out_dir", help="output directory")
+    parser.add_argument("--skeleton_model", default=None, help="name of the local skeleton model of the skeleton")
+    parser.add_argument("--ids", type=int, nargs="*", default=None, help="ids of the motions in the database")
+    parser.add_argument("--collection", type=int, default=None, help="collection id of the motions in the database")
+    parser.add_argument("--processed", action="store_true", help="use the processed motions of the database")
+    parser.add_argument("--presets", nargs="*", default=None, help="names of the camera presets, by default the first one")
+    parser.add_argument("--preset_file", default=None, help="json file with a dict of camera presets")
+    parser.add_argument("--width", type=int, default=320, help="image width")
+    parser.add_argument("--height", type=int, default=240, help="image height")
+    parser.add_argument("--backend", default=os.environ.get(PLATFORM_VARIABLE, "egl"), choices=BACKENDS,
+                        help="offscreen OpenGL platform, has to match " + PLATFORM_VARIABLE + " which is used by default")
+    parser.add_argument("--sequence", action="store_true", help="write a png file per frame")
+    parser.add_argument("--frame_step", type=int, default=1, help="distance between rendered frames of the sequence")
+    parser.add_argument("--no_sheet", action="store_true", help="do not write a contact sheet per clip and preset")
+    parser.add_argument("--sheet_frames", type=int, default=12, help="number of frames on the contact sheet")
+    parser.add_argument("--sheet_columns", type=int, default=4, help="number of columns of the contact sheet")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes, by default the number of cores")
+    parser.add_argument("--url", default=None, help="url of the motion database")
+    args = parser.parse_args()
+    try:
+        check_platform(args.backend)
+    except RuntimeError as e:
+        raise SystemExit("Error: " + str(e))
+    if os.path.isfile(constants.CONFIG_FILE):
+        constants.set_constants_from_file(constants.CONFIG_FILE)
+    db_url = args.url if args.url is not None else constants.DB_URL
+    presets = load_camera_presets(args.presets, args.preset_file)
+    if args.source == "db":
+        from anim_utils.utilities.db_interface import get_motion_list_from_remote_db, load_skeleton_from_db
+        from motion_analysis.session_manager import SessionManager
+        session = SessionManager().session
+        skeleton = load_skeleton_from_db(db_url, args.skeleton, session)
+        if skeleton is None:
+            raise ValueError("Could not find skeleton " + args.skeleton)
+        motions = []
+        if args.collection is not None:
+            motion_list = get_motion_list_from_remote_db(db_url, args.collection, args.skeleton, args.processed, session)
+            if motion_list is not None:
+                motions += [(name, motion_id) for motion_id, name in motion_list]
+        if args.ids is not None:
+            motions += [("motion_" + str(motion_id), motion_id) for motion_id in args.ids]
+        settings = RenderSettings(skeleton, presets, args.width, args.height, args.backend, args.frame_step,
+                                  args.sequence, not args.no_sheet, args.sheet_frames, args.sheet_columns)
+        report = render_db_motions_to_directory(settings, motions, args.out_dir, db_url, args.processed, session, args.workers)
+    else:
+        from motion_analysis.motion_db.cache import get_local_cache
+        skeleton = load_skeleton(args.skeleton, args.skeleton_model, db_url, get_local_cache())
+        settings = RenderSettings(skeleton, presets, args.width, args.height, args.backend, args.frame_step,
+                                  args.sequence, not args.no_sheet, args.sheet_frames, args.sheet_columns)
+        clips = list(iterate_clip_files(args.source))
+        report = render_clips_to_directory(settings, clips, args.out_dir, args.workers)
+    if report["n_failed"] > 0:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 DFKI GmbH.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the
+# following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+# NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE
+# USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Tests of the interval representation of semantic annotations and of the conversion from and to the sections
+of the meta information.
+
+Usage:
+    python -m unittest tests.test_annotation_intervals
+"""
+import copy
+import unittest
+import numpy as np
+from motion_analysis.annotation_intervals import IntervalSet, create_interval_set_from_indices, \
+    create_intervals_from_sections, create_sections_from_intervals, create_annotation_from_intervals, \
+    create_intervals_from_annotation
+
+
+def round_trip(sections, n_frames):
+    """ converts the sections into the annotation format and back like loading and saving a motion """
+    is_list = isinstance(sections, list)
+    annotation = create_annotation_from_intervals(create_intervals_from_sections(sections, n_frames), is_list)
+    annotation = copy.deepcopy(annotation)
+    return create_sections_from_intervals(create_intervals_from_annotation(annotation), annotation.is_list)
+
+
+class IntervalSetTest(unittest.TestCase):
+    def test_add_merges_overlapping_sections(self):
+        s = IntervalSet([(0, 5), (10, 15)])
+        s.add(3, 12)
+        self.assertEqual(list(s), [(0, 15)])
+
+    def test_add_keeps_touching_sections(self):
+        s = IntervalSet([(0, 5)])
+        s.add(5, 10)
+        self.assertEqual(list(s), [(0, 5), (5, 10)])
+        s.add(10, 12, merge_touching=True)
+        self.assertEqual(list(s), [(0, 5), (5, 12)])
+        s.merge_touching_sections()
+        self.assertEqual(list(s), [(0, 12)])
+
+    def test_add_ignores_empty_sections(self):
+        s = IntervalSet()
+        s.add(4, 4)
+        self.assertEqual(len(s), 0)
+
+    def test_remove_splits_section(self):
+        s = IntervalSet([(0, 10)])
+        s.remove(3, 6)
+        self.assertEqual(list(s), [(0, 3), (6, 10)])
+        s.remove(0, 3)
+        self.assertEqual(list(s), [(6, 10)])
+        s.remove(8, 20)
+        self.assertEqual(list(s), [(6, 8)])
+        s.remove(20, 30)
+        self.assertEqual(list(s), [(6, 8)])
+
+    def test_remove_spanning_several_sections(self):
+        s = IntervalSet([(0, 4), (6, 8), (10, 14)])
+        s.remove(2, 12)
+        self.assertEqual(list(s), [(0, 2), (12, 14)])
+
+    def test_find(self):
+        s = IntervalSet([(2, 5), (8, 9)])
+        self.assertIsNone(s.find(1))
+        self.assertEqual(s.find(2), 0)
+        self.assertEqual(s.find(4), 0)
+        self.assertIsNone(s.find(5))
+        self.assertEqual(s.find(8), 1)
+
+    def test_find_closest(self):
+        s = IntervalSet([(2, 5), (10, 12)])
+        self.assertEqual(s.find_closest(3), (0, 0))
+        self.assertEqual(s.find_closest(0), (0, 2))
+        self.assertEqual(s.find_closest(6), (0, 2))
+        self.assertEqual(s.find_closest(8), (1, 2))
+        self.assertEqual(s.find_closest(20), (1, 9))
+        self.assertEqual(IntervalSet().find_closest(3), (None, np.inf))
+
+    def test_frame_indices(self):
+        s = create_interval_set_from_indices([[0, 1, 2, 5, 6], [9]])
+        self.assertEqual(list(s), [(0, 3), (5, 7), (9, 10)])
+        self.assertEqual(s.get_frame_indices(), [0, 1, 2, 5, 6, 9])
+
+
+class SectionsRoundTripTest(unittest.TestCase):
+    def test_dict_sections(self):
+        sections = {"walk": [{"start_idx": 0, "end_idx": 9}, {"start_idx": 10, "end_idx": 19}],
+                    "turn": {"start_idx": 5, "end_idx": 12},
+                    "stand": [{"start_idx": 20, "end_idx": -1}]}
+        self.assertEqual(round_trip(sections, 30), sections)
+
+    def test_list_sections(self):
+        sections = [{"start_idx": 0, "end_idx": 14}, [{"start_idx": 15, "end_idx": -1}]]
+        self.assertEqual(round_trip(sections, 30), sections)
+
+    def test_explicit_last_frame_is_kept(self):
+        sections = {"stand": [{"start_idx": 20, "end_idx": 29}]}
+        self.assertEqual(round_trip(sections, 30), sections)
+
+    def test_plain_annotation_is_saved_as_lists(self):
+        annotation = {"walk": [[0, 1, 2], [5, 6]]}
+        sections = create_sections_from_intervals(create_intervals_from_annotation(annotation))
+        self.assertEqual(sections, {"walk": [{"start_idx": 0, "end_idx": 2}, {"start_idx": 5, "end_idx": 6}]})
+
+
+if __name__ == "__main__":
+    unittest.main()
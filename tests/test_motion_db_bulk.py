@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 DFKI GmbH.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the
+# following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+# NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE
+# USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Measures the throughput of BulkMotionFetcher against the local stub server.
+
+Usage:
+    python -m unittest tests.test_motion_db_bulk
+"""
+import unittest
+from motion_analysis.motion_db.stub_server import StubMotionDBServer, measure_throughput
+from motion_analysis.motion_db.client import MotionDBClient
+from motion_analysis.motion_db.bulk import BulkMotionFetcher
+
+N_MOTIONS = 200
+LATENCY = 0.01
+BATCH_SIZE = 50
+N_WORKERS = 4
+
+
+class BulkFetchTest(unittest.TestCase):
+    def run_server(self, **kwargs):
+        server = StubMotionDBServer(N_MOTIONS, n_frames=10, latency=LATENCY, **kwargs)
+        server.start()
+        self.addCleanup(server.stop)
+        return server
+
+    def test_bulk_request_count(self):
+        bulk_server = self.run_server(enable_bulk=True)
+        _, n_bulk_requests = measure_throughput(bulk_server, BATCH_SIZE, N_WORKERS)
+        single_server = self.run_server(enable_bulk=False)
+        _, n_single_requests = measure_throughput(single_server, BATCH_SIZE, N_WORKERS)
+        self.assertEqual(n_bulk_requests, N_MOTIONS // BATCH_SIZE)
+        # one rejected bulk request and three requests per clip
+        self.assertEqual(n_single_requests, 1 + 3 * N_MOTIONS)
+
+    def test_failed_batch_is_skipped(self):
+        server = self.run_server(enable_bulk=True, failing_ids=[BATCH_SIZE + 1])
+        client = MotionDBClient(server.url)
+        results = BulkMotionFetcher(client, BATCH_SIZE, N_WORKERS).fetch(server.motion_ids)
+        client.close()
+        self.assertEqual(len(results), N_MOTIONS)
+        self.assertIsNone(results[BATCH_SIZE]["motion"])
+        self.assertIsNone(results[BATCH_SIZE]["annotation"])
+        self.assertIsNotNone(results[0]["motion"])
+        self.assertIsNotNone(results[2 * BATCH_SIZE]["motion"])
+
+    def test_failed_item_is_skipped(self):
+        server = self.run_server(enable_bulk=False, failing_ids=[3])
+        client = MotionDBClient(server.url)
+        results = BulkMotionFetcher(client, BATCH_SIZE, N_WORKERS).fetch(server.motion_ids)
+        client.close()
+        self.assertEqual(len(results), N_MOTIONS)
+        self.assertIsNone(results[3]["motion"])
+        self.assertIsNotNone(results[4]["motion"])
+
+
+if __name__ == "__main__":
+    unittest.main()